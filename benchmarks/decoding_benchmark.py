@@ -0,0 +1,68 @@
+"""
+Compares the decoding of whole search responses (json, as the Extractor did) with the projected decoding of the keys
+needed by the ETL (meli.decoding, with msgspec or orjson when installed), and the bytes of the whole responses with
+the ones trimmed with the attributes parameter of the search API.
+Execute from the repository root: `python -m benchmarks.decoding_benchmark`
+"""
+import argparse
+import gc
+import json
+import time
+from typing import Callable, Any, List
+
+import meli.decoding as decoding
+from benchmarks.mock_meli_api import MockMeliApi
+from benchmarks.transformations_benchmark import build_transformer
+from etl.filter.condition import ItemAlreadyStored, NotNewProduct
+from etl.filter.filter import Filter
+
+PAGE_SIZE = 50
+
+
+def required_fields() -> set:
+    # the same keys etl_factory asks the Extractor to decode.
+    item_filter = Filter(conditions=[ItemAlreadyStored(current_day_item_ids=set()), NotNewProduct()])
+    return item_filter.input_keys() | build_transformer(columnar=False).input_keys() | {"id"}
+
+
+def best_time(f: Callable[[bytes], Any], bodies: List[bytes], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.process_time()
+        for body in bodies:
+            f(body)
+        times.append(time.process_time() - t0)
+    return min(times)
+
+
+def main(pages: int, repeat: int) -> None:
+    api = MockMeliApi(total_items=pages * PAGE_SIZE)
+    full = [json.dumps(api.search("iphone", offset, PAGE_SIZE)).encode()
+            for offset in range(0, pages * PAGE_SIZE, PAGE_SIZE)]
+    trimmed = [json.dumps(api.search("iphone", offset, PAGE_SIZE, attributes=["results"])).encode()
+               for offset in range(0, pages * PAGE_SIZE, PAGE_SIZE)]
+    fields = required_fields()
+    full_bytes, trimmed_bytes = sum(map(len, full)), sum(map(len, trimmed))
+    print(f"{pages} search pages of {PAGE_SIZE} results. Decoded keys: {sorted(fields)}")
+    print(f"bytes: {full_bytes} whole, {trimmed_bytes} with attributes=results "
+          f"({100 * (1 - trimmed_bytes / full_bytes):.1f}% less)\n")
+
+    baseline = best_time(lambda body: json.loads(body)["results"], full, repeat)
+    measures = {"json, whole results": baseline,
+                f"{decoding.decoder_name(projected=False)}, whole results": best_time(
+                    lambda body: decoding.decode_search_results(body), trimmed, repeat),
+                f"{decoding.decoder_name()}, projected": best_time(
+                    lambda body: decoding.decode_search_results(body, fields), trimmed, repeat)}
+    print(f"{'decoding':>28} {'CPU time (s)':>13} {'per page (ms)':>14} {'speedup':>8}")
+    for name, t in measures.items():
+        print(f"{name:>28} {t:>13.4f} {1000 * t / pages:>14.3f} {baseline / t:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", help="amount of search pages decoded.", default=200, type=int)
+    parser.add_argument("--repeat", help="repetitions of each measure (the best one is reported).", default=3,
+                        type=int)
+    args = parser.parse_args()
+    main(args.pages, args.repeat)
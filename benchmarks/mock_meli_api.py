@@ -0,0 +1,308 @@
+"""
+Local stand-in of the MeLi API endpoints used by the ETL (search, items, items multiget and currency conversion), so
+Extractor, Transformer and Loader can be measured without the live API. Search results are synthetic, or replayed
+from a recorded search response. Latency, jitter, errors (500) and throttling (429) can be injected.
+Run it alone from the repository root: `python -m benchmarks.mock_meli_api --port 8080`, and point the ETL to it with
+`--api_url http://127.0.0.1:8080`.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional
+from urllib.parse import urlparse, parse_qs
+
+CURRENCY_RATIO = 0.19
+
+
+def synthetic_result(query: str, index: int) -> Dict[str, Any]:
+    """
+    Search result number index of query, with the shape (and about the size) of the search API results. One of every 7
+    items is used (so it is filtered by the ETL), and sellers repeat every 3000 items.
+    """
+    item_id = f"MLB{zlib.crc32(query.encode()) % 10 ** 6:06d}{index:07d}"
+    seller_id = 1000 + index % 3000
+    price = 1000.0 + index % 500
+    return {"id": item_id,
+            "site_id": "MLB",
+            "title": f"{query} {index}",
+            "seller": {"id": seller_id,
+                       "permalink": f"http://perfil.mercadolivre.com.br/SELLER{seller_id}",
+                       "registration_date": "2015-04-20T15:34:51.000-04:00",
+                       "car_dealer": False,
+                       "real_estate_agency": False,
+                       "tags": ["brand", "large_seller", "eshop", "mshops", "credits_profile"],
+                       "seller_reputation": {"power_seller_status": "platinum",
+                                             "level_id": "5_green",
+                                             "metrics": {"cancellations": {"period": "60 days", "rate": 0.0015},
+                                                         "claims": {"period": "60 days", "rate": 0.0081},
+                                                         "delayed_handling_time": {"period": "60 days",
+                                                                                   "rate": 0.0105},
+                                                         "sales": {"period": "60 days",
+                                                                   "completed": index % 3000 * 7}},
+                                             "transactions": {"canceled": 3511, "completed": index % 3000 * 11,
+                                                              "period": "historic",
+                                                              "ratings": {"negative": 0.03, "neutral": 0.02,
+                                                                          "positive": 0.95},
+                                                              "total": index % 3000 * 11 + 3511}}},
+            "price": price,
+            "prices": {"id": item_id,
+                       "prices": [{"id": "1", "type": "standard", "amount": price, "regular_amount": None,
+                                   "currency_id": "BRL", "last_updated": "2022-11-10T14:12:04Z",
+                                   "conditions": {"context_restrictions": [], "start_time": None, "end_time": None,
+                                                  "eligible": True},
+                                   "exchange_rate_context": "DEFAULT", "metadata": {}}],
+                       "presentation": {"display_currency": "BRL"},
+                       "payment_method_prices": [],
+                       "reference_prices": [],
+                       "purchase_discounts": []},
+            "sale_price": None,
+            "currency_id": "BRL",
+            "available_quantity": 50,
+            "sold_quantity": index % 100,
+            "buying_mode": "buy_it_now",
+            "listing_type_id": "gold_special",
+            "stop_time": "2042-10-08T04:00:00.000Z",
+            "condition": "used" if index % 7 == 6 else "new",
+            "permalink": f"https://produto.mercadolivre.com.br/{item_id}",
+            "thumbnail": f"http://http2.mlstatic.com/D_{index}-I.jpg",
+            "thumbnail_id": f"{index}-MLA0000000000_112022",
+            "accepts_mercadopago": True,
+            "installments": {"quantity": 12, "amount": round(price / 12, 2), "rate": 0, "currency_id": "BRL"},
+            "address": {"state_id": "BR-SP", "state_name": "São Paulo", "city_id": "BR-SP-44",
+                        "city_name": "São Paulo"},
+            "shipping": {"free_shipping": True, "mode": "me2",
+                         "tags": ["fulfillment", "self_service_in"] if index % 3 else [],
+                         "logistic_type": "fulfillment", "store_pick_up": False},
+            "seller_address": {"id": "", "comment": "", "address_line": "", "zip_code": "",
+                               "country": {"id": "BR", "name": "Brasil"},
+                               "state": {"id": "BR-SP", "name": "São Paulo"},
+                               "city": {"id": "BR-SP-44", "name": "São Paulo"},
+                               "latitude": "", "longitude": ""},
+            "attributes": [{"id": attribute_id, "name": attribute_id.title(), "value_id": str(1000 + i),
+                            "value_name": value, "attribute_group_id": "OTHERS", "attribute_group_name": "Outros",
+                            "value_struct": None, "values": [{"id": str(1000 + i), "name": value, "struct": None,
+                                                              "source": 1505}],
+                            "source": 1505, "value_type": "string"}
+                           for i, (attribute_id, value) in enumerate([("BRAND", "Apple"), ("MODEL", "11"),
+                                                                      ("COLOR", "Preto"), ("ITEM_CONDITION", "Novo"),
+                                                                      ("LINE", "iPhone"), ("MEMORY", "64 GB")])],
+            "original_price": None,
+            "category_id": "MLB1055",
+            "official_store_id": None,
+            "domain_id": "MLB-CELLPHONES",
+            "catalog_product_id": f"MLB{15149561 + index % 40}",
+            "tags": ["good_quality_picture", "immediate_payment", "cart_eligible", "best_seller_candidate"],
+            "catalog_listing": True,
+            "use_thumbnail_id": True,
+            "offer_score": None,
+            "offer_share": None,
+            "match_score": None,
+            "winner_item_id": None,
+            "melicoin": None,
+            "discounts": None,
+            "order_backend": index % 50 + 1}
+
+
+AVAILABLE_FILTERS = [{"id": filter_id, "name": filter_id.title(), "type": "text",
+                      "values": [{"id": f"{filter_id}{i}", "name": f"{filter_id} {i}", "results": 1000 - i}
+                                 for i in range(20)]}
+                     for filter_id in ["category", "state", "price", "brand", "model", "shipping", "condition"]]
+
+
+def read_recorded_results(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads the results of a recorded search response (the JSON body of the search API), or a JSON list of results.
+    """
+    with open(path, encoding="utf-8") as file:
+        payload = json.load(file)
+    return payload["results"] if isinstance(payload, dict) else payload
+
+
+class MockMeliApi:
+    """
+    MeLi API stand-in, served by a thread of the current process. Every query has total_items results. With recorded
+    results, they are replayed cyclically (ids get a suffix after the first cycle, so they stay unique). Responses carry
+    the ETag of their body, and requests with a matching If-None-Match header get a 304 response without body.
+    Attributes
+    ----------
+    total_items: int
+        amount of search results of every query.
+    latency: float
+        seconds added to every response.
+    jitter: float
+        max seconds added to (or subtracted from) the latency of every response, uniformly distributed.
+    error_rate: float
+        fraction of requests answered with a 500 response.
+    throttle_rate: float
+        fraction of requests answered with a 429 response (with Retry-After: 0).
+    recorded_results: Optional[List[Dict[str, Any]]]
+        if defined, search results replayed instead of the synthetic ones.
+    seed: int
+        seed of the latency and error injection.
+    """
+
+    def __init__(self, total_items: int = 1000, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, recorded_results: Optional[List[Dict[str, Any]]] = None, seed: int = 0,
+                 host: str = "127.0.0.1", port: int = 0) -> None:
+        self.total_items = total_items
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.recorded_results = recorded_results
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.not_modified = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockMeliApi":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-meli-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "MockMeliApi":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def _result(self, query: str, index: int) -> Dict[str, Any]:
+        if not self.recorded_results:
+            return synthetic_result(query, index)
+        cycle, position = divmod(index, len(self.recorded_results))
+        result = dict(self.recorded_results[position])
+        if cycle:
+            result["id"] = f"{result['id']}{cycle}"
+        return result
+
+    def search(self, query: str, offset: int, limit: int, attributes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        :param attributes: if defined, only these top level keys of the response are included (as the attributes
+        parameter of the search API).
+        """
+        results = [self._result(query, index) for index in range(offset, min(offset + limit, self.total_items))]
+        payload = {"site_id": "MLB", "query": query,
+                   "paging": {"total": self.total_items, "primary_results": self.total_items, "offset": offset,
+                              "limit": limit},
+                   "results": results, "sort": {"id": "relevance", "name": "Mais relevantes"},
+                   "available_sorts": [{"id": "price_asc", "name": "Menor preço"},
+                                       {"id": "price_desc", "name": "Maior preço"}],
+                   "filters": [], "available_filters": AVAILABLE_FILTERS}
+        return {key: value for key, value in payload.items() if key in attributes} if attributes else payload
+
+    @staticmethod
+    def item(item_id: str, attributes: Optional[List[str]] = None) -> Dict[str, Any]:
+        body = {"id": item_id, "warranty": "Sem garantia" if item_id.endswith(("0", "4", "8")) else "12 meses",
+                "condition": "new", "status": "active"}
+        return {key: value for key, value in body.items() if key in attributes} if attributes else body
+
+    def _injected_fault(self) -> Optional[int]:
+        with self._lock:
+            self.requests += 1
+            draw = self._random.random()
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)) if self.jitter else \
+                self.latency
+            status = 500 if draw < self.error_rate else 429 if draw < self.error_rate + self.throttle_rate else None
+            if status == 500:
+                self.errors += 1
+            elif status == 429:
+                self.throttled += 1
+        if delay:
+            time.sleep(delay)
+        return status
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def _send(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+                body = json.dumps(payload).encode()
+                if status == 200:
+                    # responses are revalidated with the ETag of their body, as the API does.
+                    headers = {**(headers or {}), "ETag": f'"{zlib.crc32(body):08x}"'}
+                    if self.headers.get("If-None-Match") == headers["ETag"]:
+                        with api._lock:
+                            api.not_modified += 1
+                        self.send_response(304)
+                        self.send_header("ETag", headers["ETag"])
+                        self.end_headers()
+                        return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                fault = api._injected_fault()
+                if fault == 429:
+                    return self._send(429, {"message": "too many requests", "status": 429}, {"Retry-After": "0"})
+                if fault == 500:
+                    return self._send(500, {"message": "internal server error", "status": 500})
+
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                attributes = params["attributes"].split(",") if "attributes" in params else None
+                if url.path.startswith("/sites/") and url.path.endswith("/search"):
+                    return self._send(200, api.search(params.get("q", ""), int(params.get("offset", 0)),
+                                                      int(params.get("limit", 50)), attributes))
+                if url.path == "/items":
+                    return self._send(200, [{"code": 200, "body": api.item(item_id, attributes)}
+                                            for item_id in params.get("ids", "").split(",") if item_id])
+                if url.path.startswith("/items/"):
+                    return self._send(200, api.item(url.path[len("/items/"):], attributes))
+                if url.path.startswith("/currency_conversions/search"):
+                    return self._send(200, {"ratio": CURRENCY_RATIO, "mercado_pago_ratio": CURRENCY_RATIO})
+                self._send(404, {"message": f"resource {url.path} not found", "status": 404})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="port of the API stand-in.", default=8080, type=int)
+    parser.add_argument("--total_items", help="amount of search results of every query.", default=1000, type=int)
+    parser.add_argument("--latency", help="seconds added to every response.", default=0.0, type=float)
+    parser.add_argument("--jitter", help="max seconds added to or subtracted from the latency.", default=0.0,
+                        type=float)
+    parser.add_argument("--error_rate", help="fraction of 500 responses.", default=0.0, type=float)
+    parser.add_argument("--throttle_rate", help="fraction of 429 responses.", default=0.0, type=float)
+    parser.add_argument("--payloads", help="recorded search response (JSON) to replay.", default=None, type=str)
+    args = parser.parse_args()
+
+    api = MockMeliApi(total_items=args.total_items, latency=args.latency, jitter=args.jitter,
+                      error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                      recorded_results=read_recorded_results(args.payloads) if args.payloads else None,
+                      port=args.port)
+    print(f"MeLi API stand-in listening on {api.url}")
+    try:
+        api._server.serve_forever()
+    except KeyboardInterrupt:
+        api._server.server_close()
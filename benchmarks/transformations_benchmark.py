@@ -0,0 +1,109 @@
+"""
+Compares the per item (dict) transformation path of Transformer with the columnar one (Transformation.apply_batch),
+and the three separate batch generators with the single pass FusedBatchGenerator.
+Execute from the repository root: `python -m benchmarks.transformations_benchmark`
+"""
+import argparse
+import gc
+import time
+from typing import List, Dict, Any, Callable
+
+from etl.cleaner.data_cleaner import DataCleaner
+from etl.data_batch_generators.data_batch_generator import SellersBatchGenerator, ShippingBatchGenerator, \
+    ProductsBatchGenerator, FusedBatchGenerator
+from etl.transformations.transformations import HandleNoWarrantyString, PriceConverter, InsertSellerID, \
+    InsertSellerCompletedSales, ShippingMethods
+from etl.transformer import Transformer
+
+
+def synthetic_items(n: int) -> List[Dict[str, Any]]:
+    """
+    Items with the shape of the search API results (after the warranty enrichment), including keys that the cleaner
+    drops.
+    """
+    return [{"id": f"MLB{i}",
+             "title": f"Iphone 11 {i}",
+             "condition": "new",
+             "price": 1000.0 + i % 500,
+             "sold_quantity": i % 100,
+             "warranty": "Sem garantia" if i % 4 == 0 else "12 meses",
+             "seller": {"id": i % 3000,
+                        "seller_reputation": {"metrics": {"sales": {"completed": i % 3000 * 7}}}},
+             "shipping": {"tags": ["fulfillment", "self_service_in"] if i % 3 else []},
+             "attributes": [{"id": "BRAND", "value_name": "Apple"}, {"id": "MODEL", "value_name": "11"}],
+             "installments": {"quantity": 12, "amount": 100.0},
+             "thumbnail": f"http://http2.mlstatic.com/{i}.jpg"}
+            for i in range(n)]
+
+
+def build_transformer(columnar: bool, fused: bool = False) -> Transformer:
+    return Transformer(
+        transformations=[HandleNoWarrantyString(no_warranty_strings=["Sem garantia"]),
+                         PriceConverter(currency_factor=0.19),
+                         InsertSellerID(),
+                         InsertSellerCompletedSales(),
+                         ShippingMethods()],
+        preprocessed_data_cleaner=DataCleaner(relevant_keys=(["id", "title", "sold_quantity", "shipping",
+                                                              "price", "warranty", "seller_id", "completed_sales"])),
+        sellers_generator=SellersBatchGenerator(),
+        shipping_generator=ShippingBatchGenerator(),
+        products_generator=ProductsBatchGenerator(drop_keys=["shipping"]),
+        sellers_filter=None,
+        columnar=columnar,
+        fused_generator=FusedBatchGenerator(drop_keys=["shipping"]) if fused else None)
+
+
+def best_time(f: Callable[[List[Dict[str, Any]]], Any], n: int, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        items = synthetic_items(n)  # transformations modify the items in place.
+        gc.collect()
+        gc.disable()  # as timeit does, so collections of the synthetic items don't add noise.
+        try:
+            t0 = time.perf_counter()
+            f(items)
+            times.append(time.perf_counter() - t0)
+        finally:
+            gc.enable()
+    return min(times)
+
+
+def transformations_only(transformer: Transformer) -> Callable[[List[Dict[str, Any]]], Any]:
+    if transformer.columnar:
+        return transformer._transform_columnar
+
+    def per_item(items: List[Dict[str, Any]]) -> None:
+        for atribs in items:
+            transformer._apply_transformations(atribs)
+            transformer._clean_raw(atribs)
+    return per_item
+
+
+def main(sizes: List[int], repeat: int) -> None:
+    per_item, columnar = build_transformer(columnar=False), build_transformer(columnar=True)
+    print(f"{'items':>8} {'per item (s)':>13} {'columnar (s)':>13} {'speedup':>8}   (transformations and cleaning)")
+    for n in sizes:
+        t_item = best_time(transformations_only(per_item), n, repeat)
+        t_col = best_time(transformations_only(columnar), n, repeat)
+        print(f"{n:>8} {t_item:>13.4f} {t_col:>13.4f} {t_item / t_col:>7.2f}x")
+
+    configs = {"per item": build_transformer(columnar=False),
+               "columnar": build_transformer(columnar=True),
+               "per item, fused": build_transformer(columnar=False, fused=True),
+               "columnar, fused": build_transformer(columnar=True, fused=True)}
+    print(f"\n{'items':>8} {'transformer':>16} {'time (s)':>9} {'speedup':>8}   (whole Transformer.transform)")
+    for n in sizes:
+        baseline = None
+        for name, transformer in configs.items():
+            t = best_time(transformer.transform, n, repeat)
+            baseline = baseline or t
+            print(f"{n:>8} {name:>16} {t:>9.4f} {baseline / t:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", help="amounts of items.", default=[10_000, 100_000], type=int, nargs="+")
+    parser.add_argument("--repeat", help="repetitions of each measure (the best one is reported).", default=3,
+                        type=int)
+    args = parser.parse_args()
+    main(args.sizes, args.repeat)
@@ -7,25 +7,110 @@ for handler in logging.root.handlers[:]:
     logging.root.removeHandler(handler)
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
-from etl.etl_factory import etl_factory
+from etl.etl_factory import etl_factory, etl_components, replay_factory
+from etl.daemon import EtlDaemon, WarmEtl, read_schedule, DEFAULT_INTERVAL
+from etl.pipeline_spec import PipelineSpec, read_pipeline_spec
+from etl.replay import ArchiveReplayer
+from database.aggregates import BestSellerRankings
+from database.migrations import migrate_timestamps, migrate_shipping_methods, migrate_unique_keys, \
+    partition_tables
+from meli.api_client import API_URL
+from etl.loader import reset_profilers
+from utils.time_profilers import set_raw_metrics
+from utils.tracing import tracer, span
+from database.job_queue import JobQueue
+from etl.multi_query import MultiQueryRunner, read_queries
+from etl.worker import EtlWorker, default_worker_id
+from etl.pipeline import StreamingPipeline
+from etl.extractor import Extractor
+from etl.loader import Loader
+from etl.transformer import Transformer
+import signal
 import time
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, Session
 import argparse
+from datetime import date
+from typing import Optional, List, Callable
 
 
-def create_database(drop_existing: bool) -> None:
+def create_database(drop_existing: bool, partitions: bool = False) -> None:
     if drop_existing:
         logging.warning("All data in the database will be deleted.")
         Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine, checkfirst=True)
+    migrate_timestamps(engine)
+    migrate_shipping_methods(engine)
+    migrate_unique_keys(engine)
+    # tables partitioned by a previous run get the partitions of the next months anyway.
+    partition_tables(engine, migrate=partitions)
 
 
 def _main(query: str, max_items: int,
-          exclude_seller_id: int, _session: Session) -> None:
+          exclude_seller_id: int, _session: Session,
+          concurrency: Optional[int] = None, cache_path: Optional[str] = None,
+          batch_size: Optional[int] = None, columnar: bool = False,
+          item_index_path: Optional[str] = None, upsert: bool = False, chunk_size: int = 1000,
+          spool_dir: Optional[str] = None, queries: Optional[List[str]] = None, query_workers: int = 4,
+          resume: bool = False, adaptive_concurrency: bool = False,
+          max_requests_per_second: Optional[float] = None, api_url: str = API_URL,
+          record_dir: Optional[str] = None, project_payloads: bool = True, aggregates: bool = True,
+          pipeline_spec: Optional[PipelineSpec] = None, compact_items: bool = False) -> None:
 
-    extractor, transformer, loader = etl_factory(session=_session)
+    # metrics of each run are summarized apart.
+    reset_profilers()
 
+    if resume:
+        # batches of an interrupted run may have been loaded before their checkpoint, so they are upserted.
+        batch_size, upsert = batch_size or 200, upsert or not spool_dir
+
+    components = etl_components(session=_session, max_concurrent_requests=concurrency,
+                                cache_path=cache_path, columnar=columnar,
+                                item_index_path=item_index_path, upsert=upsert,
+                                chunk_size=chunk_size, spool_dir=spool_dir,
+                                adaptive_concurrency=adaptive_concurrency,
+                                max_requests_per_second=max_requests_per_second,
+                                api_url=api_url, record_dir=record_dir,
+                                project_payloads=project_payloads, aggregates=aggregates,
+                                pipeline_spec=pipeline_spec, compact_items=compact_items)
+    extractor, transformer, loader = components.extractor, components.transformer, components.loader
+
+    try:
+        t0 = time.time()
+        if queries:
+            logging.info(
+                f"Running {len(queries)} queries with {query_workers} workers, excluding seller_id {exclude_seller_id} "
+                f"and max_items {max_items} per query... \n"
+                f"--------------------------------------------------------------------------------------------------")
+            MultiQueryRunner(extractor, transformer, loader, session_factory=sessionmaker(_session.get_bind()),
+                             max_workers=query_workers).run(queries=queries, exclude_seller_id=exclude_seller_id,
+                                                            max_items=max_items)
+            logging.info(f"Finished! Time: {round(time.time() - t0, 2)} seconds")
+            return
+
+        _run(extractor, transformer, loader, query=query, max_items=max_items, exclude_seller_id=exclude_seller_id,
+             batch_size=batch_size, checkpoint_session_factory=sessionmaker(_session.get_bind()) if resume else None)
+    finally:
+        # the archive of the run is completed, and the cache, index and connections are released (workers run many
+        # jobs).
+        components.close()
+
+
+def _run(extractor: Extractor, transformer: Transformer, loader: Loader, query: str, max_items: int,
+         exclude_seller_id: int, batch_size: Optional[int] = None,
+         checkpoint_session_factory: Optional[Callable[[], Session]] = None) -> None:
     t0 = time.time()
+    if batch_size:
+        logging.info(
+            f"Streaming {query} in batches of {batch_size} items, excluding seller_id {exclude_seller_id} and "
+            f"max_items {max_items}... \n"
+            f"--------------------------------------------------------------------------------------------------")
+        StreamingPipeline(extractor, transformer, loader, batch_size=batch_size,
+                          checkpoint_session_factory=checkpoint_session_factory).run(
+            query=query, max_items=max_items, exclude_seller_id=exclude_seller_id)
+        logging.info(f"Finished! Time: {round(time.time() - t0, 2)} seconds")
+        return
+
     # Extract
     logging.info(
         f"Getting raw data for {query}, excluding seller_id {exclude_seller_id} and max_items {max_items}... \n"
@@ -41,25 +126,247 @@ def _main(query: str, max_items: int,
     # Load
     logging.info("Loading new data into Database... \n"
                  "------------------------------------")
-    loader.load(item_list_transformed, sellers, item_shippings)
+    loader.load(item_list_transformed, sellers, item_shippings, query=query)
 
     logging.info(f"Finished! Time: {round(time.time() - t0, 2)} seconds")
 
 
+def _daemon(schedule_file: str, max_items: int, exclude_seller_id: int, _session: Session,
+            control_port: Optional[int] = None, interval: float = DEFAULT_INTERVAL, currency_ttl: float = 3600.0,
+            concurrency: Optional[int] = None, cache_path: Optional[str] = None,
+            batch_size: Optional[int] = None, columnar: bool = False,
+            item_index_path: Optional[str] = None, upsert: bool = False, chunk_size: int = 1000,
+            spool_dir: Optional[str] = None, resume: bool = False, adaptive_concurrency: bool = False,
+            max_requests_per_second: Optional[float] = None, api_url: str = API_URL,
+            record_dir: Optional[str] = None, project_payloads: bool = True, aggregates: bool = True,
+            pipeline_spec: Optional[PipelineSpec] = None, compact_items: bool = False) -> None:
+    if resume:
+        logging.warning("Runs of the daemon are not checkpointed: --resume is ignored.")
+    schedule = read_schedule(schedule_file, max_items=max_items, exclude_seller_id=int(exclude_seller_id),
+                             interval=interval)
+    components = etl_components(session=_session, max_concurrent_requests=concurrency,
+                                cache_path=cache_path, columnar=columnar,
+                                item_index_path=item_index_path, upsert=upsert,
+                                chunk_size=chunk_size, spool_dir=spool_dir,
+                                adaptive_concurrency=adaptive_concurrency,
+                                max_requests_per_second=max_requests_per_second,
+                                api_url=api_url, record_dir=record_dir,
+                                project_payloads=project_payloads, aggregates=aggregates,
+                                pipeline_spec=pipeline_spec, compact_items=compact_items)
+    daemon = EtlDaemon(schedule, WarmEtl(components, currency_ttl=currency_ttl),
+                       run_query=lambda s: _run(components.extractor, components.transformer, components.loader,
+                                                query=s.query, max_items=s.max_items,
+                                                exclude_seller_id=s.exclude_seller_id, batch_size=batch_size),
+                       control_port=control_port)
+    # the current run is finished before stopping.
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        logging.warning("Daemon interrupted.")
+    finally:
+        components.close()
+
+
+def _replay(paths: List[str], _session: Session, batch_size: Optional[int] = None, columnar: bool = False,
+            chunk_size: int = 1000, spool_dir: Optional[str] = None, aggregates: bool = True,
+            pipeline_spec: Optional[PipelineSpec] = None, compact_items: bool = False) -> None:
+    reset_profilers()
+    transformer_factory, loader = replay_factory(session=_session, columnar=columnar, chunk_size=chunk_size,
+                                                 spool_dir=spool_dir, aggregates=aggregates,
+                                                 pipeline_spec=pipeline_spec, compact_items=compact_items)
+    logging.info(f"Replaying recorded runs of {', '.join(paths)}... \n"
+                 f"--------------------------------------------------------------------------------------------------")
+    ArchiveReplayer(transformer_factory, loader, batch_size=batch_size or 1000).replay(paths)
+
+
+def _ranking(ranking: str, rankings: BestSellerRankings, day: Optional[date] = None, query: Optional[str] = None,
+             limit: int = 10, days: int = 1) -> None:
+    day = day or rankings.today()
+    title = f"{ranking} of {f'the {days} days up to ' if days > 1 else ''}{day}" \
+            f"{f' for {query}' if query is not None else ''}"
+    if ranking == "sellers":
+        lines = [f"{'rank':>4}  {'seller_id':>12}  {'items':>6}  {'sold_quantity':>13}"]
+        lines += [f"{rank:>4}  {r.seller_id:>12}  {r.items:>6}  {r.sold_quantity:>13}"
+                  for rank, r in enumerate(rankings.top_sellers(day, query, limit=limit, days=days), start=1)]
+    elif ranking == "prices":
+        stats = rankings.price_stats(day, query, days=days)
+        lines = [f"{'items':>6}  {'sold_quantity':>13}  {'avg (USD)':>10}  {'min (USD)':>10}  {'max (USD)':>10}"]
+        if stats:
+            lines.append(f"{stats.items:>6}  {stats.sold_quantity:>13}  {stats.price_avg:>10.2f}  "
+                         f"{stats.price_min:>10.2f}  {stats.price_max:>10.2f}")
+    else:
+        lines = [f"{'shipping_method':<30}  {'items':>6}  {'share':>6}"]
+        lines += [f"{s.shipping_method or '(none)':<30}  {s.items:>6}  {100 * s.share:>5.1f}%"
+                  for s in rankings.shipping_mix(day, query, days=days)]
+    if len(lines) == 1:
+        lines.append("no items were loaded.")
+    logging.info(f"Best seller {title}:\n" + "\n".join(lines))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--query", help="request products filtered by name. For example: 'Iphone 11'", default="Iphone 11")
-    parser.add_argument("--max_items", help="maximum amount of products to be requested.", default=200)
+    parser.add_argument("--max_items", help="maximum amount of products to be requested.", default=200, type=int)
     parser.add_argument("--exclude_seller_id", help="This is the client seller id. "
                                                     "Products published by the client will be omitted.", default=82916233)
     parser.add_argument("--new_db", help="If true, all current data stored in the local database will be deleted.",
                         default="false", type=str2bool)
+    parser.add_argument("--partitions", help="If true, on MySQL, items, item_shipping and sellers are partitioned by "
+                                             "month (existing tables are rebuilt, which may take a while). "
+                                             "Partitions of the next months are added to partitioned tables on every "
+                                             "run.", default="false", type=str2bool)
+    parser.add_argument("--concurrency", help="If defined, search pages are requested concurrently, with at most "
+                                              "this amount of requests in flight.", default=None, type=int)
+    parser.add_argument("--cache_path", help="If defined, MeLi API responses (item attributes, currency conversion) "
+                                             "are cached in this SQLite file and reused by later runs.", default=None)
+    parser.add_argument("--batch_size", help="If defined, items are extracted, transformed and loaded in streaming "
+                                             "batches of this size, so memory doesn't depend on max_items.",
+                        default=None, type=int)
+    parser.add_argument("--columnar", help="If true, transformations are applied to whole columns of the items "
+                                           "instead of item by item.", default="false", type=str2bool)
+    parser.add_argument("--item_index_path", help="If defined, the ids of the items stored in the current day are "
+                                                  "kept in this memory-mapped file, so later runs of the same day "
+                                                  "don't read them from the database.", default=None)
+    parser.add_argument("--upsert", help="If true, each batch is loaded in a single transaction with bulk upserts, "
+                                         "so rerunning a load is safe.", default="false", type=str2bool)
+    parser.add_argument("--chunk_size", help="Max amount of rows per upsert statement.", default=1000, type=int)
+    parser.add_argument("--spool_dir", help="If defined, batches are written into this directory and bulk loaded "
+                                            "from there (LOAD DATA on MySQL). Batches that couldn't be loaded are "
+                                            "kept and loaded by a later run.", default=None)
+    parser.add_argument("--queries_file", "--queries-file", help="If defined, every query of this file (one per line) "
+                                                                 "is processed in the same run, instead of --query.",
+                        default=None)
+    parser.add_argument("--query_workers", help="Max amount of queries of --queries_file processed at the same time.",
+                        default=4, type=int)
+    parser.add_argument("--resume", help="If true, the progress of the run is checkpointed in the database, and a run "
+                                         "of the same query that failed halfway is resumed from its last checkpoint. "
+                                         "Items are streamed (see --batch_size).", default="false", type=str2bool)
+    parser.add_argument("--adaptive_concurrency", help="If true, the requests in flight to each MeLi API endpoint are "
+                                                       "adapted to its latency and its 429 and error responses.",
+                        default="false", type=str2bool)
+    parser.add_argument("--max_requests_per_second", help="If defined, max rate of requests to MeLi API.",
+                        default=None, type=float)
+    parser.add_argument("--api_url", help="Base url of MeLi API. It can be changed to use a stand-in of the API "
+                                          "(see benchmarks/mock_meli_api.py).", default=API_URL, type=str)
+    parser.add_argument("--project_payloads", help="If true, only the keys of the search results needed by the ETL are "
+                                                   "decoded (faster with msgspec or orjson installed).",
+                        default="true", type=str2bool)
+    parser.add_argument("--record_dir", help="If defined, the raw responses of MeLi API are recorded in a compressed "
+                                             "archive of this directory (one per run), to be replayed later.",
+                        default=None, type=str)
+    parser.add_argument("--replay", help="Archives (or directories of archives) recorded with --record_dir. Their items "
+                                         "are transformed and loaded again, without requests.",
+                        default=None, type=str, nargs="+")
+    parser.add_argument("--aggregates", help="If true, the best seller aggregates (top sellers, price statistics and "
+                                             "shipping methods of each day and query) are updated by every load.",
+                        default="true", type=str2bool)
+    parser.add_argument("--ranking", help="If defined, this best seller ranking is read from the aggregates and "
+                                          "logged, instead of running the ETL.", default=None,
+                        choices=["sellers", "prices", "shipping"])
+    parser.add_argument("--ranking_day", help="Last day of the ranking (YYYY-MM-DD). By default, today.",
+                        default=None, type=date.fromisoformat)
+    parser.add_argument("--ranking_days", help="Amount of days of the ranking, up to --ranking_day.", default=1,
+                        type=int)
+    parser.add_argument("--ranking_query", help="If defined, only the items found by this query are ranked.",
+                        default=None, type=str)
+    parser.add_argument("--ranking_limit", help="Amount of sellers of the sellers ranking.", default=10, type=int)
+    parser.add_argument("--pipeline_spec", help="If defined, the filter conditions, transformations and kept keys of "
+                                                "the ETL are read from this JSON or YAML spec (see README), instead of "
+                                                "the default ones.", default=None, type=str)
+    parser.add_argument("--compact_items", help="If true, transformed items are kept in compact column batches (typed "
+                                                "arrays and a single buffer of strings) until they are loaded, instead "
+                                                "of one dict per item.", default="false", type=str2bool)
+    parser.add_argument("--raw_metrics", help="If true, besides their summaries, every request and insert time is stored "
+                                              "(request_metrics and database_metrics tables).",
+                        default="false", type=str2bool)
+    parser.add_argument("--trace_file", help="If defined, the run is traced (nested spans of stages, batches and "
+                                             "requests) and the trace is written to this file in Chrome trace format.",
+                        default=None, type=str)
+    parser.add_argument("--enqueue", help="If true, --query (or every query of --queries_file) is added to the jobs "
+                                          "queue, to be processed by workers, instead of being processed.",
+                        default="false", type=str2bool)
+    parser.add_argument("--worker", help="If true, the process works as a worker of the jobs queue: it claims and "
+                                         "processes jobs until it's idle for --idle_timeout seconds.",
+                        default="false", type=str2bool)
+    parser.add_argument("--lease_seconds", help="Lease duration of the jobs claimed by a worker.", default=300.0,
+                        type=float)
+    parser.add_argument("--poll_interval", help="Seconds between two claims of a worker, when there aren't jobs.",
+                        default=5.0, type=float)
+    parser.add_argument("--idle_timeout", help="If defined, a worker stops after this amount of seconds without jobs.",
+                        default=None, type=float)
+    parser.add_argument("--schedule_file", help="If defined, the process runs as a daemon: every query of this JSON "
+                                                "schedule is run periodically, reusing connections and known items "
+                                                "and sellers between runs (see README).", default=None, type=str)
+    parser.add_argument("--schedule_interval", help="Seconds between two runs of the queries of --schedule_file that "
+                                                    "don't define their interval.", default=3600.0, type=float)
+    parser.add_argument("--control_port", help="If defined, the daemon serves a control endpoint on this port of "
+                                               "localhost (GET /status, POST /run?query=..., POST /stop).",
+                        default=None, type=int)
+    parser.add_argument("--currency_ttl", help="Seconds the daemon reuses the currency factor before requesting it "
+                                               "again.", default=3600.0, type=float)
 
     args = parser.parse_args()
 
     session = sessionmaker(engine)()
 
-    create_database(drop_existing=args.new_db)
+    try:
+        create_database(drop_existing=args.new_db, partitions=args.partitions)
+    except OperationalError as ex:
+        # spooled runs go on without the database (see --spool_dir), unless it had to be recreated.
+        if not args.spool_dir or args.new_db:
+            raise
+        logging.warning(f"Couldn't connect to the database, batches will be kept in {args.spool_dir}: {ex}")
+    set_raw_metrics(args.raw_metrics)
+
+    etl_options = dict(concurrency=args.concurrency, cache_path=args.cache_path, batch_size=args.batch_size,
+                       columnar=args.columnar, item_index_path=args.item_index_path,
+                       upsert=args.upsert, chunk_size=args.chunk_size, spool_dir=args.spool_dir,
+                       resume=args.resume, adaptive_concurrency=args.adaptive_concurrency,
+                       max_requests_per_second=args.max_requests_per_second, api_url=args.api_url,
+                       record_dir=args.record_dir, project_payloads=args.project_payloads,
+                       aggregates=args.aggregates,
+                       pipeline_spec=read_pipeline_spec(args.pipeline_spec) if args.pipeline_spec else None,
+                       compact_items=args.compact_items)
+
+    if args.trace_file:
+        tracer.enable()
 
-    _main(query=args.query, max_items=args.max_items,
-          exclude_seller_id=args.exclude_seller_id, _session=session)
+    try:
+        with span("run", query=args.query, max_items=args.max_items, queries_file=args.queries_file,
+                  batch_size=args.batch_size):
+            if args.ranking:
+                _ranking(args.ranking, BestSellerRankings(sessionmaker(engine)), day=args.ranking_day,
+                         query=args.ranking_query, limit=args.ranking_limit, days=args.ranking_days)
+            elif args.enqueue:
+                queries = read_queries(args.queries_file) if args.queries_file else [args.query]
+                enqueued = JobQueue(session, worker_id=default_worker_id()).enqueue(
+                    queries, max_items=args.max_items, exclude_seller_id=int(args.exclude_seller_id))
+                logging.info(f"{enqueued} jobs enqueued.")
+            elif args.replay:
+                _replay(args.replay, session, batch_size=args.batch_size, columnar=args.columnar,
+                        chunk_size=args.chunk_size, spool_dir=args.spool_dir, aggregates=args.aggregates,
+                        pipeline_spec=etl_options["pipeline_spec"], compact_items=args.compact_items)
+            elif args.schedule_file:
+                _daemon(args.schedule_file, max_items=args.max_items, exclude_seller_id=args.exclude_seller_id,
+                        _session=session, control_port=args.control_port, interval=args.schedule_interval,
+                        currency_ttl=args.currency_ttl, **etl_options)
+            elif args.worker:
+                # workers may find the same items at the same time, so they are loaded with upserts.
+                etl_options["upsert"] = etl_options["upsert"] or not args.spool_dir
+                EtlWorker(session_factory=sessionmaker(engine),
+                          run_job=lambda job, job_session: _main(query=job.query, max_items=job.max_items,
+                                                                 exclude_seller_id=job.exclude_seller_id,
+                                                                 _session=job_session, **etl_options),
+                          lease_seconds=args.lease_seconds, poll_interval=args.poll_interval,
+                          idle_timeout=args.idle_timeout).run()
+            else:
+                _main(query=args.query, max_items=args.max_items,
+                      exclude_seller_id=args.exclude_seller_id, _session=session, **etl_options,
+                      queries=read_queries(args.queries_file) if args.queries_file else None,
+                      query_workers=args.query_workers)
+    finally:
+        if args.trace_file:
+            spans, dropped = tracer.export(args.trace_file)
+            logging.info(f"{spans} spans were written to {args.trace_file}"
+                         f"{f' ({dropped} were dropped)' if dropped else ''}.")
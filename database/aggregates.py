@@ -0,0 +1,219 @@
+"""
+Best seller aggregates: top sellers by sold quantity, price statistics and shipping methods mix of the items loaded each
+day, by query. They are updated incrementally by every load (see DatabaseClient.update_best_seller_aggregates), so
+rankings are read from a few small rows instead of grouping the whole items history.
+"""
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Type, Optional, Callable, Hashable
+
+from sqlalchemy import func, desc
+from sqlalchemy.orm import Session
+
+from database.models import DailySellerSales, DailyPriceStats, DailyShippingMethods
+from database.models.columns import local_now
+
+QUERY_MAX_LENGTH = DailyPriceStats.__table__.c.query.type.length
+
+_version = 0
+_version_lock = threading.Lock()
+
+
+def invalidate_rankings() -> None:
+    """
+    Makes every BestSellerRankings of the process discard its cached results. Called once a load updated the
+    aggregates.
+    """
+    global _version
+    with _version_lock:
+        _version += 1
+
+
+def aggregate_batch(day: date, query: Optional[str], items: List[Dict[str, Any]],
+                    item_shipping: List[Dict[str, Any]]) -> Dict[Type, List[Dict[str, Any]]]:
+    """
+    Aggregates the products and item_shipping objects of a batch into rows of each aggregate table, to be added to
+    the stored ones.
+    """
+    query = (query or "")[:QUERY_MAX_LENGTH]
+    sellers: Dict[int, Dict[str, Any]] = {}
+    for item in items:
+        if item.get("seller_id") is None:
+            continue
+        row = sellers.get(item["seller_id"])
+        if row is None:
+            row = sellers[item["seller_id"]] = {"day": day, "query": query, "seller_id": item["seller_id"],
+                                                "items": 0, "sold_quantity": 0}
+        row["items"] += 1
+        row["sold_quantity"] += item["sold_quantity"] or 0
+
+    prices = [item["price"] for item in items if item.get("price") is not None]
+    price_stats = [{"day": day, "query": query, "items": len(prices),
+                    "sold_quantity": sum(item["sold_quantity"] or 0 for item in items if item.get("price") is not None),
+                    "price_sum": sum(prices), "price_min": min(prices), "price_max": max(prices)}] if prices else []
+
+    methods = Counter(s.get("shipping_method") or "" for s in item_shipping)
+    shipping_methods = [{"day": day, "query": query, "shipping_method": method, "items": count}
+                        for method, count in methods.items()]
+
+    return {DailySellerSales: list(sellers.values()),
+            DailyPriceStats: price_stats,
+            DailyShippingMethods: shipping_methods}
+
+
+@dataclass(frozen=True)
+class SellerRank:
+    seller_id: int
+    items: int
+    sold_quantity: int
+
+
+@dataclass(frozen=True)
+class PriceStats:
+    items: int
+    sold_quantity: int
+    price_avg: float
+    price_min: float
+    price_max: float
+
+
+@dataclass(frozen=True)
+class ShippingShare:
+    shipping_method: Optional[str]
+    items: int
+    share: float
+
+
+class BestSellerRankings:
+    """
+    Queries over the best seller aggregates. Results are kept in an LRU cache, which is invalidated whenever a load of
+    this process updates the aggregates (loads of other processes are seen once the cached results are evicted, or the
+    process restarts).
+    Attributes
+    ----------
+    session_factory: Callable[[], Session]
+        builds the session of each query (so rankings can be shared by threads, and they never read an old snapshot).
+    cache_size: int
+        max amount of results cached.
+    hits: int
+        queries answered from the cache.
+    misses: int
+        queries sent to the database.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], cache_size: int = 128) -> None:
+        self.session_factory = session_factory
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._version = _version
+        self._lock = threading.Lock()
+        self._clock_offset: Optional[timedelta] = None
+
+    def today(self) -> date:
+        """
+        :return: current day of the database server, the day of the aggregates loaded now. Its clock is read once: its
+        offset from the clock of this host (for instance, another timezone) is kept.
+        """
+        if self._clock_offset is None:
+            session = self.session_factory()
+            try:
+                self._clock_offset = session.query(local_now()).scalar() - datetime.now()
+            finally:
+                session.close()
+        return (datetime.now() + self._clock_offset).date()
+
+    def _cached(self, key: Hashable, compute: Callable[[Session], Any]) -> Any:
+        with self._lock:
+            if self._version != _version:
+                self._cache.clear()
+                self._version = _version
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+            version = self._version
+
+        session = self.session_factory()
+        try:
+            result = compute(session)
+        finally:
+            session.close()
+
+        with self._lock:
+            # results computed while a load updated the aggregates might be stale already.
+            if version == _version == self._version:
+                self._cache[key] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _filter(q, model: Type, day: date, days: int, query: Optional[str]):
+        q = q.filter(model.day > day - timedelta(days=days), model.day <= day)
+        if query is not None:
+            q = q.filter(model.query == query)
+        return q
+
+    def top_sellers(self, day: Optional[date] = None, query: Optional[str] = None, limit: int = 10,
+                    days: int = 1) -> List[SellerRank]:
+        """
+        Sellers with the highest sold quantity.
+        :param day: last day of the ranking (by default, today in the database, see today).
+        :param query: if defined, only the items found by this query are ranked (by default, items of every query).
+        :param days: amount of days ranked, up to day.
+        """
+        day = day or self.today()
+
+        def compute(session: Session) -> List[SellerRank]:
+            sold_quantity = func.sum(DailySellerSales.sold_quantity).label("sold_quantity")
+            q = session.query(DailySellerSales.seller_id, func.sum(DailySellerSales.items), sold_quantity)
+            q = self._filter(q, DailySellerSales, day, days, query)
+            q = q.group_by(DailySellerSales.seller_id).order_by(desc(sold_quantity), DailySellerSales.seller_id)
+            return [SellerRank(seller_id=seller_id, items=int(items), sold_quantity=int(sold))
+                    for seller_id, items, sold in q.limit(limit)]
+
+        return list(self._cached(("top_sellers", day, query, limit, days), compute))
+
+    def price_stats(self, day: Optional[date] = None, query: Optional[str] = None,
+                    days: int = 1) -> Optional[PriceStats]:
+        """
+        Price statistics (in USD) of the items. Parameters as in top_sellers.
+        :return: None if there aren't items.
+        """
+        day = day or self.today()
+
+        def compute(session: Session) -> Optional[PriceStats]:
+            q = session.query(func.sum(DailyPriceStats.items), func.sum(DailyPriceStats.sold_quantity),
+                              func.sum(DailyPriceStats.price_sum), func.min(DailyPriceStats.price_min),
+                              func.max(DailyPriceStats.price_max))
+            items, sold, price_sum, price_min, price_max = self._filter(q, DailyPriceStats, day, days, query).one()
+            if not items:
+                return None
+            return PriceStats(items=int(items), sold_quantity=int(sold), price_avg=price_sum / items,
+                              price_min=price_min, price_max=price_max)
+
+        return self._cached(("price_stats", day, query, days), compute)
+
+    def shipping_mix(self, day: Optional[date] = None, query: Optional[str] = None,
+                     days: int = 1) -> List[ShippingShare]:
+        """
+        Shipping methods of the items, most frequent first, with their share of the items and shipping methods
+        (an item can have several methods). Parameters as in top_sellers.
+        """
+        day = day or self.today()
+
+        def compute(session: Session) -> List[ShippingShare]:
+            items = func.sum(DailyShippingMethods.items).label("items")
+            q = session.query(DailyShippingMethods.shipping_method, items)
+            q = self._filter(q, DailyShippingMethods, day, days, query)
+            rows = q.group_by(DailyShippingMethods.shipping_method).order_by(desc(items)).all()
+            total = sum(count for _, count in rows)
+            return [ShippingShare(shipping_method=method or None, items=int(count), share=count / total)
+                    for method, count in rows]
+
+        return list(self._cached(("shipping_mix", day, query, days), compute))
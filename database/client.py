@@ -1,12 +1,55 @@
-from datetime import date
-from typing import List, Dict, Any, Tuple
+import logging
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from typing import List, Dict, Any, Tuple, Iterator, Sequence, Type, Optional, Set, Collection
 
-from sqlalchemy import func
+from sqlalchemy import func, text, tuple_, Table, distinct, inspect
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
-from database.models import Item, ItemShipping, Seller, RequestMetrics, DatabaseMetrics, ProcessMetrics
+from database.aggregates import aggregate_batch
+from database.migrations import partitioned_tables
+from database.models import Item, ItemShipping, Seller, RequestMetrics, RequestCounterMetrics, DatabaseMetrics, \
+    ProcessMetrics, MetricSummaries, DailySellerSales, DailyPriceStats, DailyShippingMethods
+from database.models.columns import local_now
+from database.spool import Spool, read_table_file, read_columns
 from utils.decorators import _time_profiling
-from utils.time_profilers import InsertItemsTimeProfiler, InsertItemsShippingTimeProfiler, InsertSellersTimeProfiler
+from utils.time_profilers import InsertItemsTimeProfiler, InsertItemsShippingTimeProfiler, InsertSellersTimeProfiler, \
+    UpdateAggregatesTimeProfiler
+from utils.useful import chunked
+
+# natural keys (unique constraints) used for detecting rows that are already stored, and columns updated in that case.
+ITEM_CONFLICT_KEYS, ITEM_UPDATE_COLUMNS = ["id"], ["seller_id", "title", "sold_quantity", "price", "warranty",
+                                                    "created_at"]
+ITEM_SHIPPING_CONFLICT_KEYS = ["item_id", "shipping_method"]
+SELLER_CONFLICT_KEYS = ["seller_id", "completed_sales"]
+# keys of the aggregate tables, and columns merged with their min / max instead of being summed.
+AGGREGATE_KEYS = {DailySellerSales: ["day", "query", "seller_id"],
+                  DailyPriceStats: ["day", "query"],
+                  DailyShippingMethods: ["day", "query", "shipping_method"]}
+AGGREGATE_MIN_COLUMNS, AGGREGATE_MAX_COLUMNS = ["price_min"], ["price_max"]
+# MySQL errors of a LOAD DATA LOCAL INFILE refused by the server (1148, 3948) or the client (2068), since local_infile
+# is disabled by default.
+LOAD_DATA_REFUSED_ERRORS = {1148, 3948, 2068}
+
+
+def day_range(day: date) -> Tuple[datetime, datetime]:
+    """
+    :return: start of the day and of the next one, for filtering timestamps with a range that indexes can use.
+    """
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def _values(objects: Sequence[Dict[str, Any]], key: str) -> List[Any]:
+    # compact batches (etl.transformations.item_batch.ItemBatch) read a single column, without building their dicts.
+    return objects.column(key) if hasattr(objects, "column") else [o[key] for o in objects]
+
+
+def _take(objects: Sequence[Dict[str, Any]], indices: List[int]) -> Sequence[Dict[str, Any]]:
+    return objects.take(indices) if hasattr(objects, "take") else [objects[i] for i in indices]
 
 
 class DatabaseClient:
@@ -20,26 +63,303 @@ class DatabaseClient:
 
     def __init__(self, session: Session) -> None:
         self._session = session
+        self._in_transaction = False
+        self._partitioned_tables: Optional[Set[str]] = None
+        self._unique_keys: Set[str] = set()
+        self._load_data_refused = False
 
-    @_time_profiling(InsertItemsTimeProfiler)
-    def insert_items(self, objects: List[Dict[str, Any]]) -> None:
-        self._session.bulk_insert_mappings(mapper=Item, mappings=objects)
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Every insert made inside the context is committed once, at the end (or rolled back if anything fails).
+        """
+        self._in_transaction = True
+        try:
+            yield
+            self._session.commit()
+        except BaseException:
+            self._session.rollback()
+            raise
+        finally:
+            self._in_transaction = False
+
+    def _partitioned(self, table: Table) -> bool:
+        """
+        Partitioned tables (MySQL only, see database.migrations) don't have unique keys for their natural keys.
+        """
+        if self._partitioned_tables is None:
+            self._partitioned_tables = partitioned_tables(self._session.connection()) \
+                if self._session.get_bind().dialect.name == "mysql" else set()
+        return table.name in self._partitioned_tables
+
+    def _check_unique_key(self, table: Table, keys: Sequence[str]) -> None:
+        """
+        Upserts of tables that aren't partitioned rely on a unique key of their natural keys. Tables created by older
+        versions lack it until they are migrated (see database.migrations.migrate_unique_keys), and rows would be
+        inserted again instead of updated.
+        """
+        if table.name in self._unique_keys:
+            return
+        inspector = inspect(self._session.connection())
+        unique = [inspector.get_pk_constraint(table.name)["constrained_columns"]] + \
+            [c["column_names"] for c in inspector.get_unique_constraints(table.name)] + \
+            [i["column_names"] for i in inspector.get_indexes(table.name) if i["unique"]]
+        if set(keys) not in [set(columns) for columns in unique]:
+            raise RuntimeError(f"{table.name} lacks the unique key ({', '.join(keys)}) that upserts rely on: run "
+                               f"create_database (best_seller.py) to migrate it.")
+        self._unique_keys.add(table.name)
+
+    @staticmethod
+    def _updates(table: Table, new: Any, update_columns: Sequence[str], columns: Collection[str]) -> Dict[str, Any]:
+        # columns that aren't inserted (timestamps) get their server default, as if the row was inserted again.
+        return {c: new[c] if c in columns else table.c[c].server_default.arg for c in update_columns}
+
+    def _delete_stored(self, table: Table, rows: List[Dict[str, Any]], keys: Sequence[str]) -> None:
+        stored = tuple_(*[table.c[k] for k in keys]).in_([tuple(row[k] for k in keys) for row in rows]) \
+            if len(keys) > 1 else table.c[keys[0]].in_([row[keys[0]] for row in rows])
+        self._session.execute(table.delete().where(stored))
+
+    def _upsert(self, model: Type, objects: List[Dict[str, Any]], conflict_keys: Sequence[str],
+                update_columns: Sequence[str], chunk_size: int) -> None:
+        """
+        Inserts the objects in chunks of chunk_size rows. Rows whose conflict_keys are already stored are updated
+        instead (only the update_columns, or nothing if there aren't any), so loading the same data twice is safe.
+        Supports MySQL (INSERT ... ON DUPLICATE KEY UPDATE) and SQLite (INSERT ... ON CONFLICT DO UPDATE). The stored
+        rows of partitioned tables are replaced instead, since their natural keys aren't unique keys.
+        """
+        table = model.__table__
+        columns = [c.name for c in table.columns]
+        dialect = self._session.get_bind().dialect.name
+        if not (dialect == "mysql" and self._partitioned(table)):
+            self._check_unique_key(table, conflict_keys)
+        for chunk in chunked(objects, chunk_size):
+            rows = [{c: o[c] for c in columns if c in o} for o in chunk]
+            inserted = set().union(*rows)
+            if dialect == "mysql" and self._partitioned(table):
+                self._delete_stored(table, rows, conflict_keys)
+                stmt = mysql.insert(table).values(rows)
+            elif dialect == "mysql":
+                stmt = mysql.insert(table).values(rows)
+                # MySQL needs at least one column; updating a key column with its own value does nothing.
+                stmt = stmt.on_duplicate_key_update(self._updates(table, stmt.inserted,
+                                                                  update_columns or conflict_keys[:1], inserted))
+            elif dialect == "sqlite":
+                stmt = sqlite.insert(table).values(rows)
+                if update_columns:
+                    stmt = stmt.on_conflict_do_update(index_elements=conflict_keys,
+                                                      set_=self._updates(table, stmt.excluded, update_columns,
+                                                                         inserted))
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=conflict_keys)
+            else:
+                raise NotImplementedError(f"Upserts are not supported for the {dialect} dialect.")
+            self._session.execute(stmt)
         self.session_commit()
 
-    @_time_profiling(InsertItemsShippingTimeProfiler)
-    def insert_item_shipping(self, objects: List[Dict[str, Any]]) -> None:
-        self._session.bulk_insert_mappings(mapper=ItemShipping, mappings=objects)
+    def _accumulate(self, model: Type, rows: List[Dict[str, Any]], keys: Sequence[str], chunk_size: int) -> None:
+        """
+        Adds rows of partial aggregates into the stored ones: rows whose keys are already stored get their columns
+        summed (or merged with their min / max, see AGGREGATE_MIN_COLUMNS). Supports MySQL and SQLite, as _upsert.
+        """
+        table = model.__table__
+        dialect = self._session.get_bind().dialect.name
+        if dialect == "mysql":
+            least, greatest = func.least, func.greatest
+        elif dialect == "sqlite":
+            # min and max with several arguments are scalar functions in SQLite.
+            least, greatest = func.min, func.max
+        else:
+            raise NotImplementedError(f"Aggregates are not supported for the {dialect} dialect.")
+
+        def merge(column: str, new: Any) -> Any:
+            if column in AGGREGATE_MIN_COLUMNS:
+                return least(table.c[column], new)
+            if column in AGGREGATE_MAX_COLUMNS:
+                return greatest(table.c[column], new)
+            return table.c[column] + new
+
+        for chunk in chunked(rows, chunk_size):
+            columns = [c for c in chunk[0] if c not in keys]
+            if dialect == "mysql":
+                stmt = mysql.insert(table).values(chunk)
+                stmt = stmt.on_duplicate_key_update({c: merge(c, stmt.inserted[c]) for c in columns})
+            else:
+                stmt = sqlite.insert(table).values(chunk)
+                stmt = stmt.on_conflict_do_update(index_elements=keys,
+                                                  set_={c: merge(c, stmt.excluded[c]) for c in columns})
+            self._session.execute(stmt)
+        self.session_commit()
+
+    def get_item_ids_stored_on(self, day: date, ids: List[str], chunk_size: int = 1000) -> Set[str]:
+        """
+        :return: the ids (of the given ones) of the items stored on that day.
+        """
+        start, end = day_range(day)
+        stored = set()
+        for chunk in chunked(ids, chunk_size):
+            rows = self._session.query(Item.id).filter(Item.id.in_(chunk), Item.created_at >= start,
+                                                       Item.created_at < end)
+            stored.update(row.id for row in rows)
+        return stored
+
+    @_time_profiling(UpdateAggregatesTimeProfiler)
+    def update_best_seller_aggregates(self, day: date, query: Optional[str], items: Sequence[Dict[str, Any]],
+                                      item_shipping: Sequence[Dict[str, Any]], skip_stored: bool = True,
+                                      chunk_size: int = 1000) -> int:
+        """
+        Adds a batch of products and item_shipping objects into the best seller aggregates of a day.
+        :param skip_stored: if True, items already stored on that day are left out, since they were aggregated by the
+        load that stored them (for instance, when a batch is upserted again). It must be called before storing the
+        batch.
+        :return: amount of items aggregated.
+        """
+        if skip_stored:
+            ids = _values(items, "id")
+            stored = self.get_item_ids_stored_on(day, ids, chunk_size)
+            if stored:
+                items = _take(items, [i for i, item_id in enumerate(ids) if item_id not in stored])
+                item_shipping = _take(item_shipping, [i for i, item_id in enumerate(_values(item_shipping, "item_id"))
+                                                      if item_id not in stored])
+        for model, rows in aggregate_batch(day, query, items, item_shipping).items():
+            if rows:
+                self._accumulate(model, rows, AGGREGATE_KEYS[model], chunk_size)
+        return len(items)
+
+    def _bulk_insert(self, model: Type, objects: Sequence[Dict[str, Any]], chunk_size: Optional[int]) -> None:
+        # sequences that build their dicts when they are read (like compact item batches) only build one chunk at once.
+        for chunk in chunked(objects, chunk_size) if chunk_size else [objects]:
+            self._session.bulk_insert_mappings(mapper=model, mappings=chunk)
         self.session_commit()
 
+    @_time_profiling(InsertItemsTimeProfiler)
+    def insert_items(self, objects: Sequence[Dict[str, Any]], chunk_size: Optional[int] = None) -> None:
+        self._bulk_insert(Item, objects, chunk_size)
+
+    @_time_profiling(InsertItemsShippingTimeProfiler)
+    def insert_item_shipping(self, objects: Sequence[Dict[str, Any]], chunk_size: Optional[int] = None) -> None:
+        self._bulk_insert(ItemShipping, objects, chunk_size)
+
+    @_time_profiling(InsertSellersTimeProfiler)
+    def insert_sellers(self, objects: Sequence[Dict[str, Any]], chunk_size: Optional[int] = None) -> None:
+        self._bulk_insert(Seller, objects, chunk_size)
+
+    @_time_profiling(InsertItemsTimeProfiler)
+    def upsert_items(self, objects: List[Dict[str, Any]], chunk_size: int = 1000) -> None:
+        self._upsert(Item, objects, ITEM_CONFLICT_KEYS, ITEM_UPDATE_COLUMNS, chunk_size)
+
+    @_time_profiling(InsertItemsShippingTimeProfiler)
+    def upsert_item_shipping(self, objects: List[Dict[str, Any]], chunk_size: int = 1000) -> None:
+        self._upsert(ItemShipping, objects, ITEM_SHIPPING_CONFLICT_KEYS, [], chunk_size)
+
     @_time_profiling(InsertSellersTimeProfiler)
-    def insert_sellers(self, objects: List[Dict[str, Any]]) -> None:
-        self._session.bulk_insert_mappings(mapper=Seller, mappings=objects)
+    def upsert_sellers(self, objects: List[Dict[str, Any]], chunk_size: int = 1000) -> None:
+        self._upsert(Seller, objects, SELLER_CONFLICT_KEYS, [], chunk_size)
+
+    def _merge_spooled(self, model: Type, path: Optional[str], conflict_keys: Sequence[str],
+                       update_columns: Sequence[str], chunk_size: int) -> None:
+        """
+        Loads a spool file into a table. On MySQL the file is sent with LOAD DATA LOCAL INFILE into a temporary
+        staging table, which is then merged into the table (INSERT ... SELECT ... ON DUPLICATE KEY UPDATE, or DELETE
+        of the stored rows and INSERT ... SELECT for partitioned tables); other dialects fall back to bulk upserts of
+        the rows read from the file. So do MySQL connections whose client or server refuse LOAD DATA LOCAL INFILE
+        (local_infile disabled), which is logged once.
+        """
+        if path is None:
+            return
+        table = model.__table__
+        dialect = self._session.get_bind().dialect
+        if dialect.name != "mysql" or self._load_data_refused:
+            self._upsert(model, list(read_table_file(path, table)), conflict_keys, update_columns, chunk_size)
+            return
+        if not self._partitioned(table):
+            self._check_unique_key(table, conflict_keys)
+        staging = f"{table.name}_staging"
+        file_columns = read_columns(path)
+        columns = ", ".join(f"`{c}`" for c in file_columns)
+        self._session.execute(text(f"DROP TEMPORARY TABLE IF EXISTS `{staging}`"))
+        # without the keys (nor the partitions, which temporary tables can't have) of the table.
+        self._session.execute(text(f"CREATE TEMPORARY TABLE `{staging}` SELECT {columns} FROM `{table.name}` LIMIT 0"))
+        try:
+            self._session.execute(text(f"LOAD DATA LOCAL INFILE :path INTO TABLE `{staging}` CHARACTER SET utf8mb4 "
+                                       f"IGNORE 1 LINES ({columns})"), {"path": os.path.abspath(path)})
+        except OperationalError as ex:
+            # a lost connection is raised, so the batch is kept in the spool.
+            if getattr(ex.orig, "args", (None,))[0] not in LOAD_DATA_REFUSED_ERRORS:
+                raise
+            logging.warning(f"LOAD DATA LOCAL INFILE was refused ({ex.orig}), spooled batches are loaded with bulk "
+                            f"upserts instead. Enable local_infile on the client (?local_infile=1 in DATABASE_URL) "
+                            f"and on the server for faster loads.")
+            self._load_data_refused = True
+            self._session.execute(text(f"DROP TEMPORARY TABLE `{staging}`"))
+            self._upsert(model, list(read_table_file(path, table)), conflict_keys, update_columns, chunk_size)
+            return
+        if self._partitioned(table):
+            stored = " AND ".join(f"t.`{k}` = s.`{k}`" for k in conflict_keys)
+            self._session.execute(text(f"DELETE t FROM `{table.name}` t JOIN `{staging}` s ON {stored}"))
+            self._session.execute(text(f"INSERT INTO `{table.name}` ({columns}) SELECT {columns} FROM `{staging}` s"))
+        else:
+            # columns that aren't in the file (timestamps) get their server default, as in _upsert.
+            updates = ", ".join(f"`{c}` = s.`{c}`" if c in file_columns else
+                                f"`{c}` = {table.c[c].server_default.arg.compile(dialect=dialect)}"
+                                for c in update_columns or conflict_keys[:1])
+            self._session.execute(text(f"INSERT INTO `{table.name}` ({columns}) SELECT {columns} FROM `{staging}` s "
+                                       f"ON DUPLICATE KEY UPDATE {updates}"))
+        self._session.execute(text(f"DROP TEMPORARY TABLE `{staging}`"))
         self.session_commit()
 
+    @_time_profiling(InsertItemsTimeProfiler)
+    def merge_spooled_items(self, path: Optional[str], chunk_size: int = 1000) -> None:
+        self._merge_spooled(Item, path, ITEM_CONFLICT_KEYS, ITEM_UPDATE_COLUMNS, chunk_size)
+
+    @_time_profiling(InsertItemsShippingTimeProfiler)
+    def merge_spooled_item_shipping(self, path: Optional[str], chunk_size: int = 1000) -> None:
+        self._merge_spooled(ItemShipping, path, ITEM_SHIPPING_CONFLICT_KEYS, [], chunk_size)
+
+    @_time_profiling(InsertSellersTimeProfiler)
+    def merge_spooled_sellers(self, path: Optional[str], chunk_size: int = 1000) -> None:
+        self._merge_spooled(Seller, path, SELLER_CONFLICT_KEYS, [], chunk_size)
+
+    @staticmethod
+    def spool_batch(spool: Spool, items: List[Dict[str, Any]], item_shipping: List[Dict[str, Any]],
+                    sellers: List[Dict[str, Any]], aggregates: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Writes a batch into the spool (no database access), returning its path.
+        :param aggregates: if defined, the day and query the batch is aggregated with when it's loaded.
+        """
+        return spool.write({Item.__table__: items, ItemShipping.__table__: item_shipping, Seller.__table__: sellers},
+                           meta={"aggregates": aggregates} if aggregates else None)
+
+    def load_spooled_batch(self, batch_path: str, chunk_size: int = 1000) -> None:
+        """
+        Loads the items, item_shipping and sellers files of a spooled batch in a single transaction (along with its
+        best seller aggregates, if it was spooled with them).
+        """
+        with self.transaction():
+            aggregates = Spool.meta(batch_path).get("aggregates")
+            if aggregates:
+                items_path = Spool.table_file(batch_path, Item.__tablename__)
+                item_shipping_path = Spool.table_file(batch_path, ItemShipping.__tablename__)
+                self.update_best_seller_aggregates(
+                    date.fromisoformat(aggregates["day"]), aggregates["query"],
+                    list(read_table_file(items_path, Item.__table__)) if items_path else [],
+                    list(read_table_file(item_shipping_path, ItemShipping.__table__)) if item_shipping_path else [],
+                    chunk_size=chunk_size)
+            self.merge_spooled_items(Spool.table_file(batch_path, Item.__tablename__), chunk_size)
+            self.merge_spooled_item_shipping(Spool.table_file(batch_path, ItemShipping.__tablename__), chunk_size)
+            self.merge_spooled_sellers(Spool.table_file(batch_path, Seller.__tablename__), chunk_size)
+
     def insert_request_metrics(self, objects: List[Dict[str, Any]]) -> None:
         self._session.bulk_insert_mappings(mapper=RequestMetrics, mappings=objects)
         self.session_commit()
 
+    def insert_request_counter_metrics(self, objects: List[Dict[str, Any]]) -> None:
+        self._session.bulk_insert_mappings(mapper=RequestCounterMetrics, mappings=objects)
+        self.session_commit()
+
+    def insert_metric_summaries(self, objects: List[Dict[str, Any]]) -> None:
+        self._session.bulk_insert_mappings(mapper=MetricSummaries, mappings=objects)
+        self.session_commit()
+
     def insert_database_metrics(self, objects: List[Dict[str, Any]]) -> None:
         self._session.bulk_insert_mappings(mapper=DatabaseMetrics, mappings=objects)
         self.session_commit()
@@ -49,14 +369,57 @@ class DatabaseClient:
         self.session_commit()
 
     def session_commit(self) -> None:
-        self._session.commit()
+        if not self._in_transaction:
+            self._session.commit()
+
+    def session_rollback(self) -> None:
+        """
+        Discards the pending changes of a failed load, so the session can be used again.
+        """
+        self._session.rollback()
+
+    def get_database_time(self) -> datetime:
+        """
+        :return: current local time of the database server (the clock of the stored timestamps).
+        """
+        return self._session.query(local_now()).scalar()
+
+    def current_day(self) -> date:
+        """
+        :return: current day of the database server, which may not be the one of this host (for instance, in another
+        timezone). Stored timestamps belong to it.
+        """
+        return self.get_database_time().date()
+
+    def _current_day_range(self) -> Tuple[datetime, datetime]:
+        return day_range(self.current_day())
+
+    def count_current_day_items(self) -> int:
+        """
+        :return: amount of distinct items stored in the current day.
+        """
+        start, end = self._current_day_range()
+        return self._session.query(func.count(distinct(Item.id))).filter(Item.created_at >= start,
+                                                                         Item.created_at < end).scalar()
 
-    def get_current_day_item_ids(self) -> List[str]:
-        current_day_items = self._session.query(Item).filter(func.date(Item.created_at) == date.today()).all()
+    def get_current_day_item_ids(self, since: Optional[datetime] = None) -> List[str]:
+        """
+        :param since: if defined, only the items stored since this time are read (for refreshing a known index).
+        """
+        # a range of created_at (instead of its date) is read from the (created_at, id) index only.
+        start, end = self._current_day_range()
+        if since is not None:
+            start = max(start, since)
+        current_day_items = self._session.query(Item.id).filter(Item.created_at >= start, Item.created_at < end)
         current_day_item_ids = list(map(lambda i: i.id, current_day_items))
         return current_day_item_ids
 
-    def get_sellers_data(self) -> List[Tuple[int, int]]:
-        sellers = self._session.query(Seller).all()
+    def get_sellers_data(self, since: Optional[datetime] = None) -> List[Tuple[int, int]]:
+        """
+        :param since: if defined, only the sellers stored since this time are read (for refreshing a known index).
+        """
+        sellers = self._session.query(Seller.seller_id, Seller.completed_sales)
+        if since is not None:
+            sellers = sellers.filter(Seller.date >= since)
         sellers = list(map(lambda i: (i.seller_id, i.completed_sales), sellers))
         return sellers
@@ -4,7 +4,9 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
 
 try:
-    engine = create_engine(os.getenv("DATABASE_URL"))
+    # pooled connections are checked before being used, since long-running processes (workers, daemon) may keep them
+    # idle for longer than the server timeout.
+    engine = create_engine(os.getenv("DATABASE_URL"), pool_pre_ping=True)
 except:
     raise Exception("Unable to create engine instance. Check if DATABASE_URL environ is defined or is correct.")
 Base = declarative_base()
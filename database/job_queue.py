@@ -0,0 +1,117 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import update, or_, and_
+from sqlalchemy.orm import Session
+
+from database.models import EtlJob
+from database.models.columns import local_now
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+CLAIM_CANDIDATES = 10
+
+
+class JobQueue:
+    """
+    Queue of ETL jobs (one query each) stored in the etl_jobs table, shared by every worker process (in the same host
+    or not). A worker claims a job with a lease: while the lease isn't expired, no other worker takes the job, and the
+    worker extends it with heartbeats. Jobs whose lease expired (for instance, because its worker died) are claimed
+    again, until max_attempts. Claims are atomic conditional updates, so they don't need row locks and work on any
+    database. Leases are set and compared with the clock of the database, not the one of each worker.
+    Attributes
+    ----------
+    session: Session
+        SQLAlchemy session, only used by this queue.
+    worker_id: str
+        identifier of the worker that claims jobs.
+    lease_seconds: float
+        duration of a lease, since it was claimed or since the last heartbeat.
+    max_attempts: int
+        max amount of times a job is claimed.
+    """
+
+    def __init__(self, session: Session, worker_id: str, lease_seconds: float = 300.0, max_attempts: int = 3) -> None:
+        self.session = session
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _now(self) -> datetime:
+        # date arithmetic differs among databases, so leases are computed from the database time instead of in SQL.
+        return self.session.query(local_now()).scalar()
+
+    def _claimable(self, now: datetime):
+        expired = and_(EtlJob.status == RUNNING, EtlJob.lease_expires_at < now)
+        return and_(or_(EtlJob.status == PENDING, expired), EtlJob.attempts < self.max_attempts)
+
+    def enqueue(self, queries: List[str], max_items: int, exclude_seller_id: Optional[int]) -> int:
+        now = self._now()
+        jobs = [{"query": q, "max_items": max_items, "exclude_seller_id": exclude_seller_id, "status": PENDING,
+                 "attempts": 0, "created_at": now} for q in queries]
+        self.session.bulk_insert_mappings(mapper=EtlJob, mappings=jobs)
+        self.session.commit()
+        return len(jobs)
+
+    def _expire_exhausted(self, now: datetime) -> None:
+        # jobs whose last attempt lease expired can't be claimed anymore.
+        result = self.session.execute(
+            update(EtlJob)
+            .where(EtlJob.status == RUNNING, EtlJob.lease_expires_at < now, EtlJob.attempts >= self.max_attempts)
+            .values(status=FAILED, finished_at=now, error="lease expired in every attempt")
+            .execution_options(synchronize_session=False))
+        self.session.commit()
+        if result.rowcount:
+            logging.warning(f"{result.rowcount} jobs failed: lease expired in every attempt.")
+
+    def claim(self) -> Optional[EtlJob]:
+        """
+        Claims the oldest claimable job.
+        :return: the claimed job, or None if there aren't claimable jobs.
+        """
+        now = self._now()
+        self._expire_exhausted(now)
+        candidates = [rowid for rowid, in self.session.query(EtlJob.rowid).filter(self._claimable(now))
+                      .order_by(EtlJob.rowid).limit(CLAIM_CANDIDATES)]
+        for rowid in candidates:
+            result = self.session.execute(
+                update(EtlJob)
+                .where(EtlJob.rowid == rowid, self._claimable(now))
+                .values(status=RUNNING, worker_id=self.worker_id, attempts=EtlJob.attempts + 1, started_at=now,
+                        lease_expires_at=now + timedelta(seconds=self.lease_seconds), error=None)
+                .execution_options(synchronize_session=False))
+            self.session.commit()
+            if result.rowcount == 1:
+                job = self.session.get(EtlJob, rowid)
+                self.session.refresh(job)
+                return job
+            # another worker claimed it first.
+        return None
+
+    def _update_own(self, job_id: int, **values) -> bool:
+        result = self.session.execute(
+            update(EtlJob)
+            .where(EtlJob.rowid == job_id, EtlJob.worker_id == self.worker_id, EtlJob.status == RUNNING)
+            .values(**values)
+            .execution_options(synchronize_session=False))
+        self.session.commit()
+        return result.rowcount == 1
+
+    def heartbeat(self, job_id: int) -> bool:
+        """
+        Extends the lease of a job claimed by this worker.
+        :return: False if the job isn't held by this worker anymore (its lease expired and another worker claimed it).
+        """
+        return self._update_own(job_id, lease_expires_at=self._now() + timedelta(seconds=self.lease_seconds))
+
+    def complete(self, job_id: int, process_time: float) -> bool:
+        return self._update_own(job_id, status=DONE, finished_at=self._now(), process_time=process_time,
+                                lease_expires_at=None)
+
+    def fail(self, job_id: int, process_time: float, error: str, attempts: int) -> bool:
+        """
+        Releases a job that failed: it's claimable again (status pending) until it was attempted max_attempts times.
+        """
+        status = FAILED if attempts >= self.max_attempts else PENDING
+        return self._update_own(job_id, status=status, finished_at=self._now(), process_time=process_time,
+                                lease_expires_at=None, error=error[:500])
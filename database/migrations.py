@@ -0,0 +1,232 @@
+"""
+Schema changes for tables created by older versions, and date partitioning of the history tables on MySQL. Both are
+applied by create_database (best_seller.py) after the missing tables were created, and do nothing if they were applied
+already.
+"""
+import logging
+from datetime import date
+from typing import List, Set, Optional, Dict
+
+from sqlalchemy import inspect, text, Table, UniqueConstraint
+from sqlalchemy.engine import Engine, Connection
+
+from database.models import Item, ItemShipping, Seller
+from database.models.columns import local_now
+
+# timestamp column (filled by the server) of each history table, which is also its partitioning column on MySQL.
+TIMESTAMP_COLUMNS = {Item.__table__: "created_at", ItemShipping.__table__: "date", Seller.__table__: "date"}
+PARTITION_MONTHS_AHEAD = 3
+MAX_PARTITION = "pmax"
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"p{month.strftime('%Y%m')}"
+
+
+def _missing_indexes(connection: Connection, table: Table) -> None:
+    existing = {index["name"] for index in inspect(connection).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            logging.info(f"Creating index {index.name} of {table.name}.")
+            index.create(connection)
+
+
+def _rebuild_sqlite_table(connection: Connection, table: Table, defaults: Dict[str, str]) -> None:
+    """
+    SQLite can't change the default nor the nullability of a column, so the table is created again and its rows are
+    copied. NULLs of the columns of defaults are replaced by their SQL expression, and rows that duplicate a unique key
+    of the new table are left out.
+    """
+    old = f"{table.name}_old"
+    for index in inspect(connection).get_indexes(table.name):
+        connection.execute(text(f'DROP INDEX "{index["name"]}"'))
+    connection.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old}"'))
+    table.create(connection)
+    columns = [c.name for c in table.columns]
+    selected = [f'COALESCE("{c}", {defaults[c]})' if c in defaults else f'"{c}"' for c in columns]
+    connection.execute(text(f'INSERT OR IGNORE INTO "{table.name}" ({", ".join(columns)}) '
+                            f'SELECT {", ".join(selected)} FROM "{old}" ORDER BY rowid'))
+    connection.execute(text(f'DROP TABLE "{old}"'))
+
+
+def _alter_mysql_timestamp(connection: Connection, table: Table, column: str) -> None:
+    connection.execute(text(f"UPDATE `{table.name}` SET `{column}` = CURRENT_TIMESTAMP WHERE `{column}` IS NULL"))
+    connection.execute(text(f"ALTER TABLE `{table.name}` MODIFY `{column}` DATETIME NOT NULL "
+                            f"DEFAULT CURRENT_TIMESTAMP"))
+
+
+def migrate_timestamps(engine: Engine) -> None:
+    """
+    Tables created by older versions got their timestamps from a python default evaluated when the models were
+    imported. Their timestamp columns are changed into server defaults (rows without timestamp get the current time),
+    and the indexes of the models that they lack are created.
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table, column in TIMESTAMP_COLUMNS.items():
+            if not inspector.has_table(table.name):
+                continue
+            default = next(c.get("default") for c in inspector.get_columns(table.name) if c["name"] == column)
+            if default is None:
+                logging.warning(f"Migrating {table.name}.{column} to a server default timestamp.")
+                if dialect == "mysql":
+                    _alter_mysql_timestamp(connection, table, column)
+                elif dialect == "sqlite":
+                    now = local_now().compile(dialect=connection.dialect)
+                    _rebuild_sqlite_table(connection, table, {column: str(now)})
+                else:
+                    raise NotImplementedError(f"Migrations are not supported for the {dialect} dialect.")
+            _missing_indexes(connection, table)
+
+
+def migrate_shipping_methods(engine: Engine) -> None:
+    """
+    Older versions stored the item_shipping objects of items without shipping method with a NULL one, which doesn't
+    collide on the unique key of item_shipping, so reloading them added them again. NULLs are replaced by the empty
+    shipping method (rows that would duplicate a stored one are deleted), and the column is made NOT NULL.
+    """
+    table = ItemShipping.__table__
+    dialect = engine.dialect.name
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if not inspector.has_table(table.name):
+            return
+        if not next(c["nullable"] for c in inspector.get_columns(table.name) if c["name"] == "shipping_method"):
+            return
+        logging.warning(f"Migrating {table.name}.shipping_method to NOT NULL: NULLs are replaced by empty methods.")
+        if dialect == "mysql":
+            # rows that would duplicate a stored one keep their NULL, and are deleted.
+            connection.execute(text(f"UPDATE IGNORE `{table.name}` SET `shipping_method` = '' "
+                                    f"WHERE `shipping_method` IS NULL"))
+            connection.execute(text(f"DELETE FROM `{table.name}` WHERE `shipping_method` IS NULL"))
+            connection.execute(text(f"ALTER TABLE `{table.name}` MODIFY `shipping_method` VARCHAR(50) NOT NULL"))
+        elif dialect == "sqlite":
+            _rebuild_sqlite_table(connection, table, {"shipping_method": "''"})
+        else:
+            raise NotImplementedError(f"Migrations are not supported for the {dialect} dialect.")
+
+
+def _delete_mysql_duplicates(connection: Connection, table: Table, keys: List[str]) -> None:
+    # every row but the first one of each key (NULLs are equal) is deleted.
+    same = " AND ".join(f"d.`{k}` <=> t.`{k}`" for k in keys)
+    connection.execute(text(f"DELETE t FROM `{table.name}` t JOIN `{table.name}` d ON {same} AND d.`rowid` < t.`rowid`"))
+
+
+def migrate_unique_keys(engine: Engine) -> None:
+    """
+    Tables created by older versions lack the unique keys of the natural keys of item_shipping and sellers, which
+    upserts rely on (without them, every reload inserts the rows again). Their duplicated rows are deleted (the first
+    one is kept) and the unique keys are added. Partitioned tables can't have them (see _partition_table).
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        partitioned = partitioned_tables(connection) if dialect == "mysql" else set()
+        for table in [ItemShipping.__table__, Seller.__table__]:
+            if not inspector.has_table(table.name) or table.name in partitioned:
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)} | \
+                       {constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}
+            missing = [c for c in table.constraints if isinstance(c, UniqueConstraint) and c.name not in existing]
+            if not missing:
+                continue
+            logging.warning(f"Adding the unique keys {', '.join(c.name for c in missing)} of {table.name}: its "
+                            f"duplicated rows are deleted.")
+            if dialect == "mysql":
+                for constraint in missing:
+                    keys = [c.name for c in constraint.columns]
+                    _delete_mysql_duplicates(connection, table, keys)
+                    connection.execute(text(f"ALTER TABLE `{table.name}` ADD CONSTRAINT `{constraint.name}` "
+                                            f"UNIQUE ({', '.join(f'`{k}`' for k in keys)})"))
+            elif dialect == "sqlite":
+                # SQLite can't add constraints: the rows are copied into the table created again, without duplicates.
+                _rebuild_sqlite_table(connection, table, {})
+            else:
+                raise NotImplementedError(f"Migrations are not supported for the {dialect} dialect.")
+
+
+def partitioned_tables(connection: Connection) -> Set[str]:
+    """
+    :return: names of the partitioned tables of the current MySQL database.
+    """
+    rows = connection.execute(text("SELECT DISTINCT TABLE_NAME FROM information_schema.PARTITIONS "
+                                   "WHERE TABLE_SCHEMA = DATABASE() AND PARTITION_NAME IS NOT NULL"))
+    return {row[0] for row in rows}
+
+
+def _partitions(connection: Connection, table: Table) -> List[str]:
+    rows = connection.execute(text("SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+                                   "ORDER BY PARTITION_ORDINAL_POSITION"), {"table": table.name})
+    return [row[0] for row in rows]
+
+
+def _partition_definitions(first_month: date, last_month: date) -> List[str]:
+    definitions, month = [], first_month
+    while month <= last_month:
+        definitions.append(f"PARTITION {_partition_name(month)} VALUES LESS THAN "
+                           f"(TO_DAYS('{_add_months(month, 1).isoformat()}'))")
+        month = _add_months(month, 1)
+    return definitions + [f"PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE"]
+
+
+def _partition_table(connection: Connection, table: Table, column: str, last_month: date) -> None:
+    """
+    MySQL requires the partitioning column in every unique key: it's added to the primary key, and unique constraints
+    are replaced by plain indexes (DatabaseClient replaces the stored rows of partitioned tables instead of relying on
+    them, see DatabaseClient._upsert).
+    """
+    oldest: Optional[date] = connection.execute(text(f"SELECT DATE(MIN(`{column}`)) FROM `{table.name}`")).scalar()
+    # rows older than the first month are kept in its partition.
+    first_month = _add_months(min(oldest or date.today(), date.today()), 0)
+    logging.warning(f"Partitioning {table.name} by month of {column}, since {first_month.isoformat()}: the table is "
+                    f"rebuilt and its rows are copied, which may take a while.")
+    changes = ["DROP PRIMARY KEY",
+               f"ADD PRIMARY KEY ({', '.join(f'`{c.name}`' for c in table.primary_key.columns)}, `{column}`)"]
+    for constraint in inspect(connection).get_unique_constraints(table.name):
+        changes += [f"DROP INDEX `{constraint['name']}`",
+                    f"ADD INDEX `{constraint['name']}` ({', '.join(f'`{c}`' for c in constraint['column_names'])})"]
+    connection.execute(text(f"ALTER TABLE `{table.name}` {', '.join(changes)}"))
+    connection.execute(text(f"ALTER TABLE `{table.name}` PARTITION BY RANGE (TO_DAYS(`{column}`)) "
+                            f"({', '.join(_partition_definitions(first_month, last_month))})"))
+
+
+def _add_partitions(connection: Connection, table: Table, column: str, last_month: date) -> None:
+    partitions = _partitions(connection, table)
+    months = [p for p in partitions if p != MAX_PARTITION]
+    if not months or MAX_PARTITION not in partitions:
+        logging.warning(f"{table.name} is partitioned, but not by month: no partitions were added.")
+        return
+    next_month = _add_months(date(int(months[-1][1:5]), int(months[-1][5:7]), 1), 1)
+    if next_month > last_month:
+        return
+    logging.info(f"Adding partitions of {table.name} up to {_partition_name(last_month)}.")
+    # the max partition is empty (no row is timestamped in the future), so splitting it is fast.
+    connection.execute(text(f"ALTER TABLE `{table.name}` REORGANIZE PARTITION {MAX_PARTITION} INTO "
+                            f"({', '.join(_partition_definitions(next_month, last_month))})"))
+
+
+def partition_tables(engine: Engine, months_ahead: int = PARTITION_MONTHS_AHEAD, migrate: bool = True) -> None:
+    """
+    Partitions items, item_shipping and sellers by month of their timestamp (MySQL only), so queries of a day or a
+    range of days only read the partitions of those days, and old history can be removed by dropping partitions.
+    Tables partitioned already get the partitions of the next months_ahead months, if they lack them.
+    :param migrate: if False, tables that aren't partitioned are left as they are (partitioning them rebuilds them).
+    """
+    if engine.dialect.name != "mysql":
+        logging.debug(f"Partitioning is not supported for the {engine.dialect.name} dialect.")
+        return
+    last_month = _add_months(date.today(), months_ahead)
+    with engine.begin() as connection:
+        partitioned = partitioned_tables(connection)
+        for table, column in TIMESTAMP_COLUMNS.items():
+            if table.name in partitioned:
+                _add_partitions(connection, table, column, last_month)
+            elif migrate:
+                _partition_table(connection, table, column, last_month)
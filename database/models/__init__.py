@@ -1,3 +1,7 @@
 from database.models.item import Item, ItemShipping
 from database.models.seller import Seller
-from database.models.metrics import RequestMetrics, DatabaseMetrics, ProcessMetrics
+from database.models.metrics import RequestMetrics, RequestCounterMetrics, DatabaseMetrics, \
+    ProcessMetrics, MetricSummaries
+from database.models.job import EtlJob
+from database.models.run import EtlRun, EtlRunBatch
+from database.models.aggregates import DailySellerSales, DailyPriceStats, DailyShippingMethods
@@ -0,0 +1,38 @@
+from sqlalchemy import Column, Integer, String, Float, Date, BigInteger
+
+from database import Base
+
+# aggregates of the items loaded each day, by the query that found them (see database.aggregates). Every item is
+# counted once per day, with the values of its first load of the day.
+
+
+class DailySellerSales(Base):
+    __tablename__ = "daily_seller_sales"
+
+    day = Column(Date(), primary_key=True)
+    query = Column(String(150), primary_key=True)
+    seller_id = Column(Integer(), primary_key=True, autoincrement=False)
+    items = Column(Integer(), nullable=False)
+    sold_quantity = Column(BigInteger(), nullable=False)
+
+
+class DailyPriceStats(Base):
+    __tablename__ = "daily_price_stats"
+
+    day = Column(Date(), primary_key=True)
+    query = Column(String(150), primary_key=True)
+    items = Column(Integer(), nullable=False)
+    sold_quantity = Column(BigInteger(), nullable=False)
+    price_sum = Column(Float(), nullable=False)
+    price_min = Column(Float(), nullable=False)
+    price_max = Column(Float(), nullable=False)
+
+
+class DailyShippingMethods(Base):
+    __tablename__ = "daily_shipping_methods"
+
+    day = Column(Date(), primary_key=True)
+    query = Column(String(150), primary_key=True)
+    # items without shipping method are counted with an empty one, since key columns can't be NULL.
+    shipping_method = Column(String(50), primary_key=True)
+    items = Column(Integer(), nullable=False)
@@ -0,0 +1,24 @@
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import DateTime
+
+
+class local_now(FunctionElement):
+    """
+    Current local time of the database server. Used as server default of the timestamps, so each row gets the time it
+    was inserted (a python default like datetime.now() is evaluated once, when the model is imported).
+    """
+    type = DateTime()
+    name = "local_now"
+    inherit_cache = True
+
+
+@compiles(local_now)
+def _compile_local_now(element, compiler, **kw) -> str:
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(local_now, "sqlite")
+def _compile_local_now_sqlite(element, compiler, **kw) -> str:
+    # CURRENT_TIMESTAMP is UTC in SQLite.
+    return "datetime('now', 'localtime')"
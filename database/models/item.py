@@ -1,12 +1,12 @@
-from datetime import datetime
-
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, DateTime, UniqueConstraint, Index
 
 from database import Base
+from database.models.columns import local_now
 
 
 class Item(Base):
     __tablename__ = "items"
+    __table_args__ = (Index("ix_items_created_at_id", "created_at", "id"),)
 
     id = Column(String(50), primary_key=True)
     seller_id = Column(Integer())
@@ -14,13 +14,15 @@ class Item(Base):
     sold_quantity = Column(Integer(), nullable=False)
     price = Column(Float(), nullable=False)
     warranty = Column(String(50), nullable=True)
-    created_at = Column(DateTime(), default=datetime.now())
+    created_at = Column(DateTime(), nullable=False, server_default=local_now())
 
 
 class ItemShipping(Base):
     __tablename__ = "item_shipping"
+    __table_args__ = (UniqueConstraint("item_id", "shipping_method", name="uq_item_shipping"),)
 
     rowid = Column(Integer(), primary_key=True)
     item_id = Column(String(50), nullable=False)
-    shipping_method = Column(String(50), nullable=True)
-    date = Column(DateTime(), default=datetime.now())
+    # items without shipping method get an empty one, since NULLs don't collide on the unique key.
+    shipping_method = Column(String(50), nullable=False)
+    date = Column(DateTime(), nullable=False, server_default=local_now())
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
+
+from database import Base
+
+
+class EtlJob(Base):
+    __tablename__ = "etl_jobs"
+    __table_args__ = (Index("ix_etl_jobs_status_lease", "status", "lease_expires_at"),)
+
+    rowid = Column(Integer(), primary_key=True)
+    query = Column(String(150), nullable=False)
+    max_items = Column(Integer(), nullable=False)
+    exclude_seller_id = Column(Integer(), nullable=True)
+    status = Column(String(20), nullable=False, default="pending")
+    worker_id = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime(), nullable=True)
+    attempts = Column(Integer(), nullable=False, default=0)
+    created_at = Column(DateTime(), default=datetime.now)
+    started_at = Column(DateTime(), nullable=True)
+    finished_at = Column(DateTime(), nullable=True)
+    process_time = Column(Float(), nullable=True)
+    error = Column(String(500), nullable=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, Integer
+from sqlalchemy import Column, String, Float, DateTime, Integer, BigInteger
 
 from database import Base
 
@@ -12,6 +12,16 @@ class RequestMetrics(Base):
     request_time = Column(Float(), nullable=False)
 
 
+class RequestCounterMetrics(Base):
+    __tablename__ = "request_counter_metrics"
+
+    rowid = Column(Integer(), primary_key=True)
+    date = Column(DateTime())
+    api_name = Column(String(50), nullable=False)
+    counter_name = Column(String(50), nullable=False)
+    value = Column(BigInteger(), nullable=False)
+
+
 class DatabaseMetrics(Base):
     __tablename__ = "database_metrics"
 
@@ -28,3 +38,19 @@ class ProcessMetrics(Base):
     date = Column(DateTime())
     process_name = Column(String(50), nullable=False)
     process_time = Column(Float(), nullable=False)
+
+
+class MetricSummaries(Base):
+    __tablename__ = "metric_summaries"
+
+    rowid = Column(Integer(), primary_key=True)
+    run_id = Column(String(40), nullable=False)
+    date = Column(DateTime())
+    category = Column(String(20), nullable=False)
+    name = Column(String(50), nullable=False)
+    count = Column(BigInteger(), nullable=False)
+    mean = Column(Float(), nullable=True)
+    p50 = Column(Float(), nullable=True)
+    p90 = Column(Float(), nullable=True)
+    p99 = Column(Float(), nullable=True)
+    max = Column(Float(), nullable=True)
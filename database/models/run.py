@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Index
+from sqlalchemy.dialects import mysql
+
+from database import Base
+
+
+class EtlRun(Base):
+    __tablename__ = "etl_runs"
+    __table_args__ = (Index("ix_etl_runs_key", "query", "exclude_seller_id", "max_items", "status"),)
+
+    rowid = Column(Integer(), primary_key=True)
+    query = Column(String(150), nullable=False)
+    exclude_seller_id = Column(Integer(), nullable=True)
+    max_items = Column(Integer(), nullable=False)
+    status = Column(String(20), nullable=False, default="running")
+    next_offset = Column(Integer(), nullable=False, default=0)
+    items_extracted = Column(Integer(), nullable=False, default=0)
+    items_loaded = Column(Integer(), nullable=False, default=0)
+    batches_loaded = Column(Integer(), nullable=False, default=0)
+    extraction_complete = Column(Boolean(), nullable=False, default=False)
+    created_at = Column(DateTime(), default=datetime.now)
+    updated_at = Column(DateTime(), default=datetime.now)
+
+
+class EtlRunBatch(Base):
+    __tablename__ = "etl_run_batches"
+    __table_args__ = (Index("ix_etl_run_batches_run", "run_id", "status"),)
+
+    rowid = Column(Integer(), primary_key=True)
+    run_id = Column(Integer(), nullable=False)
+    status = Column(String(20), nullable=False, default="extracted")
+    items = Column(Text().with_variant(mysql.LONGTEXT(), "mysql"), nullable=False)
+    created_at = Column(DateTime(), default=datetime.now)
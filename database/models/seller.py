@@ -1,14 +1,15 @@
-from datetime import datetime
-
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint, Index
 
 from database import Base
+from database.models.columns import local_now
 
 
 class Seller(Base):
     __tablename__ = "sellers"
+    __table_args__ = (UniqueConstraint("seller_id", "completed_sales", name="uq_sellers_completed_sales"),
+                      Index("ix_sellers_seller_id_date", "seller_id", "date"))
 
     rowid = Column(Integer(), primary_key=True)
     seller_id = Column(Integer())
     completed_sales = Column(Integer(), nullable=False)
-    date = Column(DateTime(), default=datetime.now())
+    date = Column(DateTime(), nullable=False, server_default=local_now())
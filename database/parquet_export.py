@@ -0,0 +1,201 @@
+"""
+Export of the warehouse tables to Parquet files partitioned by day (<output_dir>/<table>/day=<YYYY-MM-DD>/
+part-0.parquet, readable as a hive partitioned dataset by pyarrow, Spark, DuckDB...). Requires pyarrow (optional).
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple, Set
+
+from sqlalchemy import Table, Column, func, select
+from sqlalchemy.engine import Engine
+
+from database.client import day_range
+from database.models import Item, ItemShipping, Seller, RequestMetrics, RequestCounterMetrics, DatabaseMetrics, \
+    ProcessMetrics, MetricSummaries
+from database.models.columns import local_now
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# exported tables, and the timestamp column their rows are partitioned by.
+EXPORTED_TABLES: Dict[str, Tuple[Table, str]] = {
+    model.__tablename__: (model.__table__, column) for model, column in [
+        (Item, "created_at"), (ItemShipping, "date"), (Seller, "date"), (RequestMetrics, "date"),
+        (RequestCounterMetrics, "date"), (DatabaseMetrics, "date"), (ProcessMetrics, "date"), (MetricSummaries, "date")]}
+STATE_FILE = "_export_state.json"
+PYARROW_MISSING = "Parquet exports require pyarrow (pip install -r requirements-optional.txt)."
+PARTITION_FILE = "part-0.parquet"
+
+
+def _arrow_type(column: Column):
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return pyarrow.timestamp("us")
+    if python_type is date:
+        return pyarrow.date32()
+    return {int: pyarrow.int64(), float: pyarrow.float64(), bool: pyarrow.bool_()}.get(python_type, pyarrow.string())
+
+
+class ParquetExporter:
+    """
+    Streams tables into day partitioned Parquet files. Rows are read with a server-side cursor (unbuffered on MySQL)
+    in timestamp order, and written in row groups of row_group_size rows, so the memory used doesn't depend on the size
+    of the tables. Only complete days (before the current day of the database) are exported, and the last exported day
+    of each table is kept in a state file of the output directory, so later exports only write the partitions of the
+    days added since then.
+    Attributes
+    ----------
+    engine: Engine
+    output_dir: str
+    row_group_size: int
+        rows per row group (and max amount of rows in memory).
+    compression: str
+        Parquet compression codec.
+    """
+
+    def __init__(self, engine: Engine, output_dir: str, row_group_size: int = 50_000,
+                 compression: str = "snappy") -> None:
+        if pyarrow is None:
+            raise ImportError(PYARROW_MISSING)
+        self.engine = engine
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+        self.compression = compression
+        os.makedirs(output_dir, exist_ok=True)
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.output_dir, STATE_FILE)
+
+    def _read_state(self) -> Dict[str, str]:
+        if not os.path.exists(self._state_path):
+            return {}
+        with open(self._state_path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def _write_state(self, state: Dict[str, str]) -> None:
+        tmp_path = self._state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._state_path)
+
+    def _partition_dir(self, table: Table, day: date) -> str:
+        return os.path.join(self.output_dir, table.name, f"day={day.isoformat()}")
+
+    def _current_day(self) -> date:
+        # the day of the stored timestamps, which may not be the one of this host (see DatabaseClient.current_day).
+        with self.engine.connect() as connection:
+            return connection.execute(select(local_now())).scalar().date()
+
+    def _first_day(self, table: Table, column: str) -> Optional[date]:
+        with self.engine.connect() as connection:
+            first = connection.execute(select(func.min(table.c[column]))).scalar()
+        return first.date() if first else None
+
+    def export_table(self, name: str, since: Optional[date] = None, until: Optional[date] = None) -> Tuple[int, int]:
+        """
+        Exports the days of a table from since (by default, the day after the last exported one, or its first day) up
+        to until (excluded, by default the current day of the database, which isn't complete). Partitions of those days
+        are written again if they exist, and removed if the days don't have rows anymore.
+        :return: amount of partitions and rows written.
+        """
+        table, column = EXPORTED_TABLES[name]
+        state = self._read_state()
+        until = until or self._current_day()
+        if since is None:
+            since = date.fromisoformat(state[name]) + timedelta(days=1) if name in state \
+                else self._first_day(table, column)
+        if since is None or since >= until:
+            logging.info(f"{name}: no new days to export.")
+            return 0, 0
+
+        t0 = time.time()
+        schema = pyarrow.schema([(c.name, _arrow_type(c)) for c in table.columns])
+        day_index = schema.names.index(column)
+        stmt = select(table).where(table.c[column] >= day_range(since)[0], table.c[column] < day_range(until)[0]) \
+            .order_by(table.c[column])
+        partitions, rows = 0, 0
+        written_days: Set[date] = set()
+        writer: Optional["pyarrow.parquet.ParquetWriter"] = None
+        writer_day: Optional[date] = None
+        buffer: List[Any] = []
+
+        def flush() -> None:
+            if buffer:
+                columns = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*buffer), schema)]
+                writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+                buffer.clear()
+
+        def close_partition() -> None:
+            # the partition is written into a temporary file, which replaces the partition once complete.
+            flush()
+            writer.close()
+            partition_dir = self._partition_dir(table, writer_day)
+            shutil.rmtree(partition_dir, ignore_errors=True)
+            os.makedirs(partition_dir)
+            os.replace(self._tmp_path(name), os.path.join(partition_dir, PARTITION_FILE))
+            written_days.add(writer_day)
+
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(stmt)
+            for chunk in result.partitions(self.row_group_size):
+                for row in chunk:
+                    day = row[day_index].date()
+                    if day != writer_day:
+                        if writer is not None:
+                            close_partition()
+                            partitions += 1
+                        writer = pyarrow.parquet.ParquetWriter(self._tmp_path(name), schema,
+                                                               compression=self.compression)
+                        writer_day = day
+                    buffer.append(row)
+                    if len(buffer) == self.row_group_size:
+                        flush()
+                    rows += 1
+        if writer is not None:
+            close_partition()
+            partitions += 1
+        self._remove_partitions(table, since, until, keep=written_days)
+
+        state = self._read_state()
+        # exporting older days again doesn't move the last exported day back.
+        state[name] = max(state.get(name, ""), (until - timedelta(days=1)).isoformat())
+        self._write_state(state)
+        logging.info(f"{name}: {rows} rows of {partitions} days exported in {round(time.time() - t0, 2)} seconds.")
+        return partitions, rows
+
+    def _remove_partitions(self, table: Table, since: date, until: date, keep: Set[date]) -> None:
+        # partitions of a previous export whose rows were deleted since then.
+        table_dir = os.path.join(self.output_dir, table.name)
+        if not os.path.isdir(table_dir):
+            return
+        for partition in os.listdir(table_dir):
+            try:
+                day = date.fromisoformat(partition[len("day="):]) if partition.startswith("day=") else None
+            except ValueError:
+                continue
+            if day is not None and since <= day < until and day not in keep:
+                logging.info(f"{table.name}: partition of {day} removed, it doesn't have rows anymore.")
+                shutil.rmtree(os.path.join(table_dir, partition))
+
+    def _tmp_path(self, name: str) -> str:
+        return os.path.join(self.output_dir, f".{name}.parquet.tmp")
+
+    def export(self, names: Optional[List[str]] = None, since: Optional[date] = None,
+               until: Optional[date] = None) -> Tuple[int, int]:
+        """
+        Exports every table of names (by default, every exported table). See export_table.
+        :return: amount of partitions and rows written.
+        """
+        partitions, rows = 0, 0
+        for name in names or list(EXPORTED_TABLES):
+            table_partitions, table_rows = self.export_table(name, since=since, until=until)
+            partitions, rows = partitions + table_partitions, rows + table_rows
+        return partitions, rows
@@ -0,0 +1,155 @@
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime, date
+from typing import List, Dict, Any, Iterator, Optional
+
+from sqlalchemy import Table, Column
+
+# files are written in the default format of MySQL LOAD DATA: tab separated fields, one row per line, backslash
+# escaping and \N for NULL values. The first line holds the column names.
+NULL = "\\N"
+_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"}
+_UNESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r", "0": "\0"}
+META_FILE = "meta.json"
+
+
+def _encode(value: Any) -> str:
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.isoformat()
+    return "".join(_ESCAPES.get(c, c) for c in str(value))
+
+
+def _decode(field: str) -> Optional[str]:
+    if field == NULL:
+        return None
+    if "\\" not in field:
+        return field
+    chars, i = [], 0
+    while i < len(field):
+        if field[i] == "\\" and i + 1 < len(field):
+            chars.append(_UNESCAPES.get(field[i + 1], field[i + 1]))
+            i += 2
+        else:
+            chars.append(field[i])
+            i += 1
+    return "".join(chars)
+
+
+def _parse(value: Optional[str], python_type: type) -> Any:
+    if value is None:
+        return None
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type in (int, float):
+        return python_type(value)
+    return value
+
+
+def spool_columns(table: Table) -> List[Column]:
+    # surrogate "rowid" keys and timestamps (server defaults) are generated by the database.
+    return [c for c in table.columns if c.name != "rowid" and c.server_default is None]
+
+
+def write_table_file(path: str, table: Table, rows: List[Dict[str, Any]]) -> None:
+    """
+    Writes the rows of a table into a spool file. Columns missing in the rows get their scalar default (if any), since
+    LOAD DATA doesn't apply the defaults defined in the models.
+    """
+    columns = spool_columns(table)
+    defaults = {c.name: c.default.arg for c in columns if c.default is not None and c.default.is_scalar}
+    with open(path, "w", encoding="utf-8", newline="\n") as file:
+        file.write("\t".join(c.name for c in columns) + "\n")
+        for row in rows:
+            file.write("\t".join(_encode(row.get(c.name, defaults.get(c.name))) for c in columns) + "\n")
+
+
+def read_table_file(path: str, table: Table) -> Iterator[Dict[str, Any]]:
+    """
+    Reads back the rows of a spool file, parsing every value into the python type of its column.
+    """
+    with open(path, encoding="utf-8", newline="\n") as file:
+        names = file.readline().rstrip("\n").split("\t")
+        types = [table.columns[name].type.python_type for name in names]
+        for line in file:
+            fields = line.rstrip("\n").split("\t")
+            yield {name: _parse(_decode(field), _type) for name, field, _type in zip(names, fields, types)}
+
+
+def read_columns(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as file:
+        return file.readline().rstrip("\n").split("\t")
+
+
+class Spool:
+    """
+    Local directory where each transformed batch is written (one file per table) before loading it into the
+    database. A batch is removed once it was loaded, so batches that couldn't be loaded (for instance, because the
+    database was unreachable) are kept and drained by a later run.
+    Attributes
+    ----------
+    directory: str
+        path of the spool directory.
+    lock: threading.Lock
+        held while the spool is drained, so several loaders of the same process don't load the same batch.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, rows: Dict[Table, List[Dict[str, Any]]], meta: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Writes a batch (the rows of each table, tables without rows are skipped) and returns its path. Files are
+        written into a temporary directory that is renamed once complete, so a crash never leaves a partial batch to
+        be drained.
+        :param meta: if defined, it's kept with the batch (see Spool.meta).
+        """
+        name = f"batch_{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{os.getpid()}_{next(self._sequence):06d}"
+        tmp_path = os.path.join(self.directory, "." + name)
+        os.makedirs(tmp_path)
+        for table, table_rows in rows.items():
+            if table_rows:
+                write_table_file(os.path.join(tmp_path, f"{table.name}.tsv"), table, table_rows)
+        if meta:
+            with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as file:
+                json.dump(meta, file)
+        path = os.path.join(self.directory, name)
+        os.rename(tmp_path, path)
+        return path
+
+    def pending(self) -> List[str]:
+        """
+        Paths of the batches that were not loaded yet, oldest first.
+        """
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("batch_"))
+        return [os.path.join(self.directory, n) for n in names]
+
+    @staticmethod
+    def table_file(batch_path: str, table_name: str) -> Optional[str]:
+        path = os.path.join(batch_path, f"{table_name}.tsv")
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def meta(batch_path: str) -> Dict[str, Any]:
+        path = os.path.join(batch_path, META_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+
+    @staticmethod
+    def remove(batch_path: str) -> None:
+        shutil.rmtree(batch_path)
+        logging.debug(f"Spooled batch {batch_path} removed.")
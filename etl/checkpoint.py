@@ -0,0 +1,151 @@
+import json
+import logging
+from typing import Callable, List, Dict, Any, Tuple, Optional
+
+from sqlalchemy.orm import Session
+
+from database.client import day_range
+from database.models import EtlRun, EtlRunBatch
+from database.models.columns import local_now
+
+RUNNING, DONE = "running", "done"
+
+
+class RunCheckpoint:
+    """
+    Progress of a streaming run of a query, stored in the etl_runs and etl_run_batches tables: the search offset where
+    the extraction must go on, and the batches that were extracted (with their attributes) but not loaded yet. A run
+    that failed halfway is resumed by the next run of the same query, parameters and day, without requesting again the
+    pages and attributes already obtained, nor loading again the batches already loaded. Every method uses its own
+    short session, so a checkpoint can be updated from several threads.
+    Attributes
+    ----------
+    session_factory: Callable[[], Session]
+        builds the sessions used for reading and updating the checkpoint.
+    run_id: int
+    next_offset: int
+        search offset where the extraction must go on.
+    items_extracted: int
+        amount of search results already extracted (before being filtered by their attributes).
+    extraction_complete: bool
+        True if there are no more pages to extract.
+    last_batch_id: Optional[int]
+        id of the last extracted batch.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], run: EtlRun) -> None:
+        self.session_factory = session_factory
+        self.run_id = run.rowid
+        self.next_offset = run.next_offset
+        self.items_extracted = run.items_extracted
+        self.extraction_complete = run.extraction_complete
+        self.last_batch_id: Optional[int] = None
+
+    @classmethod
+    def start(cls, session_factory: Callable[[], Session], query: str, exclude_seller_id: Optional[int],
+              max_items: int) -> "RunCheckpoint":
+        """
+        Returns the checkpoint of the unfinished run of the current day with the same params, or of a new run. The
+        current day is the one of the database, which sets the timestamps of the runs.
+        """
+        session = session_factory()
+        try:
+            now = session.query(local_now()).scalar()
+            start, end = day_range(now.date())
+            run = session.query(EtlRun).filter(EtlRun.query == query,
+                                               EtlRun.exclude_seller_id == exclude_seller_id,
+                                               EtlRun.max_items == max_items,
+                                               EtlRun.status == RUNNING,
+                                               EtlRun.created_at >= start, EtlRun.created_at < end) \
+                .order_by(EtlRun.rowid.desc()).first()
+            if run is None:
+                run = EtlRun(query=query, exclude_seller_id=exclude_seller_id, max_items=max_items, status=RUNNING,
+                             next_offset=0, items_extracted=0, items_loaded=0, batches_loaded=0,
+                             extraction_complete=False, created_at=now, updated_at=now)
+                session.add(run)
+                session.commit()
+            else:
+                logging.info(f"Resuming run {run.rowid} of '{query}': {run.items_extracted} items extracted, "
+                             f"{run.items_loaded} loaded in {run.batches_loaded} batches, next offset "
+                             f"{run.next_offset}.")
+            return cls(session_factory, run)
+        finally:
+            session.close()
+
+    def _update_run(self, session: Session, **values) -> None:
+        session.query(EtlRun).filter(EtlRun.rowid == self.run_id) \
+            .update(dict(values, updated_at=local_now()), synchronize_session=False)
+
+    def pending_batches(self) -> List[Tuple[int, List[Dict[str, Any]]]]:
+        """
+        Batches that were extracted but not loaded, as (batch id, items) tuples.
+        """
+        session = self.session_factory()
+        try:
+            batches = session.query(EtlRunBatch).filter(EtlRunBatch.run_id == self.run_id) \
+                .order_by(EtlRunBatch.rowid).all()
+            return [(batch.rowid, json.loads(batch.items)) for batch in batches]
+        finally:
+            session.close()
+
+    def batch_extracted(self, items: List[Dict[str, Any]], fetched: int, next_offset: int) -> None:
+        """
+        Saves a batch of extracted items, and where the search must be resumed once it was saved.
+        :param fetched: amount of search results of the batch (before being filtered by their attributes).
+        """
+        session = self.session_factory()
+        try:
+            batch = EtlRunBatch(run_id=self.run_id, status="extracted", items=json.dumps(items),
+                                created_at=local_now())
+            session.add(batch)
+            self.items_extracted += fetched
+            self.next_offset = next_offset
+            self._update_run(session, items_extracted=self.items_extracted, next_offset=next_offset)
+            session.commit()
+            self.last_batch_id = batch.rowid
+        finally:
+            session.close()
+
+    def extraction_finished(self, completed: bool) -> None:
+        """
+        :param completed: False if the extraction stopped because a page couldn't be obtained.
+        """
+        if not completed:
+            logging.warning(f"Extraction of run {self.run_id} stopped at offset {self.next_offset}. Run it again for "
+                            f"resuming it.")
+            return
+        session = self.session_factory()
+        try:
+            self.extraction_complete = True
+            self._update_run(session, extraction_complete=True)
+            session.commit()
+        finally:
+            session.close()
+
+    def batch_loaded(self, batch_id: int, loaded_items: int) -> None:
+        session = self.session_factory()
+        try:
+            session.query(EtlRunBatch).filter(EtlRunBatch.rowid == batch_id).delete(synchronize_session=False)
+            self._update_run(session, items_loaded=EtlRun.items_loaded + loaded_items,
+                             batches_loaded=EtlRun.batches_loaded + 1)
+            session.commit()
+        finally:
+            session.close()
+
+    def finish(self) -> bool:
+        """
+        Marks the run as done if every page was extracted and every batch was loaded.
+        :return: True if the run is done.
+        """
+        session = self.session_factory()
+        try:
+            pending = session.query(EtlRunBatch).filter(EtlRunBatch.run_id == self.run_id).count()
+            if not self.extraction_complete or pending:
+                logging.warning(f"Run {self.run_id} is unfinished ({pending} batches not loaded). Run it again for "
+                                f"resuming it.")
+                return False
+            self._update_run(session, status=DONE)
+            session.commit()
+            return True
+        finally:
+            session.close()
@@ -1,5 +1,7 @@
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Collection
+
+from etl.transformations.column_batch import ColumnBatch
 
 
 @dataclass
@@ -16,3 +18,22 @@ class DataCleaner:
         for key in keys_to_drop:
             atribs.pop(key, None)
         return atribs
+
+    def clean_batch(self, batch: ColumnBatch) -> ColumnBatch:
+        return batch.select(self.relevant_keys) if self.relevant_keys else batch.drop(self.drop_keys)
+
+    def compile_source(self, ref: str, known_keys: Collection[str] = ()) -> Tuple[List[str], List[str]]:
+        """
+        Source code of clean, for compiled transformers (see etl.codegen). The cleaner is bound to the name ref.
+        :param known_keys: keys the items are expected to have. The irrelevant ones are dropped without checking the
+        rest of the keys, which are only checked (without building sets) afterwards.
+        :return: lines run once per list of items, and lines that clean the item atribs in place.
+        """
+        if not self.relevant_keys:
+            return [], [f'atribs.pop({key!r}, None)' for key in self.drop_keys]
+        relevant_keys = set(self.relevant_keys)
+        return [f"{ref}_keys = frozenset({ref}.relevant_keys)"], \
+            [f'atribs.pop({key!r}, None)' for key in sorted(set(known_keys) - relevant_keys)] + \
+            [f"if not {ref}_keys.issuperset(atribs):",
+             f"    for key in [key for key in atribs if key not in {ref}_keys]:",
+             "        del atribs[key]"]
@@ -0,0 +1,101 @@
+"""
+Compilation of filters and transformers into fused functions: the source code of every condition (or transformation,
+and the cleaner) is inlined into a single loop over a list of results, so each one is processed without the dynamic
+dispatch of Filter.apply and Transformer._apply_transformations. Conditions and transformations provide their code
+with compile_source; the ones that don't are called through satisfies and apply.
+"""
+import itertools
+import linecache
+import logging
+from typing import List, Dict, Any, Callable, Tuple, Sequence, Optional, Set
+
+from etl.cleaner.data_cleaner import DataCleaner
+from etl.filter.condition import Condition
+from etl.transformations.transformations import Transformation
+
+_compiled_functions = itertools.count()
+
+
+def _build(name: str, lines: List[str], namespace: Dict[str, Any]) -> Callable:
+    source = "\n".join(lines) + "\n"
+    filename = f"<{name}-{next(_compiled_functions)}>"
+    # the source is registered, so tracebacks and debuggers show the lines of the compiled function.
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    logging.debug(f"Compiled {filename}:\n{source}")
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace[name]
+
+
+def _indent(lines: List[str], level: int) -> List[str]:
+    return [" " * 4 * level + line for line in lines]
+
+
+def compile_conditions(conditions: Sequence[Condition]) -> Callable[[List[Dict[str, Any]]],
+                                                                    Tuple[List[Dict[str, Any]], List[int]]]:
+    """
+    :return: function that filters a list of results by conditions, evaluated in their order. It returns the results
+    that satisfy every condition, and the amount of results rejected by each condition.
+    """
+    namespace: Dict[str, Any] = {}
+    setup, checks = [], []
+    for i, cond in enumerate(conditions):
+        ref = f"_c{i}"
+        namespace[ref] = cond
+        source = cond.compile_source(ref)
+        if source is None:
+            setup.append(f"{ref}_satisfies = {ref}.satisfies")
+            expression = f"{ref}_satisfies(r)"
+        else:
+            setup += source[0]
+            expression = source[1]
+        checks += [f"if not ({expression}):",
+                   f"    rejected_{i} += 1",
+                   "    continue"]
+
+    counters = [f"rejected_{i}" for i in range(len(conditions))]
+    lines = ["def filter_all(results):",
+             *_indent(setup, 1),
+             *_indent([f"{counter} = 0" for counter in counters], 1),
+             "    kept = []",
+             "    for r in results:",
+             *_indent(checks, 2),
+             "        kept.append(r)",
+             f"    return kept, [{', '.join(counters)}]"]
+    return _build("filter_all", lines, namespace)
+
+
+def compile_transformations(transformations: Sequence[Transformation],
+                            cleaner: Optional[DataCleaner] = None,
+                            known_keys: Optional[Set[str]] = None) -> Callable[[List[Dict[str, Any]]], None]:
+    """
+    :param known_keys: keys the items are expected to have (see DataCleaner.compile_source). By default, the keys read
+    by the transformations.
+    :return: function that applies the transformations, and then the cleaner, to every item of a list, in place.
+    """
+    namespace: Dict[str, Any] = {}
+    setup, body = [], []
+    for i, tr in enumerate(transformations):
+        ref = f"_t{i}"
+        namespace[ref] = tr
+        source = tr.compile_source(ref)
+        if source is None:
+            # like Transformer._apply_transformations, items are expected to be transformed in place.
+            setup.append(f"{ref}_apply = {ref}.apply")
+            body.append(f"{ref}_apply(atribs)")
+        else:
+            setup += source[0]
+            body += source[1]
+
+    if cleaner is not None:
+        if known_keys is None:
+            known_keys = {key for tr in transformations for key in tr.input_keys or ()}
+        namespace["_cleaner"] = cleaner
+        cleaner_setup, cleaner_body = cleaner.compile_source("_cleaner", known_keys)
+        setup += cleaner_setup
+        body += cleaner_body
+
+    lines = ["def transform_all(items):",
+             *_indent(setup, 1),
+             "    for atribs in items:",
+             *_indent(body or ["pass"], 2)]
+    return _build("transform_all", lines, namespace)
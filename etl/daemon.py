@@ -0,0 +1,324 @@
+"""
+Daemon mode: a long-running process that runs a schedule of queries, keeping the setup of the ETL (database and MeLi
+API connection pools, currency factor, known items and sellers) between runs, so each run only pays for its own
+requests and loads instead of rebuilding everything.
+"""
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional, Callable
+from urllib.parse import urlparse, parse_qs
+
+from etl.etl_factory import EtlComponents, get_currency_factor, current_day_item_ids_index
+from etl.filter.index import MmapHashIndex
+from etl.loader import reset_profilers
+from utils.exceptions import ResultsNotFoundException
+from utils.tracing import span
+
+DEFAULT_INTERVAL = 3600.0
+# items and sellers stored up to this long before the previous refresh are read again, since rows get their timestamp
+# when they are inserted, but other processes may commit them later.
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+
+@dataclass
+class ScheduledQuery:
+    """
+    Query of a daemon schedule, and the status of its runs.
+    Attributes
+    ----------
+    query: str
+    interval: float
+        seconds between the start of two runs.
+    max_items: int
+    exclude_seller_id: int
+    next_run: float
+        time of the next run (by default, as soon as the daemon starts).
+    runs: int
+    failures: int
+    last_run: Optional[float]
+        start time of the last run.
+    last_duration: Optional[float]
+        seconds taken by the last run.
+    last_setup_ms: Optional[float]
+        milliseconds taken by the refresh of the warm state before the last run (None if it failed).
+    last_error: Optional[str]
+    """
+    query: str
+    interval: float
+    max_items: int
+    exclude_seller_id: int
+    next_run: float = 0.0
+    runs: int = 0
+    failures: int = 0
+    last_run: Optional[float] = None
+    last_duration: Optional[float] = None
+    last_setup_ms: Optional[float] = None
+    last_error: Optional[str] = None
+
+    def status(self) -> Dict[str, Any]:
+        return {"query": self.query, "interval": self.interval, "max_items": self.max_items,
+                "next_run_in": round(max(0.0, self.next_run - time.time()), 3),
+                "runs": self.runs, "failures": self.failures,
+                "last_run": datetime.fromtimestamp(self.last_run).isoformat() if self.last_run else None,
+                "last_duration": self.last_duration, "last_setup_ms": self.last_setup_ms,
+                "last_error": self.last_error}
+
+
+def read_schedule(path: str, max_items: int, exclude_seller_id: int,
+                  interval: float = DEFAULT_INTERVAL) -> List[ScheduledQuery]:
+    """
+    Reads a schedule file: a JSON object with a list of queries, each one a query string or an object with a query and
+    its own interval, max_items and exclude_seller_id. Top level interval, max_items and exclude_seller_id are the
+    defaults of the queries that don't define them. For example:
+    {"interval": 3600, "queries": ["Iphone 11", {"query": "Iphone 12", "interval": 600, "max_items": 500}]}
+    """
+    with open(path, encoding="utf-8") as file:
+        schedule: Dict[str, Any] = json.load(file)
+    defaults = {"interval": float(schedule.get("interval", interval)),
+                "max_items": int(schedule.get("max_items", max_items)),
+                "exclude_seller_id": int(schedule.get("exclude_seller_id", exclude_seller_id))}
+
+    queries: Dict[str, ScheduledQuery] = {}
+    for entry in schedule.get("queries", []):
+        entry = {"query": entry} if isinstance(entry, str) else entry
+        options = {key: type(default)(entry.get(key, default)) for key, default in defaults.items()}
+        # a query repeated in the file is only kept once, with its last options.
+        queries[entry["query"]] = ScheduledQuery(query=entry["query"], **options)
+    if not queries:
+        raise ValueError(f"Schedule {path} has no queries.")
+    return list(queries.values())
+
+
+class WarmEtl:
+    """
+    ETL components kept between the runs of a daemon. Before each run, their state is refreshed incrementally: the
+    items and sellers stored since the previous refresh (by this process or by others) are added to the known ones,
+    the known items are replaced by the ones of the new day when the day changes, and the currency factor is requested
+    again once it's older than currency_ttl seconds. The results registered by the filters and the time profilers are
+    reset, so each run is filtered and summarized apart.
+    Attributes
+    ----------
+    components: EtlComponents
+    currency_ttl: float
+        seconds the currency factor is reused.
+    """
+
+    def __init__(self, components: EtlComponents, currency_ttl: float = 3600.0) -> None:
+        self.components = components
+        self.currency_ttl = currency_ttl
+        self.currency_updated = time.time()
+        # the known items and sellers were read by etl_components, just before.
+        self._refreshed = components.database_client.get_database_time()
+        # days follow the clock of the database, which timestamps the stored items.
+        self.day = self._refreshed.date()
+        components.database_client.session_commit()
+
+    def _new_day(self, day: date) -> None:
+        components = self.components
+        logging.info(f"Day changed: known items of {self.day} are discarded.")
+        if isinstance(components.current_day_item_ids, MmapHashIndex):
+            # the index file is created again for the new day, so it can't be mapped meanwhile.
+            components.current_day_item_ids.close()
+        components.set_current_day_item_ids(current_day_item_ids_index(components.database_client,
+                                                                       components.item_index_path))
+        self.day = day
+
+    def refresh(self) -> float:
+        """
+        Refreshes the state of the components before a run.
+        :return: milliseconds taken.
+        """
+        t0 = time.perf_counter()
+        components = self.components
+        database_client = components.database_client
+        refreshed = database_client.get_database_time()
+        since = self._refreshed - REFRESH_OVERLAP
+        if refreshed.date() != self.day:
+            self._new_day(refreshed.date())
+        else:
+            components.current_day_item_ids.update(database_client.get_current_day_item_ids(since=since))
+        components.seller_data.update(database_client.get_sellers_data(since=since))
+        # ends the read transaction, so the next refresh doesn't read an old snapshot.
+        database_client.session_commit()
+        self._refreshed = refreshed
+
+        if components.price_converter is not None and time.time() - self.currency_updated >= self.currency_ttl:
+            currency_factor = get_currency_factor(components.meli_client)
+            if currency_factor != components.price_converter.currency_factor:
+                logging.info(f"Currency factor: {components.price_converter.currency_factor} -> {currency_factor}.")
+            components.price_converter.currency_factor = currency_factor
+            self.currency_updated = time.time()
+
+        components.item_filter.reset()
+        if components.sellers_filter is not None:
+            components.sellers_filter.reset()
+        reset_profilers()
+        return (time.perf_counter() - t0) * 1000
+
+    def status(self) -> Dict[str, Any]:
+        price_converter = self.components.price_converter
+        return {"day": self.day.isoformat(),
+                "currency_factor": price_converter.currency_factor if price_converter is not None else None,
+                "known_items": len(self.components.current_day_item_ids),
+                "known_sellers": len(self.components.seller_data)}
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    etl_daemon: "EtlDaemon"
+
+    def _reply(self, code: int, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        if urlparse(self.path).path == "/status":
+            self._reply(200, self.etl_daemon.status())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/run":
+            query = parse_qs(url.query).get("query", [None])[0]
+            triggered = self.etl_daemon.trigger(query)
+            self._reply(202 if triggered else 404, {"triggered": triggered})
+        elif url.path == "/stop":
+            self.etl_daemon.stop()
+            self._reply(202, {"stopping": True})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug(f"Control endpoint: {format % args}")
+
+
+class EtlDaemon:
+    """
+    Runs the queries of a schedule when they are due, one at a time, with the components of a WarmEtl, until it's
+    stopped. If control_port is defined, a control endpoint is served on localhost: GET /status returns the status of
+    the daemon and its queries, POST /run (or /run?query=<query>) runs every query (or one) once the current run
+    finishes, and POST /stop stops the daemon once the current run finishes.
+    Attributes
+    ----------
+    schedule: List[ScheduledQuery]
+    warm: WarmEtl
+    run_query: Callable[[ScheduledQuery], None]
+        runs the ETL process of a query, with the components of warm.
+    control_port: Optional[int]
+    """
+
+    def __init__(self, schedule: List[ScheduledQuery], warm: WarmEtl, run_query: Callable[[ScheduledQuery], None],
+                 control_port: Optional[int] = None) -> None:
+        self.schedule = schedule
+        self.warm = warm
+        self.run_query = run_query
+        self.control_port = control_port
+        self.started = time.time()
+        self.running: Optional[str] = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def trigger(self, query: Optional[str] = None) -> int:
+        """
+        Makes every query (or the given one) due.
+        :return: amount of queries triggered.
+        """
+        with self._lock:
+            scheduled = [s for s in self.schedule if query is None or s.query == query]
+            for s in scheduled:
+                s.next_run = 0.0
+        self._wakeup.set()
+        return len(scheduled)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"uptime": round(time.time() - self.started, 3), "running": self.running,
+                    "runs": sum(s.runs for s in self.schedule), **self.warm.status(),
+                    "queries": [s.status() for s in self.schedule]}
+
+    def _run(self, scheduled: ScheduledQuery) -> None:
+        t0 = time.time()
+        with self._lock:
+            self.running = scheduled.query
+            scheduled.next_run = t0 + scheduled.interval
+        setup_ms: Optional[float] = None
+        error = None
+        try:
+            # refreshing reads the database and may request the currency factor, so it can fail like the run.
+            setup_ms = self.warm.refresh()
+            with span("scheduled_run", query=scheduled.query, max_items=scheduled.max_items):
+                self.run_query(scheduled)
+        except ResultsNotFoundException:
+            logging.info(f"No new items for '{scheduled.query}'.")
+        except Exception as ex:
+            logging.exception(f"Scheduled run of '{scheduled.query}' failed.")
+            error = str(ex) or type(ex).__name__
+            self.warm.components.database_client.session_rollback()
+        duration = time.time() - t0
+
+        with self._lock:
+            self.running = None
+            scheduled.runs += 1
+            scheduled.failures += error is not None
+            scheduled.last_run, scheduled.last_duration = t0, round(duration, 3)
+            scheduled.last_setup_ms = round(setup_ms, 3) if setup_ms is not None else None
+            scheduled.last_error = error
+            # runs longer than the interval are not repeated back to back to catch up (unless it was triggered
+            # meanwhile).
+            if scheduled.next_run:
+                scheduled.next_run = max(scheduled.next_run, time.time())
+        setup = f"{round(setup_ms, 2)} ms" if setup_ms is not None else "failed"
+        logging.info(f"'{scheduled.query}' {'done' if error is None else 'failed'} in {round(duration, 2)} seconds "
+                     f"(setup: {setup}).")
+
+    def _serve(self) -> ThreadingHTTPServer:
+        handler = type("ControlHandler", (_ControlHandler,), {"etl_daemon": self})
+        server = ThreadingHTTPServer(("127.0.0.1", self.control_port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="daemon-control", daemon=True).start()
+        logging.info(f"Control endpoint listening on http://127.0.0.1:{server.server_address[1]}.")
+        return server
+
+    def run(self) -> int:
+        """
+        Runs the scheduled queries until the daemon is stopped.
+        :return: amount of runs.
+        """
+        server = self._serve() if self.control_port is not None else None
+        runs = 0
+        logging.info(f"Daemon started with {len(self.schedule)} scheduled queries.")
+        try:
+            while not self._stopped.is_set():
+                self._wakeup.clear()
+                with self._lock:
+                    now = time.time()
+                    due = sorted((s for s in self.schedule if s.next_run <= now), key=lambda s: s.next_run)
+                    next_run = min(s.next_run for s in self.schedule)
+                if not due:
+                    self._wakeup.wait(next_run - now)
+                    continue
+                for scheduled in due:
+                    if self._stopped.is_set():
+                        break
+                    self._run(scheduled)
+                    runs += 1
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        logging.info(f"Daemon stopped after {runs} runs.")
+        return runs
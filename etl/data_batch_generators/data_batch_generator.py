@@ -1,8 +1,12 @@
 import logging
+from array import array
 from copy import deepcopy
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from operator import itemgetter
+from typing import List, Dict, Any, Tuple
 
+from etl.transformations.column_batch import ColumnBatch
+from etl.transformations.item_batch import ItemBatch, IndexedColumn, CategoryColumn
 from utils.useful import drop_repeated_dicts, flat_map
 
 
@@ -23,6 +27,12 @@ class DataBatchGenerator:
     def build(self, items_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         ...
 
+    def build_batch(self, batch: ColumnBatch) -> List[Dict[str, Any]]:
+        """
+        Same as build, but reading the columns of a batch transformed by Transformer in columnar mode.
+        """
+        ...
+
 
 @dataclass
 class SellersBatchGenerator(DataBatchGenerator):
@@ -38,6 +48,11 @@ class SellersBatchGenerator(DataBatchGenerator):
         sellers = self._drop_repeated(sellers)
         return sellers
 
+    def build_batch(self, batch: ColumnBatch) -> List[Dict[str, Any]]:
+        sellers = [{"seller_id": seller_id, "completed_sales": completed_sales}
+                   for seller_id, completed_sales in zip(batch["seller_id"], batch["completed_sales"])]
+        return self._drop_repeated(sellers)
+
 
 @dataclass
 class ShippingBatchGenerator(DataBatchGenerator):
@@ -55,6 +70,12 @@ class ShippingBatchGenerator(DataBatchGenerator):
         item_shipping = self._drop_repeated(item_shipping)
         return item_shipping
 
+    def build_batch(self, batch: ColumnBatch) -> List[Dict[str, Any]]:
+        item_shipping = [{"item_id": item_id, "shipping_method": sh_meth}
+                         for item_id, shipping in zip(batch["id"], batch["shipping"])
+                         for sh_meth in shipping]
+        return self._drop_repeated(item_shipping)
+
 
 @dataclass
 class ProductsBatchGenerator(DataBatchGenerator):
@@ -77,4 +98,122 @@ class ProductsBatchGenerator(DataBatchGenerator):
                 item.pop(key, None)
 
         item_list_copy = self._drop_repeated(item_list_copy)
-        return item_list_copy
\ No newline at end of file
+        return item_list_copy
+
+    def build_batch(self, batch: ColumnBatch) -> List[Dict[str, Any]]:
+        # to_records builds new dicts, so there is no need to copy anything.
+        return self._drop_repeated(batch.drop(self.drop_keys).to_records())
+
+
+@dataclass
+class FusedBatchGenerator:
+    """
+    generator of products, item_shipping and sellers objects in a single pass over the preprocessed data. Repeated
+    objects are detected with a hash index on their natural key, and product objects are the preprocessed item dicts
+    themselves (without drop_keys), so no copies are made.
+    Attributes
+    ----------
+    drop_keys: List[str]
+        list of keys that will be removed from the item objects for generating the products.
+    product_key: Tuple[str, ...]
+        natural key of product objects.
+    item_shipping_key: Tuple[str, ...]
+        natural key of item_shipping objects.
+    seller_key: Tuple[str, ...]
+        natural key of seller objects.
+    """
+    drop_keys: List[str]
+    product_key: Tuple[str, ...] = ("id",)
+    item_shipping_key: Tuple[str, ...] = ("item_id", "shipping_method")
+    seller_key: Tuple[str, ...] = ("seller_id", "completed_sales")
+
+    def build(self, items_list: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]],
+                                                               List[Dict[str, Any]],
+                                                               List[Dict[str, Any]]]:
+        """
+        :param items_list: preprocessed items. They are modified in place.
+        :return: products, item_shipping and sellers objects.
+        """
+        products, item_shipping, sellers = [], [], []
+        product_index, item_shipping_index, seller_index = set(), set(), set()
+        len_item_shipping = 0
+        product_key, item_shipping_key, seller_key = \
+            itemgetter(*self.product_key), itemgetter(*self.item_shipping_key), itemgetter(*self.seller_key)
+
+        for item in items_list:
+            seller = {"seller_id": item["seller_id"], "completed_sales": item["completed_sales"]}
+            key = seller_key(seller)
+            if key not in seller_index:
+                seller_index.add(key)
+                sellers.append(seller)
+
+            for sh_meth in item["shipping"]:
+                len_item_shipping += 1
+                shipping = {"item_id": item["id"], "shipping_method": sh_meth}
+                key = item_shipping_key(shipping)
+                if key not in item_shipping_index:
+                    item_shipping_index.add(key)
+                    item_shipping.append(shipping)
+
+            for drop_key in self.drop_keys:
+                item.pop(drop_key, None)
+            key = product_key(item)
+            if key not in product_index:
+                product_index.add(key)
+                products.append(item)
+
+        self._log_repeated(len(items_list), len(products), len_item_shipping, len(item_shipping), len(sellers))
+        return products, item_shipping, sellers
+
+    @staticmethod
+    def _log_repeated(len_items: int, len_products: int, len_item_shipping: int, len_unique_item_shipping: int,
+                      len_sellers: int) -> None:
+        for entity, len_objects, len_unique in [("product", len_items, len_products),
+                                                ("item_shipping", len_item_shipping, len_unique_item_shipping),
+                                                ("seller", len_items, len_sellers)]:
+            if len_objects - len_unique > 0:
+                logging.warning(f"{len_objects - len_unique} {entity} registries were repeated.")
+
+    def build_compact(self, batch: ItemBatch) -> Tuple[ItemBatch, ItemBatch, List[Dict[str, Any]]]:
+        """
+        Same as build, but reading a compact batch of preprocessed items. Products and item_shipping objects are
+        compact batches too: products share the columns of the batch (only repeated products are copied out), and
+        item_shipping objects reference its item ids.
+        :return: products, item_shipping and sellers objects.
+        """
+        columns = batch.columns
+        ids, shipping = columns["id"], columns["shipping"]
+        product_columns = [columns[key] for key in self.product_key]
+        seller_id, completed_sales = columns["seller_id"], columns["completed_sales"]
+        sellers, item_shipping_index, seller_index, product_index = [], set(), set(), set()
+        product_rows = array("I")
+        shipping_items, shipping_methods = array("I"), []
+        len_item_shipping = 0
+
+        for i in range(len(batch)):
+            key = (seller_id[i], completed_sales[i])
+            if key not in seller_index:
+                seller_index.add(key)
+                sellers.append({"seller_id": key[0], "completed_sales": key[1]})
+
+            item_id = ids[i]
+            for sh_meth in shipping[i]:
+                len_item_shipping += 1
+                key = (item_id, sh_meth)
+                if key not in item_shipping_index:
+                    item_shipping_index.add(key)
+                    shipping_items.append(i)
+                    shipping_methods.append(sh_meth)
+
+            key = tuple(column[i] for column in product_columns)
+            if key not in product_index:
+                product_index.add(key)
+                product_rows.append(i)
+
+        products = batch.drop(self.drop_keys)
+        if len(product_rows) < len(batch):
+            products = products.take(product_rows)
+        item_shipping = ItemBatch({"item_id": IndexedColumn(ids, shipping_items),
+                                   "shipping_method": CategoryColumn.build(shipping_methods)}, len(shipping_items))
+        self._log_repeated(len(batch), len(products), len_item_shipping, len(item_shipping), len(sellers))
+        return products, item_shipping, sellers
@@ -1,57 +1,248 @@
-from typing import Tuple
+import logging
+from dataclasses import dataclass
+from datetime import date
+from typing import Tuple, Optional, Callable, MutableSet, Set
 
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
 from database.client import DatabaseClient
-from meli.api_client import MLApiClient
-from etl.cleaner.data_cleaner import DataCleaner
-from etl.data_batch_generators.data_batch_generator import SellersBatchGenerator, ShippingBatchGenerator, \
-    ProductsBatchGenerator
-from etl.extractor import Extractor
-from etl.filter.condition import NotNewProduct, ItemAlreadyStored, SellerAlreadyStored
+from database.spool import Spool
+from meli.api_client import MLApiClient, API_URL
+from meli.archive import ResponseArchive
+from meli.cache import ResponseCache
+from etl.extractor import Extractor, ATTRIBUTES_MAX_WORKERS
+from etl.filter.condition import ItemAlreadyStored
 from etl.filter.filter import Filter
+from etl.filter.index import MmapHashIndex
 from etl.loader import Loader
-from etl.transformations.transformations import HandleNoWarrantyString, PriceConverter, InsertSellerID, ShippingMethods, \
-    InsertSellerCompletedSales
+from etl.pipeline_spec import PipelineSpec, DEFAULT_PIPELINE_SPEC
+from etl.transformations.transformations import PriceConverter
 from etl.transformer import Transformer
+from utils.time_profilers import current_run_id
 
 
-def etl_factory(session: Session) -> Tuple[Extractor, Transformer, Loader]:
+def build_transformer(currency_factor: float, sellers_filter: Optional[Filter], columnar: bool = False,
+                      pipeline_spec: Optional[PipelineSpec] = None,
+                      item_keys: Optional[Set[str]] = None, compact_items: bool = False) -> Transformer:
+    pipeline_spec = pipeline_spec or PipelineSpec.from_dict(DEFAULT_PIPELINE_SPEC)
+    return pipeline_spec.build_transformer({"currency_factor": currency_factor}, sellers_filter=sellers_filter,
+                                           columnar=columnar, item_keys=item_keys, compact=compact_items)
+
+
+def get_currency_factor(meli_client: MLApiClient) -> float:
+    """
+    :return: current conversion ratio of the item prices (BRL) to USD.
+    """
+    return meli_client.get_currency_conv_rate(from_currency_id="BRL", to_currenc_id="USD").json()["ratio"]
+
+
+@dataclass
+class EtlComponents:
+    """
+    Extractor, Transformer and Loader of an ETL Pipeline, with the clients and the state they share. Long-running
+    processes keep them between runs, and refresh their state (see etl.daemon.WarmEtl).
+    Attributes
+    ----------
+    meli_client: MLApiClient
+    database_client: DatabaseClient
+    extractor: Extractor
+    transformer: Transformer
+    loader: Loader
+    item_filter: Filter
+        filter of the search results (its ItemAlreadyStored condition reads current_day_item_ids).
+    sellers_filter: Optional[Filter]
+        filter of the sellers (its SellerAlreadyStored condition reads seller_data).
+    price_converter: Optional[PriceConverter]
+        transformation that converts prices with the currency factor.
+    current_day_item_ids: MutableSet[str]
+        ids of the items stored in the current day (a set, or a MmapHashIndex).
+    seller_data: MutableSet[Tuple[int, int]]
+        (seller_id, completed_sales) stored in database.
+    item_index_path: Optional[str]
+        path of the MmapHashIndex, if the item ids are kept in one.
+    """
+    meli_client: MLApiClient
+    database_client: DatabaseClient
+    extractor: Extractor
+    transformer: Transformer
+    loader: Loader
+    item_filter: Filter
+    sellers_filter: Optional[Filter]
+    price_converter: Optional[PriceConverter]
+    current_day_item_ids: MutableSet[str]
+    seller_data: MutableSet[Tuple[int, int]]
+    item_index_path: Optional[str] = None
+
+    def close(self) -> None:
+        """
+        Closes the MeLi API client (with its cache and archive) and the index of item ids, if any.
+        """
+        self.meli_client.close()
+        if isinstance(self.current_day_item_ids, MmapHashIndex):
+            self.current_day_item_ids.close()
+
+    def set_current_day_item_ids(self, current_day_item_ids: MutableSet[str]) -> None:
+        """
+        Replaces the ids of the items stored in the current day (for instance, by the index of a new day) in every
+        component that reads them.
+        """
+        self.current_day_item_ids = current_day_item_ids
+        self.loader.known_item_ids = current_day_item_ids
+        for cond in self.item_filter.conditions:
+            if isinstance(cond, ItemAlreadyStored):
+                cond.current_day_item_ids = current_day_item_ids
+
+
+def current_day_item_ids_index(database_client: DatabaseClient,
+                               item_index_path: Optional[str] = None) -> MutableSet[str]:
+    """
+    :return: ids of the items stored in the current day, in a MmapHashIndex of item_index_path (if defined), or a set.
+    A reused index is rebuilt if it doesn't have as many items as the ones stored in the current day (for instance,
+    because the database was recreated, or other processes stored items without it).
+    """
+    if item_index_path:
+        current_day_item_ids = MmapHashIndex(item_index_path, day=database_client.current_day())
+        if not current_day_item_ids.is_new:
+            stored = database_client.count_current_day_items()
+            if stored != len(current_day_item_ids):
+                logging.warning(f"Index {item_index_path} has {len(current_day_item_ids)} items, but {stored} were "
+                                f"stored today: it's built again.")
+                current_day_item_ids.clear()
+                current_day_item_ids.is_new = True
+        if current_day_item_ids.is_new:
+            current_day_item_ids.update(database_client.get_current_day_item_ids())
+        return current_day_item_ids
+    return set(database_client.get_current_day_item_ids())
+
+
+def stored_items_and_sellers(database_client: DatabaseClient, item_index_path: Optional[str] = None,
+                             spool_dir: Optional[str] = None) -> Tuple[MutableSet[str], MutableSet[Tuple[int, int]]]:
+    """
+    :return: ids of the items stored in the current day (see current_day_item_ids_index), and (seller_id,
+    completed_sales) of the sellers stored in database. If batches are spooled into spool_dir and the database can't
+    be reached, none of them is known (the index, if any, is opened as it is): the run goes on, and its batches are
+    kept in the spool until a later run loads them. Spooled batches are merged, so the items and sellers found again
+    are stored only once.
+    """
+    try:
+        return current_day_item_ids_index(database_client, item_index_path), set(database_client.get_sellers_data())
+    except OperationalError as ex:
+        if not spool_dir:
+            raise
+        database_client.session_rollback()
+        logging.warning(f"Couldn't read the stored items and sellers from database, batches will be kept in "
+                        f"{spool_dir} until they can be loaded: {ex}")
+        if item_index_path:
+            return MmapHashIndex(item_index_path, day=date.today()), set()
+        return set(), set()
+
+
+def etl_components(session: Session, max_concurrent_requests: Optional[int] = None,
+                   cache_path: Optional[str] = None, columnar: bool = False,
+                   item_index_path: Optional[str] = None, upsert: bool = False,
+                   chunk_size: int = 1000, spool_dir: Optional[str] = None, adaptive_concurrency: bool = False,
+                   max_requests_per_second: Optional[float] = None,
+                   api_url: str = API_URL, record_dir: Optional[str] = None,
+                   project_payloads: bool = True, aggregates: bool = True,
+                   pipeline_spec: Optional[PipelineSpec] = None, compact_items: bool = False) -> EtlComponents:
+    """
+    Builds objects for making an ETL Pipeline. Parameters as in etl_factory.
+    """
+
+    meli_client = MLApiClient(country_ml="MLB", pool_maxsize=max_concurrent_requests or ATTRIBUTES_MAX_WORKERS,
+                              cache=ResponseCache(cache_path) if cache_path else None,
+                              adaptive_concurrency=adaptive_concurrency,
+                              max_requests_per_second=max_requests_per_second, api_url=api_url,
+                              archive=ResponseArchive(record_dir, current_run_id()) if record_dir else None)
+    database_client = DatabaseClient(session=session)
+
+    current_day_item_ids, seller_data = stored_items_and_sellers(database_client, item_index_path, spool_dir)
+
+    pipeline_spec = pipeline_spec or PipelineSpec.from_dict(DEFAULT_PIPELINE_SPEC)
+    state = {"current_day_item_ids": current_day_item_ids, "seller_data": seller_data,
+             "currency_factor": get_currency_factor(meli_client)}
+    item_filter = pipeline_spec.build_item_filter(state)
+    sellers_filter = pipeline_spec.build_sellers_filter(state)
+    # besides the keys read by the transformations, the items have the ones read by the filter.
+    transformer = pipeline_spec.build_transformer(state, sellers_filter=sellers_filter, columnar=columnar,
+                                                  item_keys=item_filter.input_keys(), compact=compact_items)
+
+    fields = None
+    if project_payloads and item_filter.input_keys() is not None and transformer.input_keys() is not None:
+        # the id is also needed for requesting the warranty of each item.
+        fields = item_filter.input_keys() | transformer.input_keys() | {"id"}
+    extractor = Extractor(meli_client, _filter=item_filter, max_concurrent_requests=max_concurrent_requests,
+                          fields=fields)
+
+    loader = Loader(database_client=database_client, known_item_ids=current_day_item_ids,
+                    upsert=upsert, chunk_size=chunk_size, spool=Spool(spool_dir) if spool_dir else None,
+                    aggregates=aggregates)
+
+    price_converter = next((t for t in transformer.transformations if isinstance(t, PriceConverter)), None)
+    return EtlComponents(meli_client=meli_client, database_client=database_client, extractor=extractor,
+                         transformer=transformer, loader=loader, item_filter=item_filter,
+                         sellers_filter=sellers_filter, price_converter=price_converter,
+                         current_day_item_ids=current_day_item_ids, seller_data=seller_data,
+                         item_index_path=item_index_path)
+
+
+def etl_factory(session: Session, max_concurrent_requests: Optional[int] = None,
+                cache_path: Optional[str] = None, columnar: bool = False,
+                item_index_path: Optional[str] = None, upsert: bool = False,
+                chunk_size: int = 1000, spool_dir: Optional[str] = None, adaptive_concurrency: bool = False,
+                max_requests_per_second: Optional[float] = None,
+                api_url: str = API_URL, record_dir: Optional[str] = None,
+                project_payloads: bool = True, aggregates: bool = True,
+                pipeline_spec: Optional[PipelineSpec] = None,
+                compact_items: bool = False) -> Tuple[Extractor, Transformer, Loader]:
     """
     Builds objects for making an ETL Pipeline.
     :param session: SQLAlchemy session.
+    :param max_concurrent_requests: if defined, search pages are requested concurrently with this limit.
+    :param cache_path: if defined, MeLi API responses are cached in this SQLite file.
+    :param columnar: if True, transformations are applied to columnar batches instead of item by item.
+    :param item_index_path: if defined, the ids of the items stored in the current day are kept in this memory-mapped
+    file, so later runs don't need to read them from database.
+    :param upsert: if True, each batch is loaded in a single transaction with bulk upserts.
+    :param chunk_size: max amount of rows per upsert statement.
+    :param spool_dir: if defined, batches are spooled into this directory and bulk loaded from there.
+    :param adaptive_concurrency: if True, the requests in flight to each MeLi API endpoint are limited adaptively.
+    :param max_requests_per_second: if defined, max rate of requests to MeLi API.
+    :param api_url: base url of MeLi API (or of a stand-in of it).
+    :param record_dir: if defined, the raw responses of the run are recorded in an archive of this directory.
+    :param project_payloads: if True, only the keys of the search results needed by the filter, the transformations and
+    the cleaner are decoded.
+    :param aggregates: if True, the best seller aggregates are updated by every load.
+    :param pipeline_spec: conditions, transformations and kept keys of the pipeline. By default, DEFAULT_PIPELINE_SPEC.
+    :param compact_items: if True, transformed items are kept in compact column batches until they are loaded,
+    instead of one dict per item.
     :return: A tuple of Extractor, Transformer and Loader.
     """
 
-    meli_client = MLApiClient(country_ml="MLB")
+    components = etl_components(session, max_concurrent_requests=max_concurrent_requests, cache_path=cache_path,
+                                columnar=columnar, item_index_path=item_index_path, upsert=upsert,
+                                chunk_size=chunk_size, spool_dir=spool_dir, adaptive_concurrency=adaptive_concurrency,
+                                max_requests_per_second=max_requests_per_second, api_url=api_url,
+                                record_dir=record_dir, project_payloads=project_payloads, aggregates=aggregates,
+                                pipeline_spec=pipeline_spec, compact_items=compact_items)
+    return components.extractor, components.transformer, components.loader
+
+
+def replay_factory(session: Session, columnar: bool = False, chunk_size: int = 1000,
+                   spool_dir: Optional[str] = None, aggregates: bool = True,
+                   pipeline_spec: Optional[PipelineSpec] = None,
+                   compact_items: bool = False) -> Tuple[Callable[[float], Transformer], Loader]:
+    """
+    Builds objects for replaying recorded runs (see etl.replay.ArchiveReplayer). The replayed items are usually stored
+    already, so they are loaded with upserts (unless they are spooled).
+    :return: A tuple of a function that builds the Transformer of a currency factor (the one recorded by each run), and
+    the Loader.
+    """
     database_client = DatabaseClient(session=session)
-    currency_factor = meli_client.get_currency_conv_rate(from_currency_id="BRL",
-                                                         to_currenc_id="USD").json()["ratio"]
-
-    current_day_item_ids = database_client.get_current_day_item_ids()
-    seller_data = database_client.get_sellers_data()
-
-    extractor = Extractor(meli_client,
-                          _filter=Filter(
-                              conditions=[
-                                  ItemAlreadyStored(current_day_item_ids=current_day_item_ids),
-                                  NotNewProduct()]
-                          ))
-
-    transformer = Transformer(
-        transformations=[HandleNoWarrantyString(no_warranty_strings=["Sem garantia"]),
-                         PriceConverter(currency_factor=currency_factor),
-                         InsertSellerID(),
-                         InsertSellerCompletedSales(),
-                         ShippingMethods()],
-        preprocessed_data_cleaner=DataCleaner(relevant_keys=(["id", "title", "sold_quantity", "shipping",
-                                                              "price", "warranty", "seller_id", "completed_sales"])),
-        sellers_generator=SellersBatchGenerator(),
-        shipping_generator=ShippingBatchGenerator(),
-        products_generator=ProductsBatchGenerator(drop_keys=["shipping"]),
-        sellers_filter=Filter(conditions=[SellerAlreadyStored(seller_data=seller_data)])
-    )
-
-    loader = Loader(database_client=database_client)
-
-    return extractor, transformer, loader
+    pipeline_spec = pipeline_spec or PipelineSpec.from_dict(DEFAULT_PIPELINE_SPEC)
+    sellers_filter = pipeline_spec.build_sellers_filter({"seller_data": set(database_client.get_sellers_data())})
+    loader = Loader(database_client=database_client, upsert=not spool_dir, chunk_size=chunk_size,
+                    spool=Spool(spool_dir) if spool_dir else None, aggregates=aggregates)
+    return lambda currency_factor: build_transformer(currency_factor, sellers_filter, columnar, pipeline_spec,
+                                                     compact_items=compact_items), loader
@@ -1,15 +1,41 @@
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Dict, Any, Optional
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Callable, Collection, Iterable
 
-from requests import Response
+from requests import Response, RequestException
 
-from meli.api_client import MLApiClient
+from meli.api_client import MLApiClient, MULTIGET_MAX_IDS, match_multiget_entries
+from meli.decoding import decode_search_results, loads
+from etl.checkpoint import RunCheckpoint
 from etl.filter.filter import Filter
 from utils.decorators import _time_profiling
 from utils.exceptions import ResultsNotFoundException
 from utils.time_profilers import ExtractTimeProfiler
-from utils.useful import check_status_response
+from utils.tracing import span, propagate
+from utils.useful import check_status_response, chunked
+
+SEARCH_PAGE_SIZE = 50
+ATTRIBUTES_MAX_WORKERS = 10
+
+
+@dataclass
+class SearchPage:
+    """
+    Filtered results of a search page.
+    Attributes
+    ----------
+    offset: int
+        offset of the page in the search results.
+    results: List[Dict[str, Any]]
+    failed: bool
+        True if the page couldn't be obtained (no more pages are requested after it).
+    """
+    offset: int
+    results: List[Dict[str, Any]]
+    failed: bool = False
 
 
 class Extractor:
@@ -22,11 +48,20 @@ class Extractor:
         client for requesting data to MeLi API.
     _filter: Optional[Filter]
         results filter. To every item object found, a filter would be applied according to a list of Condition.
+    max_concurrent_requests: Optional[int]
+        if defined, search pages are requested concurrently (asyncio), with at most this amount of requests in flight.
+        Otherwise, pages are requested one after the other. It also bounds the item attributes requests in flight.
+    fields: Optional[Collection[str]]
+        if defined, only these keys of the search results are decoded (the ones needed by the filter, the
+        transformations and the cleaner), and only the results are requested (not the paging and available filters).
     """
 
-    def __init__(self, ml_api_client: MLApiClient, _filter: Optional[Filter]) -> None:
+    def __init__(self, ml_api_client: MLApiClient, _filter: Optional[Filter],
+                 max_concurrent_requests: Optional[int] = None, fields: Optional[Collection[str]] = None) -> None:
         self.ml_api_client = ml_api_client
         self._filter = _filter
+        self.max_concurrent_requests = max_concurrent_requests
+        self.fields = fields
 
     def _apply_filter(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         return self._filter.apply_to_all(results)
@@ -34,31 +69,204 @@ class Extractor:
     def _get_warranty_for_all(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         The warranty is not included in the response of the endpoint https://api.mercadolibre.com/sites/<country_ml>/search/...
-        So this method uses the ml_api_client for requesting items attributes. Then, for each item grabs the 'warranty'
-        attribute and inserts it in the item dictionary.
+        So this method uses the ml_api_client for requesting items attributes, in chunks of MULTIGET_MAX_IDS ids per
+        request. Then, for each item grabs the 'warranty' attribute and inserts it in the item dictionary.
+        Items whose attributes couldn't be obtained are reported and left out, so they can be requested again in a
+        later run.
         :param results: List of items.
         :return: List of items with warranty
         """
+        items_by_id: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for item in results:
+            items_by_id[item["id"]].append(item)
 
-        executor = ThreadPoolExecutor(max_workers=100)
+        failed_ids = set()
 
-        def get_attributes(item: Dict[str, Any]):
-            resp = self.ml_api_client.request_to_item_attributes_api(item_id=item["id"])
-            check_status_response(resp)
-            item["warranty"] = resp.json()["warranty"]
+        def report_failure(item_id: str, detail: Any) -> None:
+            failed_ids.add(item_id)
+            logging.warning(f"Couldn't get attributes of item {item_id}. Detail: {detail}")
 
-        _ = [executor.submit(get_attributes, item) for item in results]
-        executor.shutdown()
+        chunks = list(chunked(list(items_by_id), MULTIGET_MAX_IDS))
+        with span("extract:attributes", items=len(items_by_id), requests=len(chunks)) as s, \
+                ThreadPoolExecutor(max_workers=self.max_concurrent_requests or ATTRIBUTES_MAX_WORKERS) as executor:
+            request = propagate(self.ml_api_client.request_to_items_multiget_api)
+            futures = {executor.submit(request, item_ids=chunk, attributes=["id", "warranty"]): chunk
+                       for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    resp = future.result()
+                    check_status_response(resp)
+                    entries = loads(resp.content)
+                except (RequestException, ValueError) as ex:
+                    for item_id in chunk:
+                        report_failure(item_id, ex)
+                    continue
+
+                matched = match_multiget_entries(chunk, entries)
+                for item_id in chunk:
+                    entry = matched.get(item_id)
+                    if entry is None:
+                        report_failure(item_id, "not included in the multiget response.")
+                        continue
+                    if entry.get("code") != 200:
+                        report_failure(item_id, f"status code: {entry.get('code')}. {entry.get('body')}")
+                        continue
+                    for item in items_by_id[item_id]:
+                        item["warranty"] = entry["body"].get("warranty")
+            s.set("failed", len(failed_ids))
+
+        if failed_ids:
+            logging.warning(f"{len(failed_ids)} items were left out because their attributes couldn't be obtained.")
+            results = [item for item in results if item["id"] not in failed_ids]
 
         return results
 
+    def register_extracted(self, items: List[Dict[str, Any]],
+                           registered: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Registers items extracted by a previous run (that were not loaded yet) in the filter, so they are discarded if
+        they are found again.
+        :param registered: if defined, the registered items are appended to it (see search).
+        """
+        if self._filter:
+            for item in items:
+                if self._filter.register(item) and registered is not None:
+                    registered.append(item)
+
+    def release(self, items: Iterable[Dict[str, Any]]) -> None:
+        """
+        Forgets items registered by a search that weren't loaded (because the run failed, or they were left out), so
+        later searches of the process can find them again.
+        """
+        if self._filter:
+            self._filter.release(items)
+
+    def log_summary(self) -> None:
+        """
+        Logs how many search results the filter rejected since the previous summary.
+        """
+        if self._filter:
+            self._filter.log_summary()
+
     @staticmethod
     def _check_if_items(len_items_list: int):
         if len_items_list == 0:
             raise ResultsNotFoundException("No new items were found in ML Search API.")
 
+    def _process_page(self, resp: Response, offset: int,
+                      registered: Optional[List[Dict[str, Any]]] = None) -> Optional[SearchPage]:
+        """
+        Filters the results of a search page. Items that were already found in a previous page are also discarded.
+        :param registered: if defined, the results registered in the filter are appended to it.
+        :return: the filtered page (a failed one, on errors), or None if there are no more pages to request.
+        """
+        if resp.status_code != 200:
+            logging.warning(f"status code: {resp.status_code}. Detail: {resp.json()}")
+            return SearchPage(offset=offset, results=[], failed=True)
+        results = decode_search_results(resp.content, self.fields)
+        batch_len = len(results)
+        if batch_len == 0:
+            return None
+
+        if self._filter:
+            with span("extract:filter", offset=offset, received=batch_len) as s:
+                results = self._apply_filter(results)
+                results = [r for r in results if self._filter.register(r)]
+                if registered is not None:
+                    registered += results
+                s.set("kept", len(results))
+
+        after_filter_batch_len = len(results)
+        logging.info(f"{batch_len} items were received and {batch_len - after_filter_batch_len} were filtered.")
+        return SearchPage(offset=offset, results=results)
+
+    def _request_page(self, query: str, exclude_seller_id: int, offset: int,
+                      registered: Optional[List[Dict[str, Any]]] = None) -> Optional[SearchPage]:
+        with span("extract:search page", offset=offset) as s:
+            resp: Response = self.ml_api_client.request_to_search_api(
+                query, exclude_seller_id, offset, SEARCH_PAGE_SIZE, attributes=["results"] if self.fields else None)
+            page = self._process_page(resp, offset, registered)
+            s.set("items", len(page.results) if page else 0)
+            return page
+
+    def _pages_sequential(self, query: str, exclude_seller_id: int, max_items: int,
+                          start_offset: int = 0, collected: int = 0,
+                          registered: Optional[List[Dict[str, Any]]] = None) -> Iterator[SearchPage]:
+        offset = start_offset
+        while collected < max_items:
+            page = self._request_page(query, exclude_seller_id, offset, registered)
+            if page is None:
+                return
+            collected += len(page.results)
+            yield page
+            if page.failed:
+                return
+            offset = offset + SEARCH_PAGE_SIZE
+
+    async def _pages_concurrent(self, query: str, exclude_seller_id: int, max_items: int,
+                                start_offset: int = 0, collected: int = 0,
+                                registered: Optional[List[Dict[str, Any]]] = None) -> AsyncIterator[SearchPage]:
+        """
+        Requests offset windows of the search API concurrently, keeping at most max_concurrent_requests windows in
+        flight. Every page is requested and filtered in a thread pool as soon as it arrives (the blocking ml_api_client
+        call keeps its request time profiling), and pages are yielded in offset order. No new windows are requested
+        once max_items items were collected or a page came back empty (or with an error).
+        """
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrent_requests)
+        in_flight: Dict[int, asyncio.Future] = {}
+        request_page = propagate(self._request_page)
+        next_offset = start_offset
+        try:
+            while True:
+                while len(in_flight) < self.max_concurrent_requests and collected < max_items:
+                    in_flight[next_offset] = loop.run_in_executor(executor, request_page,
+                                                                  query, exclude_seller_id, next_offset, registered)
+                    next_offset += SEARCH_PAGE_SIZE
+                if not in_flight:
+                    return
+                page = await in_flight.pop(min(in_flight))
+                if page is None:
+                    # pages placed after an empty (or failed) page are discarded.
+                    return
+                collected += len(page.results)
+                yield page
+                if page.failed:
+                    return
+        finally:
+            for future in in_flight.values():
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _iter_pages(self, query: str, exclude_seller_id: int, max_items: int,
+                    start_offset: int = 0, collected: int = 0,
+                    registered: Optional[List[Dict[str, Any]]] = None) -> Iterator[SearchPage]:
+        """
+        Yields the filtered search pages, from start_offset, until max_items items were collected (counting the
+        already collected ones) or there are no more pages. The last page is a failed one if the search couldn't go
+        on. In concurrent mode, the windows in flight keep being requested while the caller consumes a page, but no
+        new ones are requested until the next page is consumed.
+        """
+        if not self.max_concurrent_requests:
+            yield from self._pages_sequential(query, exclude_seller_id, max_items, start_offset, collected, registered)
+            return
+
+        loop = asyncio.new_event_loop()
+        pages = self._pages_concurrent(query, exclude_seller_id, max_items, start_offset, collected, registered)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(pages.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(pages.aclose())
+            loop.close()
+
     @_time_profiling(ExtractTimeProfiler)
-    def search(self, query: str, exclude_seller_id: int, max_items: int = 200) -> List[Dict[str, Any]]:
+    def search(self, query: str, exclude_seller_id: int, max_items: int = 200,
+               registered: Optional[List[Dict[str, Any]]] = None, log_summary: bool = True) -> List[Dict[str, Any]]:
         """
         Uses the ml_api_client for requesting products information, according to the input params. Also uses the _filter
          (if it was defined in the object constructor) for discarding useless products (for example, 'used' products or
@@ -66,38 +274,20 @@ class Extractor:
         :param query: query param related to item title. For example: 'Samsung Galaxy'
         :param exclude_seller_id: exclude results of items that belongs to that seller.
         :param max_items: max amount of items that will be returned.
+        :param registered: if defined, the items registered in the filter are appended to it, so the ones that end up
+        not being loaded can be released (see release).
+        :param log_summary: if False, the summary of the filtered results is not logged (see log_summary), for instance
+        when several searches share the filter at the same time.
         :return: List of items with useful attributes (item_id, item_title, seller, warranty, etc.)
         """
         item_list = []
-        offset = 0
-        step = 50
-        limit = 50
-        len_item_list = 0
-        #received = 0
-        while len_item_list < max_items:
-            resp: Response = self.ml_api_client.request_to_search_api(query, exclude_seller_id, offset, limit)
-            if resp.status_code != 200:
-                logging.warning(f"status code: {resp.status_code}. Detail: {resp.json()}")
-                break
-            results = resp.json()["results"]
-            batch_len = len(results)
-            if batch_len == 0:
-                break
-
-            if self._filter:
-                results = self._apply_filter(results)
-
-            after_filter_batch_len = len(results)
-            item_list += results
-            len_item_list = len(item_list)
-            logging.info(f"{len_item_list}/{max_items} items. {batch_len} items were received and {batch_len - after_filter_batch_len} were filtered.")
-            offset = offset + step
-
-            #received += batch_len
-            #if received >= max_items:
-            #    logging.warning(f"{received} items were received and {len_item_list} will be processed.")
-            #    break
+        for page in self._iter_pages(query, exclude_seller_id, max_items, registered=registered):
+            item_list += page.results
+            logging.info(f"{len(item_list)}/{max_items} items.")
+        if log_summary:
+            self.log_summary()
 
+        len_item_list = len(item_list)
         self._check_if_items(len_item_list)
 
         if len_item_list > max_items:
@@ -107,3 +297,65 @@ class Extractor:
         item_list = self._get_warranty_for_all(item_list)
 
         return item_list
+
+    def iter_search_batches(self, query: str, exclude_seller_id: int, max_items: int = 200,
+                            batch_size: int = 200,
+                            checkpoint: Optional[RunCheckpoint] = None,
+                            registered: Optional[List[Dict[str, Any]]] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Streaming version of search: instead of returning every item at once, yields batches of at most batch_size
+        items (with warranty) as soon as enough search pages were received. So only a few batches are kept in memory,
+        no matter max_items.
+        :param query: query param related to item title. For example: 'Samsung Galaxy'
+        :param exclude_seller_id: exclude results of items that belongs to that seller.
+        :param max_items: max amount of items that will be yielded.
+        :param batch_size: max amount of items of each batch.
+        :param checkpoint: if defined, the search goes on from its last checkpoint, and every batch is saved in it
+        (with the offset where the search must be resumed) before being yielded.
+        :param registered: as in search.
+        """
+        buffer = []
+        # [page offset, amount of its items in the buffer]: a resumed search starts at the first page with buffered items.
+        segments: List[List[int]] = []
+        yielded = checkpoint.items_extracted if checkpoint else 0
+        next_offset = checkpoint.next_offset if checkpoint else 0
+        failed = False
+
+        def next_batch(size: int) -> List[Dict[str, Any]]:
+            nonlocal buffer, yielded
+            batch, buffer = buffer[:size], buffer[size:]
+            pending = len(batch)
+            while pending:
+                taken = min(pending, segments[0][1])
+                segments[0][1] -= taken
+                pending -= taken
+                if segments[0][1] == 0:
+                    segments.pop(0)
+            yielded += len(batch)
+            logging.info(f"{yielded}/{max_items} items.")
+            items = self._get_warranty_for_all(batch)
+            if checkpoint:
+                checkpoint.batch_extracted(items, fetched=len(batch),
+                                           next_offset=segments[0][0] if segments else next_offset)
+            return items
+
+        for page in self._iter_pages(query, exclude_seller_id, max_items, start_offset=next_offset, collected=yielded,
+                                     registered=registered):
+            failed = page.failed
+            next_offset = page.offset if failed else page.offset + SEARCH_PAGE_SIZE
+            results = page.results[:max_items - yielded - len(buffer)]
+            if results:
+                buffer += results
+                segments.append([page.offset, len(results)])
+            while len(buffer) >= batch_size:
+                yield next_batch(batch_size)
+            if yielded + len(buffer) >= max_items:
+                break
+        self.log_summary()
+
+        if buffer:
+            yield next_batch(len(buffer))
+
+        if checkpoint:
+            checkpoint.extraction_finished(completed=not failed)
+        self._check_if_items(yielded)
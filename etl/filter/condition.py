@@ -1,42 +1,125 @@
-import logging
-from dataclasses import dataclass
-from typing import Dict, Any, List, Tuple
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Any, Tuple, Collection, Set, Optional, ClassVar, List
 
 
 @dataclass
 class Condition:
+    # keys read by the condition. None means that it may need any key of the result.
+    input_keys: ClassVar[Optional[Tuple[str, ...]]] = None
 
     def satisfies(self, result: Dict[str, Any]) -> bool:
         ...
 
+    def register(self, result: Dict[str, Any]) -> bool:
+        """
+        Lets stateful conditions remember a result that passed the filter, so an equal result found later in the same
+        run (for example, in a later page or batch) is discarded.
+        :return: False if the result had already been registered.
+        """
+        return True
+
+    def release(self, result: Dict[str, Any]) -> None:
+        """
+        Forgets a registered result that wasn't loaded (for instance, because its load failed), so it can be found
+        again by a later search of the process.
+        """
+
+    def reset(self) -> None:
+        """
+        Forgets the registered results, once the run they belong to finished (for long-running processes).
+        """
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], str]]:
+        """
+        Source code of the condition, for compiled filters (see etl.codegen). The condition is bound to the name ref.
+        :return: lines run once per list of results (they may define names prefixed by ref), and an expression of the
+        result r that is true if r satisfies the condition. None if the condition can't be compiled (satisfies is
+        called instead).
+        """
+        return None
+
 
 @dataclass
 class NotNewProduct(Condition):
+    input_keys = ("condition",)
 
     def satisfies(self, result: Dict[str, Any]) -> bool:
-        if result["condition"] == "new":
-            return True
-        logging.warning(f"item {result['id']} is not new. Will be filtered.")
-        return False
+        return result["condition"] == "new"
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], str]]:
+        return [], 'r["condition"] == "new"'
 
 
 @dataclass
 class ItemAlreadyStored(Condition):
-    current_day_item_ids: List[str]
+    """
+    Discards items that were already stored in database during the current day.
+    Attributes
+    ----------
+    current_day_item_ids: Collection[str]
+        index of the item ids stored in the current day (a set, or a persisted MmapHashIndex).
+    """
+    input_keys = ("id",)
+    current_day_item_ids: Collection[str]
+    _registered: Set[str] = field(default_factory=set, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
 
     def satisfies(self, result: Dict[str, Any]) -> bool:
-        if result["id"] not in self.current_day_item_ids:
+        return result["id"] not in self.current_day_item_ids
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], str]]:
+        # the index is read on every call, since it's replaced when the day changes.
+        return [f"{ref}_ids = {ref}.current_day_item_ids"], f'r["id"] not in {ref}_ids'
+
+    def register(self, result: Dict[str, Any]) -> bool:
+        with self._lock:
+            if result["id"] in self._registered:
+                return False
+            self._registered.add(result["id"])
             return True
-        logging.warning(f"item {result['id']} has already been stored in database. Will be filtered.")
-        return False
+
+    def release(self, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._registered.discard(result["id"])
+
+    def reset(self) -> None:
+        with self._lock:
+            self._registered.clear()
+
 
 @dataclass
 class SellerAlreadyStored(Condition):
-    seller_data: List[Tuple[int, int]]
+    """
+    Discards sellers that are already in database and haven't changed their completed sales.
+    Attributes
+    ----------
+    seller_data: Collection[Tuple[int, int]]
+        index of the (seller_id, completed_sales) stored in database.
+    """
+    input_keys = ("seller_id", "completed_sales")
+    seller_data: Collection[Tuple[int, int]]
+    _registered: Set[Tuple[int, int]] = field(default_factory=set, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
 
     def satisfies(self, seller: Dict[str, Any]) -> bool:
-        if (seller["seller_id"], seller["completed_sales"]) not in self.seller_data:
+        return (seller["seller_id"], seller["completed_sales"]) not in self.seller_data
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], str]]:
+        return [f"{ref}_data = {ref}.seller_data"], f'(r["seller_id"], r["completed_sales"]) not in {ref}_data'
+
+    def register(self, seller: Dict[str, Any]) -> bool:
+        with self._lock:
+            key = (seller["seller_id"], seller["completed_sales"])
+            if key in self._registered:
+                return False
+            self._registered.add(key)
             return True
-        logging.warning(f"Seller {seller['seller_id']} is already in database and doesn't have changed its completed sales"
-                        f". This registry will be filtered.")
-        return False
+
+    def release(self, seller: Dict[str, Any]) -> None:
+        with self._lock:
+            self._registered.discard((seller["seller_id"], seller["completed_sales"]))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._registered.clear()
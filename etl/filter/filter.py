@@ -1,27 +1,165 @@
-from dataclasses import dataclass
-from typing import List, Dict, Any
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Set, Callable, Tuple, Iterable
 
+from etl.codegen import compile_conditions
 from etl.filter.condition import Condition
 
 
+@dataclass
+class ConditionStats:
+    """
+    Measured behaviour of a condition: how many results it evaluated and rejected, and how long it took (only a
+    sample of the evaluations is timed).
+    """
+    evaluations: int = 0
+    rejections: int = 0
+    timed_evaluations: int = 0
+    time: float = 0.0
+
+    @property
+    def rank(self) -> float:
+        """
+        Expected cost for rejecting a result. Evaluating the conditions by ascending rank minimizes the amount of work
+        spent on the results that are rejected.
+        """
+        cost = self.time / self.timed_evaluations if self.timed_evaluations else 0.0
+        rejection_rate = self.rejections / self.evaluations if self.evaluations else 0.0
+        return cost / max(rejection_rate, 1e-6)
+
+
 #########################################################################
 
 @dataclass
 class Filter:
     """
-    To every item object found, a filter would be applied according to a list of Condition.
+    To every item object found, a filter would be applied according to a list of Condition. Conditions are evaluated in
+    the order that rejects results with less work, according to their measured cost and selectivity, and rejections are
+    counted (see log_summary) instead of being logged one by one. Filters can be shared by threads: the statistics of
+    the conditions are only updated under a lock.
     Attributes
     ----------
     conditions: List[Condition]
         A list of conditions that will be use for discarding item results.
+    reorder_every: int
+        amount of evaluated results between two reorderings of the conditions.
+    time_sample_every: int
+        only one out of time_sample_every evaluations of each condition is timed.
+    compiled: bool
+        if True, apply_to_all evaluates the conditions with a single compiled function (see etl.codegen), in their
+        order (they aren't reordered nor timed, only their evaluations and rejections are counted).
     """
     conditions: List[Condition]
+    reorder_every: int = 1000
+    time_sample_every: int = 16
+    compiled: bool = False
+    _stats: List[ConditionStats] = field(default_factory=list, init=False, repr=False)
+    _order: List[int] = field(default_factory=list, init=False, repr=False)
+    _applied: int = field(default=0, init=False, repr=False)
+    _reported_rejections: List[int] = field(default_factory=list, init=False, repr=False)
+    _compiled_filter: Optional[Callable[[List[Dict[str, Any]]], Tuple[List[Dict[str, Any]], List[int]]]] = \
+        field(default=None, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
 
-    def apply(self, result: Dict[str, Any]) -> bool:
+    def __post_init__(self):
+        self._stats = [ConditionStats() for _ in self.conditions]
+        self._order = list(range(len(self.conditions)))
+        self._reported_rejections = [0 for _ in self.conditions]
+        if self.compiled:
+            self._compiled_filter = compile_conditions(self.conditions)
+
+    def input_keys(self) -> Optional[Set[str]]:
+        """
+        Keys of the results read by the conditions. None (every key) if any of them is unknown.
+        """
+        keys = set()
         for cond in self.conditions:
-            if not cond.satisfies(result):
+            if cond.input_keys is None:
+                return None
+            keys.update(cond.input_keys)
+        return keys
+
+    def _reorder(self) -> None:
+        order = sorted(range(len(self.conditions)), key=lambda i: self._stats[i].rank)
+        if order != self._order:
+            logging.debug(f"Conditions order: {[type(self.conditions[i]).__name__ for i in order]}")
+            self._order = order
+
+    def apply(self, result: Dict[str, Any]) -> bool:
+        with self._lock:
+            return self._apply(result)
+
+    def _apply(self, result: Dict[str, Any]) -> bool:
+        self._applied += 1
+        if self._applied % self.reorder_every == 0:
+            self._reorder()
+
+        for i in self._order:
+            stats = self._stats[i]
+            stats.evaluations += 1
+            if stats.evaluations % self.time_sample_every == 1:
+                t0 = time.perf_counter()
+                satisfied = self.conditions[i].satisfies(result)
+                stats.time += time.perf_counter() - t0
+                stats.timed_evaluations += 1
+            else:
+                satisfied = self.conditions[i].satisfies(result)
+            if not satisfied:
+                stats.rejections += 1
                 return False
         return True
 
     def apply_to_all(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        return list(filter(lambda r: self.apply(r), results))
+        if self._compiled_filter is not None:
+            kept, rejections = self._compiled_filter(results)
+            with self._lock:
+                evaluations = len(results)
+                for stats, rejected in zip(self._stats, rejections):
+                    stats.evaluations += evaluations
+                    stats.rejections += rejected
+                    evaluations -= rejected
+            return kept
+        with self._lock:
+            return [r for r in results if self._apply(r)]
+
+    def register(self, result: Dict[str, Any]) -> bool:
+        """
+        Registers a result that passed the filter in every condition.
+        :return: False if any condition had already registered an equal result.
+        """
+        is_new = True
+        for cond in self.conditions:
+            is_new = cond.register(result) and is_new
+        return is_new
+
+    def release(self, results: Iterable[Dict[str, Any]]) -> None:
+        """
+        Forgets registered results that weren't loaded, in every condition (see Condition.release).
+        """
+        for result in results:
+            for cond in self.conditions:
+                cond.release(result)
+
+    def reset(self) -> None:
+        """
+        Forgets the results registered by every condition (see Condition.reset).
+        """
+        for cond in self.conditions:
+            cond.reset()
+
+    def log_summary(self, entity: str = "item") -> None:
+        """
+        Logs how many results each condition rejected since the previous summary.
+        """
+        rejections = {}
+        with self._lock:
+            for i, cond in enumerate(self.conditions):
+                total = self._stats[i].rejections
+                if total > self._reported_rejections[i]:
+                    rejections[type(cond).__name__] = total - self._reported_rejections[i]
+                self._reported_rejections[i] = total
+        if rejections:
+            detail = ", ".join(f"{count} by {name}" for name, count in rejections.items())
+            logging.warning(f"{sum(rejections.values())} {entity} results were filtered: {detail}.")
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+from datetime import date
+from typing import Iterable
+
+_MAGIC = b"MLIDX001"
+_HEADER = struct.Struct("<8sQQQ")  # magic, capacity, count, day (ordinal)
+_EMPTY = 0
+_MAX_LOAD_FACTOR = 0.5
+
+
+def _key_hash(key: str) -> int:
+    # stable across processes (unlike hash()), and never equal to the empty slot marker.
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+class MmapHashIndex:
+    """
+    Set of string keys persisted in a memory-mapped file, so it can be reused by later runs without rebuilding it. It
+    is an open addressing hash table of 64 bits key hashes: membership checks don't need to load the whole file, and
+    a false positive needs a 64 bits hash collision. The index belongs to a day: opening it in another day starts an
+    empty one. It can be shared by several threads of the same process.
+    Attributes
+    ----------
+    path: str
+        path of the index file.
+    day: date
+        day of the keys stored in the index.
+    """
+
+    def __init__(self, path: str, day: date, initial_capacity: int = 1 << 16) -> None:
+        self.path = path
+        self.day = day
+        self.is_new = True
+        self._file = None
+        self._mmap = None
+        self._slots = None
+        self._lock = threading.RLock()
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                header = f.read(_HEADER.size)
+            if len(header) == _HEADER.size:
+                magic, _, _, stored_day = _HEADER.unpack(header)
+                if magic == _MAGIC and stored_day == day.toordinal():
+                    self.is_new = False
+        if self.is_new:
+            self._create(path, initial_capacity)
+        self._open(path)
+        if not self.is_new:
+            logging.info(f"Reusing index of {len(self)} known items from {path}.")
+
+    def _create(self, path: str, capacity: int) -> None:
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, capacity, 0, self.day.toordinal()))
+            f.truncate(_HEADER.size + 8 * capacity)
+
+    def _open(self, path: str) -> None:
+        self._file = open(path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        _, self._capacity, self._count, _ = _HEADER.unpack_from(self._mmap, 0)
+        self._slots = memoryview(self._mmap)[_HEADER.size:].cast("Q")
+
+    def clear(self) -> None:
+        """
+        Removes every key (for instance, when the index doesn't match the stored items anymore).
+        """
+        with self._lock:
+            self.close()
+            self._create(self.path, self._capacity)
+            self._open(self.path)
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._slots.release()
+            self._mmap.flush()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+
+    def _find_slot(self, h: int) -> int:
+        mask = self._capacity - 1
+        i = h & mask
+        slots = self._slots
+        while slots[i] != _EMPTY and slots[i] != h:
+            i = (i + 1) & mask
+        return i
+
+    def __contains__(self, key: str) -> bool:
+        h = _key_hash(key)
+        with self._lock:
+            return self._slots[self._find_slot(h)] == h
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, key: str) -> None:
+        h = _key_hash(key)
+        with self._lock:
+            i = self._find_slot(h)
+            if self._slots[i] == h:
+                return
+            self._slots[i] = h
+            self._count += 1
+            struct.pack_into("<Q", self._mmap, 16, self._count)
+            if self._count > self._capacity * _MAX_LOAD_FACTOR:
+                self._grow()
+
+    def update(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self.add(key)
+
+    def _grow(self) -> None:
+        hashes = [h for h in self._slots if h != _EMPTY]
+        capacity = self._capacity * 2
+        self.close()
+        tmp_path = self.path + ".tmp"
+        self._create(tmp_path, capacity)
+        os.replace(tmp_path, self.path)
+        self._open(self.path)
+        mask = capacity - 1
+        for h in hashes:
+            i = h & mask
+            while self._slots[i] != _EMPTY:
+                i = (i + 1) & mask
+            self._slots[i] = h
+        self._count = len(hashes)
+        struct.pack_into("<Q", self._mmap, 16, self._count)
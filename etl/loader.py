@@ -1,24 +1,45 @@
+import copy
 import logging
-from typing import List, Dict, Any
+from datetime import date
+from typing import List, Dict, Any, Optional, MutableSet, Sequence
 
+from sqlalchemy.exc import OperationalError
+
+from database.aggregates import invalidate_rankings
 from database.client import DatabaseClient
+from database.spool import Spool
+from etl.transformations.item_batch import column_values
 from utils.decorators import _time_profiling
 from utils.time_profilers import ConverterApiTimeProfiler, SearchApiTimeProfiler, AttributesItemApiTimeProfiler, \
     InsertItemsTimeProfiler, InsertItemsShippingTimeProfiler, InsertSellersTimeProfiler, LoadTimeProfiler, \
-    ExtractTimeProfiler, TransformTimeProfiler
+    UpdateAggregatesTimeProfiler, ExtractTimeProfiler, TransformTimeProfiler, ItemsMultigetApiTimeProfiler, HttpConnectionPoolProfiler, start_run, \
+    current_run_id
 from utils.useful import flat_map
 
 API_REQUEST_PROFILERS = [ConverterApiTimeProfiler,
                          SearchApiTimeProfiler,
-                         AttributesItemApiTimeProfiler]
+                         AttributesItemApiTimeProfiler,
+                         ItemsMultigetApiTimeProfiler,
+                         HttpConnectionPoolProfiler]
 
 DB_INSERT_PROFILERS = [InsertItemsTimeProfiler,
                        InsertItemsShippingTimeProfiler,
-                       InsertSellersTimeProfiler]
+                       InsertSellersTimeProfiler,
+                       UpdateAggregatesTimeProfiler]
 
 PROCESS_PROFILERS = [ExtractTimeProfiler, TransformTimeProfiler, LoadTimeProfiler]
 
 
+def reset_profilers() -> None:
+    """
+    Discards the metrics (and counters) measured so far and starts labeling the metrics with a new run id, for
+    instance once they were stored by a process that runs several ETL jobs.
+    """
+    for profiler in API_REQUEST_PROFILERS + DB_INSERT_PROFILERS + PROCESS_PROFILERS:
+        profiler.reset()
+    start_run()
+
+
 class Loader:
     """
     Pipeline for storing into MySQL database products, sellers, metrics related to MeLi API requests and metrics related
@@ -27,34 +48,72 @@ class Loader:
     ----------
     database_client: DatabaseClient
        client used for interacting with database that stores products, sellers and metrics data.
+    known_item_ids: Optional[MutableSet[str]]
+        index of the item ids stored in the current day (used by the ItemAlreadyStored condition). If defined, the ids
+        of the inserted items are added to it.
+    upsert: bool
+        if True, products, item_shipping and sellers of each batch are written in a single transaction, with bulk
+        upserts (rows already stored are updated instead of failing), so loading the same data again is safe.
+    chunk_size: int
+        max amount of rows per upsert statement.
+    spool: Optional[Spool]
+        if defined, each batch is written into this spool and then bulk loaded (LOAD DATA on MySQL) in a single
+        transaction. Batches that couldn't be loaded are kept in the spool and loaded by a later run.
+    aggregates: bool
+        if True, the best seller aggregates (see database.aggregates) are updated with every batch, along with it.
     """
 
-    def __init__(self, database_client: DatabaseClient):
+    def __init__(self, database_client: DatabaseClient, known_item_ids: Optional[MutableSet[str]] = None,
+                 upsert: bool = False, chunk_size: int = 1000, spool: Optional[Spool] = None,
+                 aggregates: bool = False):
         self.database_client = database_client
+        self.known_item_ids = known_item_ids
+        self.upsert = upsert
+        self.chunk_size = chunk_size
+        self.spool = spool
+        self.aggregates = aggregates
+
+    def with_database_client(self, database_client: DatabaseClient) -> "Loader":
+        """
+        Returns a Loader that shares the configuration, the known item ids and the spool of this one, but uses another
+        database client (for instance, one per thread, since sessions can't be shared by threads).
+        """
+        loader = copy.copy(self)
+        loader.database_client = database_client
+        return loader
 
-    def _insert_items(self, items: List[Dict[str, Any]]) -> None:
+    def _insert_items(self, items: Sequence[Dict[str, Any]]) -> None:
         len_items = len(items)
         if len_items == 0:
             logging.warning("No new item_shipping data retrieved.")
             return
         logging.info(f"Inserting {len_items} products.")
-        self.database_client.insert_items(items)
+        if self.upsert:
+            self.database_client.upsert_items(items, self.chunk_size)
+        else:
+            self.database_client.insert_items(items, self.chunk_size)
 
-    def _insert_sellers(self, sellers: List[Dict[str, Any]]) -> None:
+    def _insert_sellers(self, sellers: Sequence[Dict[str, Any]]) -> None:
         len_sellers = len(sellers)
         if len_sellers == 0:
             logging.warning("No new sellers data retrieved.")
             return
         logging.info(f"Inserting {len_sellers} sellers.")
-        self.database_client.insert_sellers(sellers)
+        if self.upsert:
+            self.database_client.upsert_sellers(sellers, self.chunk_size)
+        else:
+            self.database_client.insert_sellers(sellers, self.chunk_size)
 
-    def _insert_item_shipping(self, item_shipping: List[Dict[str, Any]]) -> None:
+    def _insert_item_shipping(self, item_shipping: Sequence[Dict[str, Any]]) -> None:
         len_item_shipping = len(item_shipping)
         if len_item_shipping == 0:
             logging.warning("No new item_shipping data retrieved.")
             return
         logging.info(f"Inserting {len_item_shipping} items & shipping methods.")
-        self.database_client.insert_item_shipping(item_shipping)
+        if self.upsert:
+            self.database_client.upsert_item_shipping(item_shipping, self.chunk_size)
+        else:
+            self.database_client.insert_item_shipping(item_shipping, self.chunk_size)
 
     def _insert_request_metrics(self):
         mappers = []
@@ -62,8 +121,15 @@ class Loader:
             mappers.append(profiler.to_json())
 
         mappers = list(flat_map(lambda x: x, mappers))
-        logging.info(f"Inserting {len(mappers)} registries of request metrics.")
-        self.database_client.insert_request_metrics(mappers)
+        if mappers:
+            # raw mode only (see set_raw_metrics).
+            logging.info(f"Inserting {len(mappers)} registries of request metrics.")
+            self.database_client.insert_request_metrics(mappers)
+
+        counters = list(flat_map(lambda profiler: profiler.counters_to_json(), API_REQUEST_PROFILERS))
+        if counters:
+            logging.info(f"Inserting {len(counters)} registries of request counters.")
+            self.database_client.insert_request_counter_metrics(counters)
 
     def _insert_database_metrics(self):
         mappers = []
@@ -71,8 +137,10 @@ class Loader:
             mappers.append(profiler.to_json())
 
         mappers = list(flat_map(lambda x: x, mappers))
-        logging.info(f"Inserting {len(mappers)} registries of database metrics.")
-        self.database_client.insert_database_metrics(mappers)
+        if mappers:
+            # raw mode only (see set_raw_metrics).
+            logging.info(f"Inserting {len(mappers)} registries of database metrics.")
+            self.database_client.insert_database_metrics(mappers)
 
     def _insert_process_metrics(self):
         mappers = []
@@ -83,21 +151,111 @@ class Loader:
         logging.info(f"Inserting {len(mappers)} registries of process metrics.")
         self.database_client.insert_process_metrics(mappers)
 
+    def _insert_metric_summaries(self):
+        summaries = list(flat_map(lambda profiler: profiler.summary_to_json(),
+                                  API_REQUEST_PROFILERS + DB_INSERT_PROFILERS + PROCESS_PROFILERS))
+        logging.info(f"Inserting {len(summaries)} metric summaries (run {current_run_id()}).")
+        self.database_client.insert_metric_summaries(summaries)
+
+    def current_day(self) -> date:
+        """
+        :return: current day of the database (see DatabaseClient.current_day), or of this host if the batches are
+        spooled and the database can't be reached.
+        """
+        try:
+            return self.database_client.current_day()
+        except OperationalError:
+            if self.spool is None:
+                raise
+            self.database_client.session_rollback()
+            return date.today()
+
+    def _update_aggregates(self, items: Sequence[Dict[str, Any]], item_shipping: Sequence[Dict[str, Any]],
+                           query: Optional[str], day: date) -> None:
+        if self.aggregates and items:
+            # before storing the batch, which would hide the items that were already aggregated.
+            self.database_client.update_best_seller_aggregates(day, query, items, item_shipping, skip_stored=True,
+                                                               chunk_size=self.chunk_size)
+
     @_time_profiling(LoadTimeProfiler)
-    def _load_items_and_sellers(self, items: List[Dict[str, Any]],
-                                sellers: List[Dict[str, Any]],
-                                item_shipping: List[Dict[str, Any]]) -> None:
-        self._insert_items(items)
-        self._insert_item_shipping(item_shipping)
-        self._insert_sellers(sellers)
-
-    def load(self, items: List[Dict[str, Any]],
-             sellers: List[Dict[str, Any]],
-             item_shipping: List[Dict[str, Any]]) -> None:
-
-        self._load_items_and_sellers(items, sellers, item_shipping)
-
-        self._insert_request_metrics()
-        self._insert_database_metrics()
-        self._insert_process_metrics()
+    def _load_items_and_sellers(self, items: Sequence[Dict[str, Any]],
+                                sellers: Sequence[Dict[str, Any]],
+                                item_shipping: Sequence[Dict[str, Any]],
+                                query: Optional[str] = None, day: Optional[date] = None) -> None:
+        day = day or self.current_day()
+        if self.spool is not None:
+            aggregates = {"day": day.isoformat(), "query": query or ""} if self.aggregates else None
+            batch_path = self.database_client.spool_batch(self.spool, items, item_shipping, sellers, aggregates)
+            logging.info(f"{len(items)} products, {len(item_shipping)} items & shipping methods and {len(sellers)} "
+                         f"sellers spooled into {batch_path}.")
+            self.drain_spool()
+        else:
+            # the aggregates are updated along with the batch (upserted or inserted), or not at all.
+            with self.database_client.transaction():
+                self._update_aggregates(items, item_shipping, query, day)
+                self._insert_items(items)
+                self._insert_item_shipping(item_shipping)
+                self._insert_sellers(sellers)
+        if self.aggregates and self.spool is None:
+            invalidate_rankings()
+        if self.known_item_ids is not None:
+            self.known_item_ids.update(column_values(items, "id"))
+
+    def drain_spool(self) -> int:
+        """
+        Loads every pending batch of the spool, oldest first, removing the loaded ones. Stops at the first batch that
+        couldn't be loaded because of a database error, keeping it (and the following ones) for a later run.
+        :return: amount of batches loaded.
+        """
+        with self.spool.lock:
+            pending = self.spool.pending()
+            for loaded, batch_path in enumerate(pending):
+                try:
+                    self.database_client.load_spooled_batch(batch_path, self.chunk_size)
+                except OperationalError as ex:
+                    logging.warning(f"Couldn't load spooled batches into database, {len(pending) - loaded} batches "
+                                    f"kept in {self.spool.directory}: {ex}")
+                    return loaded
+                finally:
+                    # spooled batches may update the best seller aggregates.
+                    invalidate_rankings()
+                Spool.remove(batch_path)
+            return len(pending)
+
+    def load_batch(self, items: Sequence[Dict[str, Any]],
+                   sellers: Sequence[Dict[str, Any]],
+                   item_shipping: Sequence[Dict[str, Any]],
+                   query: Optional[str] = None, day: Optional[date] = None) -> None:
+        """
+        Stores products, sellers and item_shipping objects, but not the metrics. Used when the data is loaded in several
+        batches; load_metrics must be called once every batch was loaded.
+        :param query: query that found the products, used by the best seller aggregates.
+        :param day: day of the best seller aggregates the products are added to: the day of the run that found them
+        (for instance, the recorded one when it's replayed). By default, the current day of the database.
+        """
+        self._load_items_and_sellers(items, sellers, item_shipping, query, day)
+
+    def load_metrics(self) -> None:
+        if self.spool is not None:
+            # batches left by previous runs, when this one didn't load any.
+            self.drain_spool()
+        try:
+            with self.database_client.transaction():
+                self._insert_request_metrics()
+                self._insert_database_metrics()
+                self._insert_process_metrics()
+                self._insert_metric_summaries()
+        except OperationalError as ex:
+            if self.spool is None:
+                raise
+            # the batches are kept in the spool, but the metrics of the run are lost.
+            logging.warning(f"Couldn't insert the metrics of run {current_run_id()} into database: {ex}")
+
+    def load(self, items: Sequence[Dict[str, Any]],
+             sellers: Sequence[Dict[str, Any]],
+             item_shipping: Sequence[Dict[str, Any]],
+             query: Optional[str] = None, day: Optional[date] = None) -> None:
+
+        self.load_batch(items, sellers, item_shipping, query, day)
+        self.load_metrics()
 
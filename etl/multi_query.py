@@ -0,0 +1,158 @@
+import logging
+import time
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Callable
+
+from sqlalchemy.orm import Session
+
+from database.client import DatabaseClient
+from etl.extractor import Extractor
+from etl.loader import Loader
+from etl.transformations.item_batch import column_values
+from etl.transformer import Transformer
+from utils.exceptions import ResultsNotFoundException
+from utils.tracing import span, propagate
+
+
+def read_queries(path: str) -> List[str]:
+    """
+    Reads a queries file: one query per line. Blank lines and lines starting with '#' are ignored, and repeated
+    queries are only kept once.
+    """
+    with open(path, encoding="utf-8") as file:
+        lines = (line.strip() for line in file)
+        return list(dict.fromkeys(line for line in lines if line and not line.startswith("#")))
+
+
+@dataclass
+class QueryReport:
+    """
+    Result of the ETL process of one query.
+    Attributes
+    ----------
+    query: str
+    items: int
+        amount of new products loaded (products already found by other queries are not counted).
+    sellers: int
+        amount of new sellers loaded.
+    extract_time: float
+    transform_time: float
+    load_time: float
+    error: Optional[str]
+        reason why the query failed, if it did.
+    """
+    query: str
+    items: int = 0
+    sellers: int = 0
+    extract_time: float = 0.0
+    transform_time: float = 0.0
+    load_time: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def total_time(self) -> float:
+        return self.extract_time + self.transform_time + self.load_time
+
+
+class MultiQueryRunner:
+    """
+    Runs the Extract -> Transform -> Load process of many queries concurrently in one process. Every query shares the
+    same Extractor, Transformer and Loader (so the MeLi API client, its connection pool and cache, the currency ratio and
+    the indexes of stored items and sellers are built only once). Products found by several queries are only loaded by
+    the first one, since the filters register every item and seller that passed them (the ones of a query that failed
+    are released). Each query thread loads with its own session, taken from the same engine (connection pool).
+    Attributes
+    ----------
+    extractor: Extractor
+    transformer: Transformer
+    loader: Loader
+        used for loading the metrics; query threads use copies of it with their own database client.
+    session_factory: Callable[[], Session]
+        builds the session of each query, for instance a sessionmaker bound to the engine.
+    max_workers: int
+        max amount of queries processed at the same time.
+    """
+
+    def __init__(self, extractor: Extractor, transformer: Transformer, loader: Loader,
+                 session_factory: Callable[[], Session], max_workers: int = 4) -> None:
+        self.extractor = extractor
+        self.transformer = transformer
+        self.loader = loader
+        self.session_factory = session_factory
+        self.max_workers = max_workers
+
+    def _run_query(self, query: str, exclude_seller_id: int, max_items: int, day: date) -> QueryReport:
+        with span("query:run", query=query) as s:
+            report = self._process_query(query, exclude_seller_id, max_items, day)
+            s.set("items", report.items)
+            if report.error:
+                s.set("error", report.error)
+            return report
+
+    def _process_query(self, query: str, exclude_seller_id: int, max_items: int, day: date) -> QueryReport:
+        report = QueryReport(query=query)
+        session = self.session_factory()
+        loader = self.loader.with_database_client(DatabaseClient(session=session))
+        registered, sellers, loaded = [], [], False
+        try:
+            t0 = time.time()
+            # filter summaries of concurrent queries would be mixed up, they are logged once every query finished.
+            item_list = self.extractor.search(query=query, max_items=max_items, exclude_seller_id=exclude_seller_id,
+                                              registered=registered, log_summary=False)
+            t1 = time.time()
+            products, item_shipping, sellers = self.transformer.transform(item_list)
+            t2 = time.time()
+            loader.load_batch(products, sellers, item_shipping, query=query, day=day)
+            loaded = True
+            t3 = time.time()
+            report.extract_time, report.transform_time, report.load_time = t1 - t0, t2 - t1, t3 - t2
+            report.items, report.sellers = len(products), len(sellers)
+        except ResultsNotFoundException:
+            report.error = "no new items"
+        except Exception as ex:
+            logging.exception(f"Query '{query}' failed.")
+            report.error = str(ex) or type(ex).__name__
+        finally:
+            session.close()
+            # items and sellers registered by the query, but not loaded, can be found by other queries (or runs).
+            loaded_ids = set(column_values(products, "id")) if loaded else set()
+            self.extractor.release(item for item in registered if item["id"] not in loaded_ids)
+            if not loaded:
+                self.transformer.release(sellers)
+        return report
+
+    @staticmethod
+    def _log_reports(reports: List[QueryReport], wall_time: float) -> None:
+        width = max([len(r.query) for r in reports] + [5])
+        lines = [f"{'query':<{width}}  {'items':>6}  {'sellers':>7}  {'extract':>8}  {'transform':>9}  "
+                 f"{'load':>8}  {'total':>8}"]
+        for r in reports:
+            if r.error:
+                lines.append(f"{r.query:<{width}}  failed: {r.error}")
+            else:
+                lines.append(f"{r.query:<{width}}  {r.items:>6}  {r.sellers:>7}  {r.extract_time:>8.2f}  "
+                             f"{r.transform_time:>9.2f}  {r.load_time:>8.2f}  {r.total_time:>8.2f}")
+        ok = [r for r in reports if not r.error]
+        lines.append(f"{'total':<{width}}  {sum(r.items for r in ok):>6}  {sum(r.sellers for r in ok):>7}  "
+                     f"{sum(r.extract_time for r in ok):>8.2f}  {sum(r.transform_time for r in ok):>9.2f}  "
+                     f"{sum(r.load_time for r in ok):>8.2f}  {sum(r.total_time for r in ok):>8.2f}")
+        logging.info("Queries report (times in seconds):\n" + "\n".join(lines))
+        logging.info(f"{len(ok)}/{len(reports)} queries succeeded. Wall time: {round(wall_time, 2)} seconds.")
+
+    def run(self, queries: List[str], exclude_seller_id: int, max_items: int) -> List[QueryReport]:
+        """
+        Processes every query (at most max_items products each) and then loads the metrics of the whole run.
+        :return: report of each query, in the same order as queries.
+        """
+        t0 = time.time()
+        # every query is aggregated into the day the run started.
+        day = self.loader.current_day()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="query") as executor:
+            run_query = propagate(self._run_query)
+            reports = list(executor.map(lambda q: run_query(q, exclude_seller_id, max_items, day), queries))
+        self.extractor.log_summary()
+        self._log_reports(reports, time.time() - t0)
+        self.loader.load_metrics()
+        return reports
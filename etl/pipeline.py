@@ -0,0 +1,206 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional, List, Dict, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from etl.checkpoint import RunCheckpoint
+from etl.extractor import Extractor
+from etl.loader import Loader
+from etl.transformations.item_batch import column_values
+from etl.transformer import Transformer
+from utils.time_profilers import ExtractTimeProfiler
+from utils.tracing import span, propagate
+
+_END = object()
+
+
+class _Stage(threading.Thread):
+    """
+    Pipeline stage running in its own thread. It consumes the objects of its input (an iterable or a queue), applies
+    its function and puts the results into a bounded output queue, so it blocks (backpressure) when the next stage
+    falls behind.
+    """
+
+    def __init__(self, name: str, source: Any, function: Optional[Callable[[Any], Any]],
+                 output: "queue.Queue", stop: threading.Event) -> None:
+        super().__init__(name=name, daemon=True)
+        self.source = source
+        self.function = function
+        self.output = output
+        self.stop = stop
+        self.error: Optional[BaseException] = None
+        # spans of the stage are children of the span open when the pipeline was built.
+        self._process = propagate(self._process)
+
+    def _put(self, obj: Any) -> bool:
+        with span("queue:put wait", stage=self.name):
+            while not self.stop.is_set():
+                try:
+                    self.output.put(obj, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+    def _inputs(self) -> Iterable[Any]:
+        if isinstance(self.source, queue.Queue):
+            return iter_queue(self.source, self.stop)
+        return self.source
+
+    def _process(self) -> None:
+        try:
+            with span(f"stage:{self.name}"):
+                for obj in self._inputs():
+                    if self.stop.is_set():
+                        break
+                    if not self._put(self.function(obj) if self.function else obj):
+                        break
+        except BaseException as ex:
+            self.error = ex
+            self.stop.set()
+        finally:
+            self._put(_END)
+
+    def run(self) -> None:
+        self._process()
+
+
+def iter_queue(source: "queue.Queue", stop: threading.Event) -> Iterable[Any]:
+    while not stop.is_set():
+        with span("queue:get wait"):
+            try:
+                obj = source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        if obj is _END:
+            return
+        yield obj
+
+
+class StreamingPipeline:
+    """
+    Streaming version of the Extract -> Transform -> Load process. Search pages flow through the Transformer and the
+    Loader as bounded batches: extraction, transformation and loading run in different threads, connected by bounded
+    queues. So the peak memory depends on batch_size and queue_size instead of max_items, and network and database
+    times overlap.
+    Attributes
+    ----------
+    extractor: Extractor
+    transformer: Transformer
+    loader: Loader
+    batch_size: int
+        max amount of items of each batch.
+    queue_size: int
+        max amount of batches waiting between two stages.
+    checkpoint_session_factory: Optional[Callable[[], Session]]
+        if defined, the run is checkpointed (see RunCheckpoint) with sessions of this factory, so a run that failed
+        halfway is resumed by the next one.
+    """
+
+    def __init__(self, extractor: Extractor, transformer: Transformer, loader: Loader,
+                 batch_size: int = 200, queue_size: int = 2,
+                 checkpoint_session_factory: Optional[Callable[[], Session]] = None) -> None:
+        self.extractor = extractor
+        self.transformer = transformer
+        self.loader = loader
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.checkpoint_session_factory = checkpoint_session_factory
+
+    def _timed_batches(self, query: str, exclude_seller_id: int, max_items: int,
+                       checkpoint: Optional[RunCheckpoint], registered: List[Dict[str, Any]]) -> Iterable[Any]:
+        """
+        Yields (batch id, batch) tuples: first the batches extracted by a previous run of the checkpoint that were not
+        loaded, then the new ones. Batch ids are only defined for checkpointed runs.
+        """
+        if checkpoint:
+            pending = checkpoint.pending_batches()
+            if pending:
+                logging.info(f"{len(pending)} batches extracted by a previous run will be loaded.")
+            for _, batch in pending:
+                self.extractor.register_extracted(batch, registered)
+            yield from pending
+            if checkpoint.extraction_complete:
+                return
+
+        # the extraction is a generator, so its time is measured between batches instead of with _time_profiling.
+        elapsed = 0.0
+        batches = self.extractor.iter_search_batches(query=query, exclude_seller_id=exclude_seller_id,
+                                                     max_items=max_items, batch_size=self.batch_size,
+                                                     checkpoint=checkpoint, registered=registered)
+        while True:
+            t0 = time.time()
+            try:
+                with span("extract:batch") as s:
+                    batch = next(batches)
+                    s.set("items", len(batch))
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.time() - t0
+            yield checkpoint.last_batch_id if checkpoint else None, batch
+        ExtractTimeProfiler.record(elapsed)
+
+    def _transform(self, batch: Any, transformed_sellers: List[Dict[str, Any]]) -> Any:
+        batch_id, items = batch
+        with span("transform:batch", items=len(items)):
+            products, item_shipping, sellers = self.transformer.transform(items)
+            transformed_sellers += sellers
+            return batch_id, (products, item_shipping, sellers)
+
+    def run(self, query: str, exclude_seller_id: int, max_items: int) -> None:
+        with span("pipeline:run", query=query, max_items=max_items, batch_size=self.batch_size):
+            self._run(query, exclude_seller_id, max_items)
+
+    def _run(self, query: str, exclude_seller_id: int, max_items: int) -> None:
+        checkpoint = RunCheckpoint.start(self.checkpoint_session_factory, query=query,
+                                         exclude_seller_id=int(exclude_seller_id), max_items=max_items) \
+            if self.checkpoint_session_factory else None
+        stop = threading.Event()
+        extracted = queue.Queue(maxsize=self.queue_size)
+        transformed = queue.Queue(maxsize=self.queue_size)
+        # items and sellers registered by the filters during the run, and the loaded ones: the rest are released at
+        # the end, so a failed batch (or items left out of it) doesn't hide them from later runs of the process.
+        registered: List[Dict[str, Any]] = []
+        transformed_sellers: List[Dict[str, Any]] = []
+        loaded_ids: Set[str] = set()
+        loaded_sellers: Set[Tuple[int, int]] = set()
+        # every batch is aggregated into the day the run started.
+        day = self.loader.current_day()
+
+        stages = [_Stage("extract", self._timed_batches(query, exclude_seller_id, max_items, checkpoint, registered),
+                         None, extracted, stop),
+                  _Stage("transform", extracted, lambda batch: self._transform(batch, transformed_sellers),
+                         transformed, stop)]
+        for stage in stages:
+            stage.start()
+
+        loaded_batches = 0
+        try:
+            for batch_id, (products, item_shipping, sellers) in iter_queue(transformed, stop):
+                with span("load:batch", items=len(products), sellers=len(sellers)):
+                    self.loader.load_batch(products, sellers, item_shipping, query=query, day=day)
+                    loaded_ids.update(column_values(products, "id"))
+                    loaded_sellers.update((s["seller_id"], s["completed_sales"]) for s in sellers)
+                    if checkpoint:
+                        checkpoint.batch_loaded(batch_id, len(products))
+                loaded_batches += 1
+        finally:
+            stop.set()
+            for stage in stages:
+                stage.join()
+            self.extractor.release(item for item in registered if item["id"] not in loaded_ids)
+            self.transformer.release(s for s in transformed_sellers
+                                     if (s["seller_id"], s["completed_sales"]) not in loaded_sellers)
+
+        for stage in stages:
+            if stage.error:
+                raise stage.error
+
+        logging.info(f"{loaded_batches} batches were loaded.")
+        if checkpoint:
+            checkpoint.finish()
+        self.loader.load_metrics()
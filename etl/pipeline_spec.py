@@ -0,0 +1,171 @@
+"""
+Declarative spec of the ETL pipeline: the conditions of the items and sellers filters, the transformations (with their
+parameters) and the keys kept from each item, by name. Specs are Python dicts, or JSON or YAML files (YAML requires
+PyYAML), so the pipeline can be changed without editing code. Compiled specs fuse each filter, and the transformations
+with the cleaner, into single functions (see etl.codegen).
+"""
+import dataclasses
+import json
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Type, Optional, Union, Set
+
+from etl.cleaner.data_cleaner import DataCleaner
+from etl.data_batch_generators.data_batch_generator import FusedBatchGenerator
+from etl.filter.condition import Condition, NotNewProduct, ItemAlreadyStored, SellerAlreadyStored
+from etl.filter.filter import Filter
+from etl.transformations.transformations import Transformation, HandleNoWarrantyString, PriceConverter, \
+    InsertSellerID, InsertSellerCompletedSales, ShippingMethods
+from etl.transformer import Transformer
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+CONDITIONS: Dict[str, Type[Condition]] = {
+    "not_new_product": NotNewProduct,
+    "item_already_stored": ItemAlreadyStored,
+    "seller_already_stored": SellerAlreadyStored,
+}
+TRANSFORMATIONS: Dict[str, Type[Transformation]] = {
+    "handle_no_warranty_string": HandleNoWarrantyString,
+    "price_converter": PriceConverter,
+    "insert_seller_id": InsertSellerID,
+    "insert_seller_completed_sales": InsertSellerCompletedSales,
+    "shipping_methods": ShippingMethods,
+}
+
+DEFAULT_PIPELINE_SPEC: Dict[str, Any] = {
+    "item_conditions": ["item_already_stored", "not_new_product"],
+    "seller_conditions": ["seller_already_stored"],
+    "transformations": [{"handle_no_warranty_string": {"no_warranty_strings": ["Sem garantia"]}},
+                        "price_converter",
+                        "insert_seller_id",
+                        "insert_seller_completed_sales",
+                        "shipping_methods"],
+    "relevant_keys": ["id", "title", "sold_quantity", "shipping", "price", "warranty", "seller_id", "completed_sales"],
+    "product_drop_keys": ["shipping"],
+    "compiled": False,
+}
+
+
+@dataclass
+class StepSpec:
+    """
+    A condition or transformation of a spec: its registered name, and the parameters of its constructor. Parameters
+    that aren't defined are taken from the runtime state of the pipeline (see PipelineSpec.build_item_filter).
+    """
+    name: str
+    params: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, step: Union[str, Dict[str, Any]], registry: Dict[str, Type]) -> "StepSpec":
+        """
+        :param step: a name, or a dict of a name and its parameters (for instance, {"price_converter": {}}).
+        """
+        if isinstance(step, dict):
+            if len(step) != 1:
+                raise ValueError(f"Pipeline steps must have a single name: {step}")
+            (name, params), = step.items()
+        else:
+            name, params = step, {}
+        if name not in registry:
+            raise ValueError(f"Unknown pipeline step '{name}'. Known steps: {', '.join(registry)}.")
+        return cls(name=name, params=dict(params or {}))
+
+    def build(self, registry: Dict[str, Type], state: Dict[str, Any]) -> Any:
+        step_cls = registry[self.name]
+        params = dict(self.params)
+        for f in dataclasses.fields(step_cls):
+            if f.init and f.name not in params and f.name in state:
+                params[f.name] = state[f.name]
+        try:
+            return step_cls(**params)
+        except TypeError as ex:
+            raise ValueError(f"Pipeline step '{self.name}' can't be built: {ex}") from ex
+
+
+@dataclass
+class PipelineSpec:
+    """
+    Conditions, transformations and keys of an ETL pipeline.
+    Attributes
+    ----------
+    item_conditions: List[StepSpec]
+        conditions of the search results filter (evaluated in this order, when compiled).
+    seller_conditions: List[StepSpec]
+        conditions of the sellers filter. Without them, sellers aren't filtered.
+    transformations: List[StepSpec]
+        transformations applied to each item, in this order.
+    relevant_keys: List[str]
+        keys kept from each transformed item.
+    product_drop_keys: List[str]
+        keys removed from the items for generating the products.
+    compiled: bool
+        if True, the filters and the transformer are compiled into fused functions. Compiled filters evaluate their
+        conditions in the given order, without the adaptive reordering and timing of Filter.
+    """
+    item_conditions: List[StepSpec]
+    seller_conditions: List[StepSpec]
+    transformations: List[StepSpec]
+    relevant_keys: List[str]
+    product_drop_keys: List[str]
+    compiled: bool = False
+
+    @classmethod
+    def from_dict(cls, spec: Dict[str, Any]) -> "PipelineSpec":
+        """
+        Parses a spec with the keys of DEFAULT_PIPELINE_SPEC. Keys that aren't defined take their default value.
+        """
+        unknown = set(spec) - set(DEFAULT_PIPELINE_SPEC)
+        if unknown:
+            raise ValueError(f"Unknown pipeline spec keys: {', '.join(sorted(unknown))}.")
+        spec = {**DEFAULT_PIPELINE_SPEC, **spec}
+        return cls(item_conditions=[StepSpec.parse(s, CONDITIONS) for s in spec["item_conditions"]],
+                   seller_conditions=[StepSpec.parse(s, CONDITIONS) for s in spec["seller_conditions"]],
+                   transformations=[StepSpec.parse(s, TRANSFORMATIONS) for s in spec["transformations"]],
+                   relevant_keys=list(spec["relevant_keys"]),
+                   product_drop_keys=list(spec["product_drop_keys"]),
+                   compiled=bool(spec["compiled"]))
+
+    def build_item_filter(self, state: Dict[str, Any]) -> Filter:
+        """
+        :param state: runtime values of the steps parameters, by name (for instance, current_day_item_ids, seller_data
+        and currency_factor).
+        """
+        return Filter(conditions=[s.build(CONDITIONS, state) for s in self.item_conditions], compiled=self.compiled)
+
+    def build_sellers_filter(self, state: Dict[str, Any]) -> Optional[Filter]:
+        if not self.seller_conditions:
+            return None
+        return Filter(conditions=[s.build(CONDITIONS, state) for s in self.seller_conditions], compiled=self.compiled)
+
+    def build_transformer(self, state: Dict[str, Any], sellers_filter: Optional[Filter] = None,
+                          columnar: bool = False, item_keys: Optional[Set[str]] = None,
+                          compact: bool = False) -> Transformer:
+        """
+        :param item_keys: keys the items are expected to have (see Transformer).
+        :param compact: if True, the transformer returns compact batches of products and item_shipping objects.
+        """
+        return Transformer(transformations=[s.build(TRANSFORMATIONS, state) for s in self.transformations],
+                           preprocessed_data_cleaner=DataCleaner(relevant_keys=list(self.relevant_keys)),
+                           fused_generator=FusedBatchGenerator(drop_keys=list(self.product_drop_keys)),
+                           sellers_filter=sellers_filter,
+                           columnar=columnar,
+                           compiled=self.compiled and not columnar,
+                           item_keys=item_keys,
+                           compact=compact)
+
+
+def read_pipeline_spec(path: str) -> PipelineSpec:
+    """
+    Reads a spec file: YAML (.yaml, .yml) or JSON.
+    """
+    with open(path, encoding="utf-8") as file:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ImportError("YAML pipeline specs require PyYAML (pip install pyyaml).")
+            spec = yaml.safe_load(file)
+        else:
+            spec = json.load(file)
+    return PipelineSpec.from_dict(spec or {})
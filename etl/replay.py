@@ -0,0 +1,123 @@
+import logging
+import time
+from datetime import date
+from typing import Callable, Dict, Any, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+from etl.filter.condition import NotNewProduct, ItemAlreadyStored
+from etl.filter.filter import Filter
+from etl.loader import Loader
+from etl.transformer import Transformer
+from meli.archive import ArchivedResponse, archive_paths, read_archive
+from utils.time_profilers import ConverterApiTimeProfiler, SearchApiTimeProfiler, ItemsMultigetApiTimeProfiler, \
+    AttributesItemApiTimeProfiler
+
+REPLAYED_APIS = [ConverterApiTimeProfiler.api_name, SearchApiTimeProfiler.api_name,
+                 ItemsMultigetApiTimeProfiler.api_name, AttributesItemApiTimeProfiler.api_name]
+
+
+def search_query(url: str) -> Optional[str]:
+    """
+    :return: the query of a search API url.
+    """
+    return parse_qs(urlparse(url).query).get("q", [None])[0]
+
+
+class ArchiveReplayer:
+    """
+    Reprocesses runs recorded by a ResponseArchive, without requests: the extracted items of each run are rebuilt from
+    its archived search and attributes responses (with the same filtering as the Extractor), and they are transformed
+    and loaded in batches. Archives are read as streams, so the memory used depends on batch_size, not on the amount of
+    recorded responses. Items are added to the best seller aggregates of the day of their recorded run. Useful for
+    backfilling, or reprocessing the history after a Transformation changed.
+    Attributes
+    ----------
+    transformer_factory: Callable[[float], Transformer]
+        builds the Transformer of a run, given the currency factor recorded by it.
+    loader: Loader
+        usually, an upserting loader, since the replayed items were probably stored already.
+    batch_size: int
+        max amount of items transformed and loaded at once.
+    """
+
+    def __init__(self, transformer_factory: Callable[[float], Transformer], loader: Loader,
+                 batch_size: int = 1000) -> None:
+        self.transformer_factory = transformer_factory
+        self.loader = loader
+        self.batch_size = batch_size
+
+    def _load(self, transformer: Transformer, items: List[Dict[str, Any]], query: Optional[str], day: date) -> int:
+        products, item_shipping, sellers = transformer.transform(items)
+        self.loader.load_batch(products, sellers, item_shipping, query=query, day=day)
+        return len(products)
+
+    def replay_archive(self, path: str) -> int:
+        """
+        :return: amount of products loaded.
+        """
+        # every run discards used products and items found twice, as the Extractor does.
+        _filter = Filter(conditions=[NotNewProduct(), ItemAlreadyStored(current_day_item_ids=set())])
+        transformer: Optional[Transformer] = None
+        query: Optional[str] = None
+        # the items are aggregated into the day of the recorded run, not the current one.
+        day: Optional[date] = None
+        awaiting_attributes: Dict[str, Dict[str, Any]] = {}
+        ready: List[Dict[str, Any]] = []
+        loaded = 0
+
+        def add_attributes(body: Dict[str, Any]) -> None:
+            item = awaiting_attributes.pop(body.get("id"), None)
+            if item is not None:
+                item["warranty"] = body.get("warranty")
+                ready.append(item)
+
+        response: ArchivedResponse
+        for response in read_archive(path, api_names=REPLAYED_APIS):
+            day = day or date.fromtimestamp(response.time)
+            if response.status_code != 200:
+                continue
+            if response.api_name == ConverterApiTimeProfiler.api_name:
+                transformer = transformer or self.transformer_factory(response.json()["ratio"])
+            elif response.api_name == SearchApiTimeProfiler.api_name:
+                query = query or search_query(response.url)
+                results = _filter.apply_to_all(response.json()["results"])
+                for result in results:
+                    if _filter.register(result):
+                        awaiting_attributes[result["id"]] = result
+            elif response.api_name == ItemsMultigetApiTimeProfiler.api_name:
+                for entry in response.json():
+                    if entry.get("code") == 200:
+                        add_attributes(entry["body"])
+            else:
+                add_attributes(response.json())
+
+            if transformer and len(ready) >= self.batch_size:
+                loaded += self._load(transformer, ready, query, day)
+                ready = []
+
+        if transformer is None:
+            logging.warning(f"Archive {path} was skipped: it has no currency conversion response.")
+            return 0
+        if ready:
+            loaded += self._load(transformer, ready, query, day)
+        if awaiting_attributes:
+            logging.info(f"{len(awaiting_attributes)} items of {path} were left out: their attributes weren't "
+                         f"recorded (for instance, because they exceeded max_items).")
+        return loaded
+
+    def replay(self, paths: List[str]) -> int:
+        """
+        Replays archives (or directories of archives), in order, and then loads the metrics of the replay.
+        :return: amount of products loaded.
+        """
+        t0 = time.time()
+        archives = archive_paths(paths)
+        loaded = 0
+        for path in archives:
+            archive_loaded = self.replay_archive(path)
+            logging.info(f"{archive_loaded} products of {path} were loaded.")
+            loaded += archive_loaded
+        logging.info(f"{loaded} products of {len(archives)} archives were replayed in {round(time.time() - t0, 2)} "
+                     f"seconds.")
+        self.loader.load_metrics()
+        return loaded
@@ -0,0 +1,51 @@
+from typing import List, Dict, Any, Optional, Iterable
+
+
+class ColumnBatch:
+    """
+    Columnar representation of a batch of item objects: one list of values per key, all of them with the same length.
+    Transformations applied to a whole column avoid the per item and per transformation dispatch of the dict API.
+    Attributes
+    ----------
+    columns: Dict[str, List[Any]]
+        values of each key, in item order.
+    """
+
+    def __init__(self, columns: Dict[str, List[Any]], length: int) -> None:
+        self.columns = columns
+        self._length = length
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]], keys: Optional[Iterable[str]] = None) -> "ColumnBatch":
+        """
+        :param records: item objects.
+        :param keys: keys that will be kept as columns. By default, the keys of the first record.
+        """
+        if keys is None:
+            keys = records[0].keys() if records else []
+        return cls({key: [r.get(key) for r in records] for key in keys}, len(records))
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        keys = list(self.columns)
+        return [dict(zip(keys, row)) for row in zip(*self.columns.values())] if keys else [{} for _ in range(len(self))]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.columns
+
+    def __getitem__(self, key: str) -> List[Any]:
+        return self.columns[key]
+
+    def __setitem__(self, key: str, values: List[Any]) -> None:
+        if len(values) != self._length:
+            raise ValueError(f"Column {key} has {len(values)} values, but the batch has {self._length} items.")
+        self.columns[key] = values
+
+    def select(self, keys: Iterable[str]) -> "ColumnBatch":
+        return ColumnBatch({key: self.columns[key] for key in keys if key in self.columns}, self._length)
+
+    def drop(self, keys: Iterable[str]) -> "ColumnBatch":
+        keys = set(keys)
+        return ColumnBatch({key: values for key, values in self.columns.items() if key not in keys}, self._length)
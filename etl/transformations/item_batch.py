@@ -0,0 +1,238 @@
+"""
+Compact representation of transformed items, kept from the Transformer to the Loader instead of one dict per item:
+every key is a typed column (numbers in arrays, strings in a single utf-8 buffer, repeated values dictionary encoded),
+and dicts are only built, one at a time (or one chunk at a time), by the consumers that need them.
+"""
+from array import array
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Union, Sequence
+
+from etl.transformations.column_batch import ColumnBatch
+
+# strings (or other hashable values) with at most one distinct value every CATEGORY_RATIO values are dictionary encoded.
+CATEGORY_RATIO = 4
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+# ints that doubles represent exactly.
+_DOUBLE_INT_MAX = 2 ** 53
+
+
+def _nulls(values: Sequence[Any]) -> Optional[bytearray]:
+    # None values are flagged in a mask, which is only allocated if there are any.
+    if all(v is not None for v in values):
+        return None
+    return bytearray(v is None for v in values)
+
+
+class NumericColumn:
+    __slots__ = ("values", "nulls")
+
+    def __init__(self, values: array, nulls: Optional[bytearray]) -> None:
+        self.values = values
+        self.nulls = nulls
+
+    @classmethod
+    def build(cls, typecode: str, values: Sequence[Any]) -> "NumericColumn":
+        return cls(array(typecode, (0 if v is None else v for v in values)), _nulls(values))
+
+    def __getitem__(self, i: int) -> Any:
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return self.values[i]
+
+    def take(self, indices: Sequence[int]) -> "NumericColumn":
+        nulls = self.nulls
+        return NumericColumn(array(self.values.typecode, (self.values[i] for i in indices)),
+                              bytearray(nulls[i] for i in indices) if nulls is not None else None)
+
+    def nbytes(self) -> int:
+        return self.values.itemsize * len(self.values) + (len(self.nulls) if self.nulls is not None else 0)
+
+
+class StringColumn:
+    __slots__ = ("data", "offsets", "nulls")
+
+    def __init__(self, data: bytes, offsets: array, nulls: Optional[bytearray]) -> None:
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    @classmethod
+    def build(cls, values: Sequence[Optional[str]]) -> "StringColumn":
+        encoded = [b"" if v is None else v.encode() for v in values]
+        offsets = array("Q", [0])
+        end = 0
+        for value in encoded:
+            end += len(value)
+            offsets.append(end)
+        return cls(b"".join(encoded), offsets, _nulls(values))
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def take(self, indices: Sequence[int]) -> "StringColumn":
+        return StringColumn.build([self[i] for i in indices])
+
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.itemsize * len(self.offsets) + \
+            (len(self.nulls) if self.nulls is not None else 0)
+
+
+class CategoryColumn:
+    __slots__ = ("categories", "codes")
+
+    def __init__(self, categories: List[Any], codes: array) -> None:
+        self.categories = categories
+        self.codes = codes
+
+    @classmethod
+    def build(cls, values: Sequence[Any]) -> "CategoryColumn":
+        index: Dict[Any, int] = {}
+        codes = [index.setdefault(v, len(index)) for v in values]
+        return cls(list(index), array("H" if len(index) <= 1 << 16 else "I", codes))
+
+    def __getitem__(self, i: int) -> Any:
+        return self.categories[self.codes[i]]
+
+    def take(self, indices: Sequence[int]) -> "CategoryColumn":
+        return CategoryColumn(self.categories, array(self.codes.typecode, (self.codes[i] for i in indices)))
+
+    def nbytes(self) -> int:
+        return self.codes.itemsize * len(self.codes)
+
+
+class IndexedColumn:
+    """
+    Values of another column, through an array of indices (for instance, the item ids of the item_shipping objects).
+    """
+    __slots__ = ("base", "indices")
+
+    def __init__(self, base: Any, indices: array) -> None:
+        self.base = base
+        self.indices = indices
+
+    def __getitem__(self, i: int) -> Any:
+        return self.base[self.indices[i]]
+
+    def take(self, indices: Sequence[int]) -> "IndexedColumn":
+        return IndexedColumn(self.base, array(self.indices.typecode, (self.indices[i] for i in indices)))
+
+    def nbytes(self) -> int:
+        return self.indices.itemsize * len(self.indices)
+
+
+class ObjectColumn:
+    __slots__ = ("values",)
+
+    def __init__(self, values: List[Any]) -> None:
+        self.values = values
+
+    def __getitem__(self, i: int) -> Any:
+        return self.values[i]
+
+    def take(self, indices: Sequence[int]) -> "ObjectColumn":
+        return ObjectColumn([self.values[i] for i in indices])
+
+    def nbytes(self) -> int:
+        return 8 * len(self.values)
+
+
+def _hashable(value: Any) -> Any:
+    return tuple(value) if isinstance(value, list) else value
+
+
+def build_column(values: Sequence[Any]):
+    """
+    Builds the most compact column for the values: int64 or double arrays (ints mixed with floats, like round prices,
+    are read back as floats), dictionary encoded values (lists, like the shipping tags, are kept as tuples), or a utf-8
+    buffer of strings. Values of other types are kept as they are.
+    """
+    non_null = [v for v in values if v is not None]
+    types = {type(v) for v in non_null}
+    if types == {int} and _INT64_MIN <= min(non_null) and max(non_null) <= _INT64_MAX:
+        return NumericColumn.build("q", values)
+    if types == {float} or (types == {int, float} and
+                            all(abs(v) <= _DOUBLE_INT_MAX for v in non_null if type(v) is int)):
+        return NumericColumn.build("d", values)
+    try:
+        distinct = len({_hashable(v) for v in non_null})
+    except TypeError:
+        return ObjectColumn(list(values))
+    if distinct <= max(1, len(values) // CATEGORY_RATIO):
+        return CategoryColumn.build([_hashable(v) for v in values])
+    if types == {str}:
+        return StringColumn.build(values)
+    return ObjectColumn(list(values))
+
+
+def column_values(objects: Sequence[Dict[str, Any]], key: str) -> List[Any]:
+    """
+    :return: value of a key of every object (read from its column, for compact batches).
+    """
+    return objects.column(key) if isinstance(objects, ItemBatch) else [o[key] for o in objects]
+
+
+class ItemBatch:
+    """
+    Compact batch of objects with the same keys (products, or item_shipping objects). It's a sequence of dicts: they
+    are built when they are read (iterating, indexing or slicing the batch), so consumers of lists of dicts (like the
+    DatabaseClient inserts) accept it, and only keep the dicts of the chunk they process.
+    Attributes
+    ----------
+    columns: Dict[str, Any]
+        column of each key, in key order.
+    """
+
+    def __init__(self, columns: Dict[str, Any], length: int) -> None:
+        self.columns = columns
+        self._length = length
+
+    @classmethod
+    def from_records(cls, records: Sequence[Dict[str, Any]], keys: Optional[Iterable[str]] = None) -> "ItemBatch":
+        """
+        :param keys: keys that will be kept as columns. By default, every key of the records (missing keys are read as
+        None).
+        """
+        if keys is None:
+            keys = dict.fromkeys(key for r in records for key in r)
+        return cls({key: build_column([r.get(key) for r in records]) for key in keys}, len(records))
+
+    @classmethod
+    def from_columns(cls, batch: ColumnBatch) -> "ItemBatch":
+        return cls({key: build_column(values) for key, values in batch.columns.items()}, len(batch))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def record(self, i: int) -> Dict[str, Any]:
+        return {key: column[i] for key, column in self.columns.items()}
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(self._length):
+            yield self.record(i)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        if isinstance(i, slice):
+            return [self.record(j) for j in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("ItemBatch index out of range")
+        return self.record(i)
+
+    def column(self, key: str) -> List[Any]:
+        column = self.columns[key]
+        return [column[i] for i in range(self._length)]
+
+    def take(self, indices: Sequence[int]) -> "ItemBatch":
+        return ItemBatch({key: column.take(indices) for key, column in self.columns.items()}, len(indices))
+
+    def drop(self, keys: Iterable[str]) -> "ItemBatch":
+        keys = set(keys)
+        return ItemBatch({key: column for key, column in self.columns.items() if key not in keys}, self._length)
+
+    def nbytes(self) -> int:
+        """
+        :return: approximate size of the columns (without the distinct values of dictionary encoded ones).
+        """
+        return sum(column.nbytes() for column in self.columns.values())
@@ -1,50 +1,123 @@
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+
+from etl.transformations.column_batch import ColumnBatch
+
+# shipping method of the items without shipping tags (item_shipping.shipping_method can't be NULL).
+NO_SHIPPING_METHOD = ""
 
 
 class Transformation:
+    # keys read by the transformation. None means that it may need any key of the item.
+    input_keys: Optional[Tuple[str, ...]] = None
 
     def apply(self, atribs: Dict[str, Any]) -> Dict[str, Any]:
         ...
 
+    def apply_batch(self, batch: ColumnBatch) -> ColumnBatch:
+        """
+        Applies the transformation to every item of a columnar batch. By default, falls back to the per item API.
+        """
+        return ColumnBatch.from_records([self.apply(atribs) for atribs in batch.to_records()])
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Source code of the transformation, for compiled transformers (see etl.codegen). The transformation is bound to
+        the name ref.
+        :return: lines run once per list of items, and lines that transform the item atribs in place (both may define
+        names prefixed by ref). None if the transformation can't be compiled (apply is called instead).
+        """
+        return None
+
 
 @dataclass
 class HandleNoWarrantyString(Transformation):
     no_warranty_strings: List[str]
+    input_keys = ("warranty",)
 
     def apply(self, atribs: Dict[str, Any]) -> Dict[str, Any]:
         if atribs["warranty"] in self.no_warranty_strings:
             atribs["warranty"] = None
         return atribs
 
+    def apply_batch(self, batch: ColumnBatch) -> ColumnBatch:
+        no_warranty_strings = set(self.no_warranty_strings)
+        batch["warranty"] = [None if w in no_warranty_strings else w for w in batch["warranty"]]
+        return batch
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], List[str]]]:
+        return [f"{ref}_strings = frozenset({ref}.no_warranty_strings)"], \
+            [f'if atribs["warranty"] in {ref}_strings:',
+             '    atribs["warranty"] = None']
+
 
 @dataclass
 class PriceConverter(Transformation):
     currency_factor: float
+    input_keys = ("price",)
 
     def apply(self, atribs: Dict[str, Any]) -> Dict[str, Any]:
         atribs["price"] = atribs["price"] * self.currency_factor
         return atribs
 
+    def apply_batch(self, batch: ColumnBatch) -> ColumnBatch:
+        currency_factor = self.currency_factor
+        batch["price"] = [price * currency_factor for price in batch["price"]]
+        return batch
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], List[str]]]:
+        # the factor is read on every call, since long-running processes update it.
+        return [f"{ref}_factor = {ref}.currency_factor"], [f'atribs["price"] = atribs["price"] * {ref}_factor']
+
 
 @dataclass
 class InsertSellerID(Transformation):
+    input_keys = ("seller",)
 
     def apply(self, atribs: Dict[str, Any]) -> Dict[str, Any]:
         atribs["seller_id"] = atribs["seller"]["id"]
         return atribs
 
+    def apply_batch(self, batch: ColumnBatch) -> ColumnBatch:
+        batch["seller_id"] = [seller["id"] for seller in batch["seller"]]
+        return batch
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], List[str]]]:
+        return [], ['atribs["seller_id"] = atribs["seller"]["id"]']
+
+
 @dataclass
 class InsertSellerCompletedSales(Transformation):
+    input_keys = ("seller",)
 
     def apply(self, atribs: Dict[str, Any]) -> Dict[str, Any]:
         atribs["completed_sales"] = atribs["seller"]["seller_reputation"]["metrics"]["sales"]["completed"]
         return atribs
 
+    def apply_batch(self, batch: ColumnBatch) -> ColumnBatch:
+        batch["completed_sales"] = [seller["seller_reputation"]["metrics"]["sales"]["completed"]
+                                    for seller in batch["seller"]]
+        return batch
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], List[str]]]:
+        return [], ['atribs["completed_sales"] = '
+                    'atribs["seller"]["seller_reputation"]["metrics"]["sales"]["completed"]']
+
+
 @dataclass
 class ShippingMethods(Transformation):
+    input_keys = ("shipping",)
 
     def apply(self, atribs: Dict[str, Any]) -> Dict[str, Any]:
         tags = atribs["shipping"]["tags"]
-        atribs["shipping"] = tags if len(tags) > 0 else [None]
+        atribs["shipping"] = tags if len(tags) > 0 else [NO_SHIPPING_METHOD]
         return atribs
+
+    def apply_batch(self, batch: ColumnBatch) -> ColumnBatch:
+        batch["shipping"] = [shipping["tags"] if len(shipping["tags"]) > 0 else [NO_SHIPPING_METHOD]
+                             for shipping in batch["shipping"]]
+        return batch
+
+    def compile_source(self, ref: str) -> Optional[Tuple[List[str], List[str]]]:
+        return [], [f'{ref}_tags = atribs["shipping"]["tags"]',
+                    f'atribs["shipping"] = {ref}_tags if len({ref}_tags) > 0 else [{NO_SHIPPING_METHOD!r}]']
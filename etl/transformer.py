@@ -1,10 +1,13 @@
 import logging
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Set, Collection, Sequence, Iterable
 
 from etl.cleaner.data_cleaner import DataCleaner
+from etl.codegen import compile_transformations
 from etl.data_batch_generators.data_batch_generator import DataBatchGenerator, SellersBatchGenerator, \
-    ProductsBatchGenerator, ShippingBatchGenerator
+    ProductsBatchGenerator, ShippingBatchGenerator, FusedBatchGenerator
 from etl.filter.filter import Filter
+from etl.transformations.column_batch import ColumnBatch
+from etl.transformations.item_batch import ItemBatch
 from etl.transformations.transformations import Transformation
 from utils.decorators import _time_profiling
 from utils.time_profilers import TransformTimeProfiler
@@ -25,30 +28,64 @@ class Transformer:
     preprocessed_data_cleaner: DataCleaner
         used for cleaning items objects, after transformations, in order to retain only the useful attributes for
         generating the sellers and item_shipping object lists.
-    sellers_generator: SellersBatchGenerator
+    sellers_generator: Optional[SellersBatchGenerator]
         generator of sellers from preprocessed data
-    shipping_generator: ShippingBatchGenerator
+    shipping_generator: Optional[ShippingBatchGenerator]
         generator of item_shipping objects list from preprocessed data
-    products_generator: ProductsBatchGenerator
+    products_generator: Optional[ProductsBatchGenerator]
         generator of products objects list from preprocessed data
     sellers_filter: Optional[Filter]
         To every seller object generated, a filter would be applied according to a list of Condition (for example,
         exclude sellers that were already stored in database.)
+    columnar: bool
+        if True, the items are converted to a ColumnBatch and every transformation is applied to whole columns
+        (Transformation.apply_batch) instead of item by item.
+    fused_generator: Optional[FusedBatchGenerator]
+        if defined, it generates products, item_shipping and sellers in a single pass, instead of the three separate
+        generators.
+    compiled: bool
+        if True (and not columnar), the transformations and the cleaner are compiled into a single function applied to
+        the whole list of items (see etl.codegen).
+    item_keys: Optional[Collection[str]]
+        keys the items are expected to have, besides the ones read by the transformations (for instance, the ones read
+        by the items filter). Compiled transformers drop the irrelevant ones without checking the rest.
+    compact: bool
+        if True, the transformed items are kept in a compact ItemBatch (see etl.transformations.item_batch), and the
+        products and item_shipping objects are compact batches too (fused_generator is required). The dicts of the
+        items list are discarded (the list is emptied) once the batch was built.
     """
 
     def __init__(self,
                  transformations: List[Transformation],
                  preprocessed_data_cleaner: DataCleaner,
-                 sellers_generator: SellersBatchGenerator,
-                 shipping_generator: ShippingBatchGenerator,
-                 products_generator: ProductsBatchGenerator,
-                 sellers_filter: Optional[Filter]):
+                 sellers_generator: Optional[SellersBatchGenerator] = None,
+                 shipping_generator: Optional[ShippingBatchGenerator] = None,
+                 products_generator: Optional[ProductsBatchGenerator] = None,
+                 sellers_filter: Optional[Filter] = None,
+                 columnar: bool = False,
+                 fused_generator: Optional[FusedBatchGenerator] = None,
+                 compiled: bool = False,
+                 item_keys: Optional[Collection[str]] = None,
+                 compact: bool = False):
+        if not fused_generator and not (sellers_generator and shipping_generator and products_generator):
+            raise ValueError("fused_generator or sellers, shipping and products generators must be defined.")
+        if compact and not fused_generator:
+            raise ValueError("Compact items require a fused_generator.")
         self.transformations = transformations
         self.preprocessed_data_cleaner = preprocessed_data_cleaner
         self.sellers_generator = sellers_generator
         self.products_generator = products_generator
         self.shipping_generator = shipping_generator
         self.sellers_filter = sellers_filter
+        self.columnar = columnar
+        self.fused_generator = fused_generator
+        self.compiled = compiled
+        self.compact = compact
+        self._compiled_transform = None
+        if compiled:
+            known_keys = {key for tr in transformations for key in tr.input_keys or ()} | set(item_keys or ())
+            self._compiled_transform = compile_transformations(transformations, preprocessed_data_cleaner,
+                                                               known_keys=known_keys)
 
     def _apply_transformations(self, atribs: Dict[str, Any]) -> Dict[str, Any]:
         for tr in self.transformations:
@@ -58,23 +95,92 @@ class Transformer:
     def _clean_raw(self, atribs: Dict[str, Any]) -> Dict[str, Any]:
         return self.preprocessed_data_cleaner.clean(atribs)
 
+    def _transform_records(self, items_list: List[Dict[str, Any]]) -> None:
+        if self._compiled_transform is not None:
+            self._compiled_transform(items_list)
+            return
+        for atribs in items_list:
+            self._apply_transformations(atribs)
+            self._clean_raw(atribs)
+
+    def input_keys(self) -> Optional[Set[str]]:
+        """
+        Keys of the items needed by the transformations and kept by the cleaner (besides the ones added by the
+        transformations). It's also the set of keys converted to columns in columnar mode. None (every key) if any of
+        them is unknown.
+        """
+        relevant_keys = self.preprocessed_data_cleaner.relevant_keys
+        if not relevant_keys or any(tr.input_keys is None for tr in self.transformations):
+            return None
+        keys = set(relevant_keys)
+        for tr in self.transformations:
+            keys.update(tr.input_keys)
+        return keys
+
+    def _transform_columnar(self, items_list: List[Dict[str, Any]]) -> ColumnBatch:
+        batch = ColumnBatch.from_records(items_list, self.input_keys())
+        for tr in self.transformations:
+            batch = tr.apply_batch(batch)
+        return self.preprocessed_data_cleaner.clean_batch(batch)
+
     def _opt_filter_sellers(self, sellers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         if self.sellers_filter:
             len_sellers = len(sellers)
             sellers = self.sellers_filter.apply_to_all(sellers)
+            # sellers already generated by a previous batch are discarded too.
+            sellers = [s for s in sellers if self.sellers_filter.register(s)]
             after_filter_len = len(sellers)
             if len_sellers - after_filter_len > 0:
                 logging.warning(f"{len_sellers - after_filter_len} seller registries were filtered.")
         return sellers
 
+    def release(self, sellers: Iterable[Dict[str, Any]]) -> None:
+        """
+        Forgets sellers registered by transform that weren't loaded, so later batches can generate them again.
+        """
+        if self.sellers_filter:
+            self.sellers_filter.release(sellers)
+
     @_time_profiling(TransformTimeProfiler)
-    def transform(self, items_list: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]],
-                                                                   List[Dict[str, Any]],
+    def transform(self, items_list: List[Dict[str, Any]]) -> Tuple[Sequence[Dict[str, Any]],
+                                                                   Sequence[Dict[str, Any]],
                                                                    List[Dict[str, Any]]]:
+        """
+        :param items_list: filtered items. They are transformed in place and, if compact, the list is emptied once the
+        ItemBatch is built, so the caller can't read the items from it afterwards.
+        :return: products, item_shipping objects and sellers (the first two are ItemBatch objects if compact).
+        """
+        if self.compact:
+            if self.columnar:
+                batch = ItemBatch.from_columns(self._transform_columnar(items_list))
+            else:
+                self._transform_records(items_list)
+                batch = ItemBatch.from_records(items_list)
+            # the dicts are freed, even if the caller keeps the list.
+            items_list.clear()
+            products_list, item_shipping, sellers = self.fused_generator.build_compact(batch)
+            sellers = self._opt_filter_sellers(sellers)
+            return products_list, item_shipping, sellers
 
-        for atribs in items_list:
-            self._apply_transformations(atribs)
-            self._clean_raw(atribs)
+        if self.fused_generator:
+            if self.columnar:
+                items_list = self._transform_columnar(items_list).to_records()
+            else:
+                self._transform_records(items_list)
+            products_list, item_shipping, sellers = self.fused_generator.build(items_list)
+            sellers = self._opt_filter_sellers(sellers)
+            return products_list, item_shipping, sellers
+
+        if self.columnar:
+            batch = self._transform_columnar(items_list)
+            sellers = self.sellers_generator.build_batch(batch)
+            sellers = self._opt_filter_sellers(sellers)
+            item_shipping = self.shipping_generator.build_batch(batch)
+            products_list = self.products_generator.build_batch(batch)
+            del batch
+            return products_list, item_shipping, sellers
+
+        self._transform_records(items_list)
 
         sellers = self.sellers_generator.build(items_list)
         sellers = self._opt_filter_sellers(sellers)
@@ -0,0 +1,139 @@
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from database.job_queue import JobQueue
+from database.models import EtlJob
+from etl.loader import reset_profilers
+from utils.exceptions import ResultsNotFoundException
+from utils.tracing import span
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class _Heartbeat(threading.Thread):
+    """
+    Extends the lease of a job periodically while it is processed. It uses its own queue (and session), since sessions
+    can't be shared by threads.
+    """
+
+    def __init__(self, job_queue: JobQueue, job_id: int, interval: float) -> None:
+        super().__init__(name=f"heartbeat-{job_id}", daemon=True)
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                if not self.job_queue.heartbeat(self.job_id):
+                    logging.warning(f"Lease of job {self.job_id} was lost.")
+                    return
+            except Exception as ex:
+                logging.warning(f"Heartbeat of job {self.job_id} failed: {ex}")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class EtlWorker:
+    """
+    Worker process of the ETL job queue: claims jobs, runs them and records their status and processing time in the
+    etl_jobs table, until there are no jobs for idle_timeout seconds (or forever, if it's not defined). Scaling out is
+    only starting more workers, in the same host or in others.
+    Attributes
+    ----------
+    session_factory: Callable[[], Session]
+        builds the sessions of the worker (for instance, a sessionmaker bound to the worker engine).
+    run_job: Callable[[EtlJob, Session], None]
+        runs the ETL process of a job, with the given session.
+    worker_id: str
+    lease_seconds: float
+        lease duration of the claimed jobs; heartbeats are sent every lease_seconds / 3.
+    poll_interval: float
+        seconds between two claims, when there aren't claimable jobs.
+    idle_timeout: Optional[float]
+        if defined, the worker stops after this amount of seconds without claimable jobs.
+    max_attempts: int
+        max amount of times a job is claimed.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], run_job: Callable[[EtlJob, Session], None],
+                 worker_id: Optional[str] = None, lease_seconds: float = 300.0, poll_interval: float = 5.0,
+                 idle_timeout: Optional[float] = None, max_attempts: int = 3) -> None:
+        self.session_factory = session_factory
+        self.run_job = run_job
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.max_attempts = max_attempts
+
+    def _queue(self) -> JobQueue:
+        return JobQueue(self.session_factory(), worker_id=self.worker_id, lease_seconds=self.lease_seconds,
+                        max_attempts=self.max_attempts)
+
+    def _process(self, job_queue: JobQueue, job: EtlJob) -> None:
+        logging.info(f"Worker {self.worker_id} claimed job {job.rowid}: '{job.query}' (attempt {job.attempts}).")
+        heartbeat = _Heartbeat(self._queue(), job.rowid, interval=self.lease_seconds / 3)
+        heartbeat.start()
+        session = self.session_factory()
+        t0 = time.time()
+        error = None
+        try:
+            with span("job", job_id=job.rowid, query=job.query, attempt=job.attempts):
+                self.run_job(job, session)
+        except ResultsNotFoundException:
+            logging.info(f"No new items for job {job.rowid}.")
+        except Exception as ex:
+            logging.exception(f"Job {job.rowid} failed.")
+            error = str(ex) or type(ex).__name__
+        finally:
+            heartbeat.stop()
+            heartbeat.job_queue.session.close()
+            session.close()
+            # metrics of the job were already stored by its loader.
+            reset_profilers()
+        process_time = time.time() - t0
+
+        stored = job_queue.complete(job.rowid, process_time) if error is None else \
+            job_queue.fail(job.rowid, process_time, error, job.attempts)
+        if not stored:
+            logging.warning(f"Job {job.rowid} finished, but its lease had expired: its result was not recorded.")
+        else:
+            logging.info(f"Job {job.rowid} {'done' if error is None else 'failed'} in {round(process_time, 2)} "
+                         f"seconds.")
+
+    def run(self) -> int:
+        """
+        Processes jobs until the worker is idle for idle_timeout seconds.
+        :return: amount of processed jobs.
+        """
+        job_queue = self._queue()
+        processed = 0
+        idle_since = time.time()
+        logging.info(f"Worker {self.worker_id} started.")
+        try:
+            while True:
+                job = job_queue.claim()
+                if job is not None:
+                    self._process(job_queue, job)
+                    processed += 1
+                    idle_since = time.time()
+                    continue
+                if self.idle_timeout is not None and time.time() - idle_since >= self.idle_timeout:
+                    break
+                time.sleep(self.poll_interval)
+        finally:
+            job_queue.session.close()
+        logging.info(f"Worker {self.worker_id} stopped after {processed} jobs.")
+        return processed
@@ -0,0 +1,36 @@
+import argparse
+import logging
+import sys
+from datetime import date
+
+from database import engine
+from database.parquet_export import ParquetExporter, EXPORTED_TABLES, PYARROW_MISSING, pyarrow
+
+for handler in logging.root.handlers[:]:
+    logging.root.removeHandler(handler)
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports the warehouse tables to Parquet files partitioned by day.")
+    parser.add_argument("--output_dir", help="Directory of the exported tables (one directory per table, with one "
+                                             "day=YYYY-MM-DD partition per day).", required=True, type=str)
+    parser.add_argument("--tables", help="Exported tables (by default, all of them).", default=None, nargs="+",
+                        choices=list(EXPORTED_TABLES))
+    parser.add_argument("--since", help="First exported day (YYYY-MM-DD). By default, the day after the last exported "
+                                        "one, so only days added since the last export are written.",
+                        default=None, type=date.fromisoformat)
+    parser.add_argument("--until", help="Day after the last exported one (YYYY-MM-DD). By default the current day of "
+                                        "the database, since it isn't complete.", default=None, type=date.fromisoformat)
+    parser.add_argument("--row_group_size", help="Rows per Parquet row group (and max amount of rows in memory).",
+                        default=50_000, type=int)
+    parser.add_argument("--compression", help="Parquet compression codec.", default="snappy", type=str)
+
+    args = parser.parse_args()
+    if pyarrow is None:
+        parser.error(PYARROW_MISSING)
+
+    exporter = ParquetExporter(engine, args.output_dir, row_group_size=args.row_group_size,
+                               compression=args.compression)
+    partitions, rows = exporter.export(args.tables, since=args.since, until=args.until)
+    logging.info(f"Finished! {rows} rows of {partitions} partitions were exported into {args.output_dir}.")
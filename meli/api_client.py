@@ -1,37 +1,384 @@
+import json
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, Type
+
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
 
+from meli.archive import ResponseArchive
+from meli.cache import ResponseCache
+from meli.rate_limiter import AIMDLimiter, TokenBucket, site_bucket, OK, THROTTLED, ERROR
 from utils.decorators import _time_profiling
-from utils.time_profilers import SearchApiTimeProfiler, ConverterApiTimeProfiler, AttributesItemApiTimeProfiler
+from utils.tracing import span
+from utils.time_profilers import SearchApiTimeProfiler, ConverterApiTimeProfiler, AttributesItemApiTimeProfiler, \
+    ItemsMultigetApiTimeProfiler, APIRequestTimeProfilerBase, HttpConnectionPoolProfiler
+
+# max amount of ids accepted by the multi-item endpoint (https://api.mercadolibre.com/items?ids=...) per call.
+MULTIGET_MAX_IDS = 20
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+API_URL = "https://api.mercadolibre.com"
+
+
+def match_multiget_entries(item_ids: List[str], entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Matches the entries of a multiget response with the requested ids, by the id of their body, since the API doesn't
+    guarantee their order nor one entry per id. Error entries don't have the id of their item: they are matched by
+    position, only if the response has one entry per requested id.
+    :return: entry of each requested id. Ids without an entry are left out.
+    """
+    requested = set(item_ids)
+    matched: Dict[str, Dict[str, Any]] = {}
+    unmatched: List[int] = []
+    for position, entry in enumerate(entries):
+        body = entry.get("body") if isinstance(entry, dict) else None
+        item_id = body.get("id") if isinstance(body, dict) else None
+        if item_id in requested and item_id not in matched:
+            matched[item_id] = entry
+        else:
+            unmatched.append(position)
+    if len(entries) == len(item_ids):
+        for position in unmatched:
+            entry = entries[position]
+            if item_ids[position] not in matched and isinstance(entry, dict) and entry.get("code") != 200:
+                matched[item_ids[position]] = entry
+    return matched
 
 
 class MLApiClient:
     """
-    Client for requesting useful data to MeLi public API.
+    Client for requesting useful data to MeLi public API. Every request goes through a shared keep-alive connection
+    pool, and 429/5xx responses (or connection errors) are retried with jittered exponential backoff. Optionally, the
+    requests in flight to each endpoint are limited by an adaptive (AIMD) limiter, and the request rate to the site is
+    capped by a token bucket.
     Attributes
     ----------
     country_ml: str
         Country MeLi site alias. For example: MLB (Mercado Libre Brasil)
+    pool_maxsize: int
+        max amount of connections kept alive in the pool. It should match the amount of concurrent requests.
+    max_retries: int
+        max amount of retries for a single request.
+    backoff_factor: float
+        base delay (seconds) of the exponential backoff between retries.
+    max_backoff: float
+        max delay (seconds) between retries, unless the API asks for a longer one through the Retry-After header.
+    timeout: float
+        connect/read timeout (seconds) of each request.
+    cache: Optional[ResponseCache]
+        if defined, responses of the apis with a time to live in the cache are stored and reused.
+    adaptive_concurrency: bool
+        if True, the requests in flight to each endpoint are limited by an AIMDLimiter (between 1 and pool_maxsize),
+        driven by the latency of the requests and the rate of 429 and failed responses.
+    max_requests_per_second: Optional[float]
+        if defined, max rate of requests to the site (shared by every client of the site in this process).
+    api_url: str
+        base url of the API. It can be changed to use a stand-in of the API (see benchmarks.mock_meli_api).
+    archive: Optional[ResponseArchive]
+        if defined, the body of every response (cached ones too) is recorded in it, so the run can be replayed later
+        without requests (see etl.replay).
     """
 
-    def __init__(self, country_ml: str) -> None:
-        self.items_search_url = f"https://api.mercadolibre.com/sites/{country_ml}/search"
-        self.item_attributes_url = "https://api.mercadolibre.com/items/"
-        self.currencies_url = "https://api.mercadolibre.com/currencies"
-        self.currency_convert_url = f"https://api.mercadolibre.com/currency_conversions/" \
+    def __init__(self, country_ml: str, pool_maxsize: int = 10, max_retries: int = 3,
+                 backoff_factor: float = 0.5, max_backoff: float = 30.0, timeout: float = 10.0,
+                 cache: Optional[ResponseCache] = None, adaptive_concurrency: bool = False,
+                 max_requests_per_second: Optional[float] = None, api_url: str = API_URL,
+                 archive: Optional[ResponseArchive] = None) -> None:
+        api_url = api_url.rstrip("/")
+        self.items_search_url = f"{api_url}/sites/{country_ml}/search"
+        self.item_attributes_url = f"{api_url}/items/"
+        self.items_multiget_url = f"{api_url}/items"
+        self.currencies_url = f"{api_url}/currencies"
+        self.currency_convert_url = f"{api_url}/currency_conversions/" \
                                     "search?from={}&to={}"
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.archive = archive
+        self.pool_maxsize = pool_maxsize
+        self.adaptive_concurrency = adaptive_concurrency
+        self._bucket: Optional[TokenBucket] = site_bucket(country_ml, max_requests_per_second) \
+            if max_requests_per_second else None
+        self._limiters: Dict[str, AIMDLimiter] = {}
+        self._limiters_lock = threading.Lock()
+
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+        self._pool_lock = threading.Lock()
+        self._seen_connections = 0
+        self._seen_requests = 0
+
+    def close(self) -> None:
+        """
+        Closes the connections of the client, and its cache and archive (if any).
+        """
+        self._session.close()
+        if self.cache:
+            self.cache.close()
+        if self.archive:
+            self.archive.close()
+
+    def __enter__(self) -> "MLApiClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _archived(self, time_profiler: Type[APIRequestTimeProfilerBase], resp: Response) -> Response:
+        if self.archive:
+            self.archive.record(time_profiler.api_name, resp.url, resp.status_code, resp.content)
+        return resp
+
+    def _record_pool_usage(self) -> None:
+        """
+        Compares the amount of connections opened by the pool with the amount of requests sent through it: every
+        request that didn't need a new connection reused a kept-alive one (pool hit).
+        """
+        with self._pool_lock:
+            pools = self._adapter.poolmanager.pools
+            connections, requests_sent = 0, 0
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    requests_sent += pool.num_requests
+            if connections < self._seen_connections or requests_sent < self._seen_requests:
+                # a pool was discarded, start counting again.
+                self._seen_connections, self._seen_requests = 0, 0
+            new_connections = connections - self._seen_connections
+            new_requests = requests_sent - self._seen_requests
+            self._seen_connections, self._seen_requests = connections, requests_sent
+
+        HttpConnectionPoolProfiler.increment("pool_misses", new_connections)
+        HttpConnectionPoolProfiler.increment("pool_hits", max(new_requests - new_connections, 0))
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+        if retry_after:
+            try:
+                return float(retry_after) + delay
+            except ValueError:
+                try:
+                    wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                    return max(wait, 0) + delay
+                except (TypeError, ValueError):
+                    pass
+        return delay
+
+    def _limiter(self, time_profiler: Type[APIRequestTimeProfilerBase]) -> Optional[AIMDLimiter]:
+        if not self.adaptive_concurrency:
+            return None
+        with self._limiters_lock:
+            limiter = self._limiters.get(time_profiler.api_name)
+            if limiter is None:
+                limiter = AIMDLimiter(time_profiler.api_name, initial_limit=max(1, self.pool_maxsize // 2),
+                                      max_limit=self.pool_maxsize)
+                self._limiters[time_profiler.api_name] = limiter
+            return limiter
+
+    def _send(self, url: str, time_profiler: Type[APIRequestTimeProfilerBase],
+              params: Optional[Dict[str, Any]], headers: Optional[Dict[str, str]], attempt: int = 0) -> Response:
+        """
+        Sends a single request, once the site rate and the endpoint concurrency limit allow it. The latency and outcome
+        of the request drive the concurrency limit of the endpoint.
+        """
+        with span(f"http:{time_profiler.api_name}", attempt=attempt) as s:
+            if self._bucket:
+                waited = self._bucket.acquire()
+                if waited >= 0.001:
+                    time_profiler.increment("rate_limit_wait_ms", int(waited * 1000))
+                    s.set("rate_limit_wait_ms", int(waited * 1000))
+            limiter = self._limiter(time_profiler)
+            if limiter is None:
+                resp = self._session.get(url, params=params, headers=headers, timeout=self.timeout)
+                s.set("status_code", resp.status_code)
+                s.set("bytes", len(resp.content))
+                return resp
+
+            waited = limiter.acquire()
+            if waited >= 0.001:
+                time_profiler.increment("concurrency_wait_ms", int(waited * 1000))
+                s.set("concurrency_wait_ms", int(waited * 1000))
+            t0 = time.perf_counter()
+            outcome = ERROR
+            try:
+                resp = self._session.get(url, params=params, headers=headers, timeout=self.timeout)
+                outcome = THROTTLED if resp.status_code == 429 else ERROR if resp.status_code >= 500 else OK
+                s.set("status_code", resp.status_code)
+                s.set("bytes", len(resp.content))
+                return resp
+            finally:
+                limiter.release(time.perf_counter() - t0, outcome)
+                s.set("concurrency_limit", int(limiter.limit))
+                time_profiler.set_counter("concurrency_limit", int(limiter.limit))
+                time_profiler.set_counter("concurrency_limit_increases", limiter.increases)
+                time_profiler.set_counter("concurrency_limit_decreases", limiter.decreases)
+
+    def _get(self, url: str, time_profiler: Type[APIRequestTimeProfilerBase],
+             params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None) -> Response:
+        attempt = 0
+        while True:
+            try:
+                resp = self._send(url, time_profiler, params, headers, attempt)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                time_profiler.increment("errors")
+                if attempt >= self.max_retries:
+                    raise
+                detail = str(ex)
+                delay = self._backoff_delay(attempt, None)
+            else:
+                self._record_pool_usage()
+                time_profiler.increment("bytes_received", len(resp.content))
+                if resp.status_code == 429:
+                    time_profiler.increment("throttled")
+                elif resp.status_code >= 500:
+                    time_profiler.increment("errors")
+                if resp.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return resp
+                detail = f"status code: {resp.status_code}"
+                delay = self._backoff_delay(attempt, resp.headers.get("Retry-After"))
+
+            time_profiler.increment("retries")
+            logging.warning(f"{time_profiler.api_name} request failed ({detail}). "
+                            f"Retrying in {round(delay, 2)} seconds ({attempt + 1}/{self.max_retries}).")
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _cache_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        return requests.Request("GET", url, params=params).prepare().url
+
+    @staticmethod
+    def _response_from_cache(url: str, body: bytes) -> Response:
+        resp = Response()
+        resp.status_code = 200
+        resp.url = url
+        resp.encoding = "utf-8"
+        resp.headers["Content-Type"] = "application/json"
+        resp._content = body
+        resp.from_cache = True
+        return resp
+
+    def _cached_get(self, url: str, time_profiler: Type[APIRequestTimeProfilerBase],
+                    params: Optional[Dict[str, Any]] = None) -> Response:
+        """
+        Like _get, but fresh cached responses are returned without any request, and expired ones with an ETag are
+        revalidated with If-None-Match.
+        """
+        if not self.cache or not self.cache.ttl(time_profiler.api_name):
+            return self._get(url, time_profiler, params)
+
+        key = self._cache_key(url, params)
+        cached = self.cache.get(key)
+        if cached and cached.age < self.cache.ttl(time_profiler.api_name):
+            time_profiler.increment("cache_hits")
+            time_profiler.increment("cache_bytes_saved", len(cached.body))
+            return self._response_from_cache(key, cached.body)
+
+        headers = {"If-None-Match": cached.etag} if cached and cached.etag else None
+        resp = self._get(url, time_profiler, params, headers)
+        if resp.status_code == 304 and cached:
+            self.cache.touch(key)
+            time_profiler.increment("cache_revalidations")
+            time_profiler.increment("cache_bytes_saved", len(cached.body))
+            return self._response_from_cache(key, cached.body)
+
+        time_profiler.increment("cache_misses")
+        if resp.status_code == 200:
+            self.cache.put(key, time_profiler.api_name, resp.content, resp.headers.get("ETag"))
+        return resp
 
     @_time_profiling(ConverterApiTimeProfiler)
     def get_currency_conv_rate(self, from_currency_id: str = "BRL",
                                to_currenc_id: str = "USD") -> Response:
-        return requests.get(self.currency_convert_url.format(from_currency_id, to_currenc_id))
+        return self._archived(ConverterApiTimeProfiler, self._cached_get(
+            self.currency_convert_url.format(from_currency_id, to_currenc_id), ConverterApiTimeProfiler))
 
     @_time_profiling(SearchApiTimeProfiler)
     def request_to_search_api(self, query: str, exclude_seller_id: int,
-                              offset: int, limit: int) -> Response:
-        return requests.get(
-            self.items_search_url + f"?q={query}&offset={offset}&limit={limit}&seller_id!={exclude_seller_id}")
+                              offset: int, limit: int, attributes: Optional[List[str]] = None) -> Response:
+        """
+        :param attributes: if defined, only these top level keys of the response are requested (for instance, results).
+        Ignored while recording an archive, which keeps the whole responses, so later replays can read keys the
+        current run doesn't need.
+        """
+        url = self.items_search_url + f"?q={query}&offset={offset}&limit={limit}&seller_id!={exclude_seller_id}"
+        if attributes and not self.archive:
+            url += f"&attributes={','.join(attributes)}"
+        return self._archived(SearchApiTimeProfiler, self._cached_get(url, SearchApiTimeProfiler))
 
     @_time_profiling(AttributesItemApiTimeProfiler)
     def request_to_item_attributes_api(self, item_id: str) -> Response:
-        return requests.get(self.item_attributes_url + item_id)
+        return self._archived(AttributesItemApiTimeProfiler,
+                              self._cached_get(self.item_attributes_url + item_id, AttributesItemApiTimeProfiler))
+
+    @_time_profiling(ItemsMultigetApiTimeProfiler)
+    def request_to_items_multiget_api(self, item_ids: List[str], attributes: Optional[List[str]] = None) -> Response:
+        """
+        Requests the attributes of several items in one call. The response is a list of {"code": ..., "body": ...}
+        entries, usually one per requested id (see match_multiget_entries).
+        :param item_ids: at most MULTIGET_MAX_IDS item ids.
+        :param attributes: if defined, only these attributes are included in each item body.
+        """
+        if len(item_ids) > MULTIGET_MAX_IDS:
+            raise ValueError(f"At most {MULTIGET_MAX_IDS} item ids can be requested per call.")
+        params = {"ids": ",".join(item_ids)}
+        if attributes:
+            params["attributes"] = ",".join(attributes)
+        if not self.cache or not self.cache.ttl(ItemsMultigetApiTimeProfiler.api_name):
+            resp = self._get(self.items_multiget_url, ItemsMultigetApiTimeProfiler, params=params)
+        else:
+            resp = self._cached_multiget(item_ids, attributes)
+        return self._archived(ItemsMultigetApiTimeProfiler, resp)
+
+    def _cached_multiget(self, item_ids: List[str], attributes: Optional[List[str]]) -> Response:
+        """
+        Multiget responses are cached per item, so overlapping chunks (for example, items found by different queries)
+        reuse the cached entries. Only the items that are not cached (or expired) are requested. Unlike _cached_get,
+        expired items aren't revalidated: the ETag of a multiget response covers every item of it, so they are
+        requested again.
+        """
+        profiler = ItemsMultigetApiTimeProfiler
+        ttl = self.cache.ttl(profiler.api_name)
+        attributes_param = {"attributes": ",".join(attributes)} if attributes else None
+        keys = {item_id: self._cache_key(self.item_attributes_url + item_id, attributes_param) for item_id in item_ids}
+
+        entries: Dict[str, Any] = {}
+        for item_id in item_ids:
+            cached = self.cache.get(keys[item_id])
+            if cached and cached.age < ttl:
+                profiler.increment("cache_hits")
+                profiler.increment("cache_bytes_saved", len(cached.body))
+                entries[item_id] = {"code": 200, "body": json.loads(cached.body)}
+
+        missing_ids = [item_id for item_id in item_ids if item_id not in entries]
+        if not missing_ids:
+            return self._response_from_cache(self.items_multiget_url,
+                                             json.dumps([entries[item_id] for item_id in item_ids]).encode())
+
+        profiler.increment("cache_misses", len(missing_ids))
+        params = {"ids": ",".join(missing_ids), **(attributes_param or {})}
+        resp = self._get(self.items_multiget_url, profiler, params=params)
+        if resp.status_code != 200:
+            return resp
+
+        for item_id, entry in match_multiget_entries(missing_ids, resp.json()).items():
+            entries[item_id] = entry
+            if entry.get("code") == 200:
+                self.cache.put(keys[item_id], profiler.api_name, json.dumps(entry["body"]).encode())
+
+        # ids left out of the response are left out of this one too.
+        resp._content = json.dumps([entries[item_id] for item_id in item_ids if item_id in entries]).encode()
+        return resp
@@ -0,0 +1,101 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+from meli.decoding import loads
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+
+
+@dataclass
+class ArchivedResponse:
+    """
+    Raw response of MeLi API recorded by a ResponseArchive.
+    Attributes
+    ----------
+    time: float
+        epoch time of the response.
+    api_name: str
+        api_name of the time profiler of the request (search, items_multiget, ...).
+    url: str
+    status_code: int
+    body: str
+    """
+    time: float
+    api_name: str
+    url: str
+    status_code: int
+    body: str
+
+    def json(self):
+        return loads(self.body)
+
+
+class ResponseArchive:
+    """
+    Append-only archive of the raw responses of a run, in a gzip compressed JSON lines file (<directory>/<run_id>
+    .jsonl.gz). Responses are compressed in a single gzip stream, which is flushed (Z_SYNC_FLUSH) after each one: the
+    file is readable at any time, even if the process dies (its last response may be incomplete), while responses are
+    still compressed together. It can be shared by several threads, and must be closed to complete the stream.
+    Attributes
+    ----------
+    path: str
+        path of the archive file.
+    """
+
+    def __init__(self, directory: str, run_id: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{run_id}{ARCHIVE_SUFFIX}")
+        self.records = 0
+        self._lock = threading.Lock()
+        # an archive that exists already (same run id) gets a new gzip member, which is read as part of the stream.
+        self._file = gzip.open(self.path, "ab", compresslevel=6)
+
+    def record(self, api_name: str, url: str, status_code: int, body: bytes) -> None:
+        line = json.dumps({"time": time.time(), "api_name": api_name, "url": url, "status_code": status_code,
+                           "body": body.decode("utf-8", errors="replace")}).encode() + b"\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+            self.records += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def archive_paths(paths: List[str]) -> List[str]:
+    """
+    Expands directories into the archives they contain. Archives of a directory are sorted by name, which starts with
+    the run date, so older runs come first.
+    """
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            expanded += sorted(glob.glob(os.path.join(path, f"*{ARCHIVE_SUFFIX}")))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def read_archive(path: str, api_names: Optional[List[str]] = None) -> Iterator[ArchivedResponse]:
+    """
+    Yields the responses of an archive, in the order they were recorded. A response that was being written when its
+    process died is skipped.
+    :param api_names: if defined, only the responses of these apis are yielded.
+    """
+    with gzip.open(path, "rb") as file:
+        try:
+            for line in file:
+                record = json.loads(line)
+                if api_names is None or record["api_name"] in api_names:
+                    yield ArchivedResponse(**record)
+        except (EOFError, zlib.error, ValueError) as ex:
+            logging.warning(f"Archive {path} ends with an incomplete response, which was skipped ({ex}).")
@@ -0,0 +1,101 @@
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+# default time to live (seconds) of the cached responses of each api. Apis not listed here are not cached.
+DEFAULT_TTLS = {
+    "currency_coverter": 6 * 60 * 60,
+    "item_attributes": 24 * 60 * 60,
+    "items_multiget": 24 * 60 * 60,
+}
+
+EVICTION_TARGET = 0.9
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: Optional[str]
+    stored_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+
+class ResponseCache:
+    """
+    Persistent cache of MeLi API responses, stored in a local SQLite file. Entries expire according to the time to live
+    of the api they belong to; expired entries with an ETag can still be revalidated with an If-None-Match request.
+    Items of multiget responses are stored without ETag (the API only returns one for the whole response), so they are
+    only reused within their time to live, and requested again once they expire. When the stored bodies exceed
+    max_bytes, the least recently used entries are evicted.
+    Attributes
+    ----------
+    path: str
+        path of the SQLite file.
+    ttls: Dict[str, float]
+        time to live (seconds) of the responses of each api (by api_name). Apis without ttl are not cached.
+    max_bytes: int
+        max amount of bytes of the stored response bodies.
+    """
+
+    def __init__(self, path: str, ttls: Optional[Dict[str, float]] = None, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.path = path
+        self.ttls = ttls if ttls is not None else DEFAULT_TTLS
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                           "key TEXT PRIMARY KEY, api_name TEXT NOT NULL, body BLOB NOT NULL, etag TEXT, "
+                           "stored_at REAL NOT NULL, last_access REAL NOT NULL, size INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_access ON responses (last_access)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def ttl(self, api_name: str) -> float:
+        return self.ttls.get(api_name, 0)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._conn.execute("SELECT body, etag, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return CachedResponse(body=row[0], etag=row[1], stored_at=row[2])
+
+    def put(self, key: str, api_name: str, body: bytes, etag: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, api_name, body, etag, stored_at, last_access, "
+                               "size) VALUES (?, ?, ?, ?, ?, ?, ?)", (key, api_name, body, etag, now, now, len(body)))
+            self._total_bytes += len(body) - (row[0] if row else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def touch(self, key: str) -> None:
+        """
+        Marks an entry as fresh again, after the API confirmed (304 Not Modified) that it didn't change.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE responses SET stored_at = ?, last_access = ? WHERE key = ?", (now, now, key))
+
+    def _evict(self) -> None:
+        # some room is left, so the next puts don't evict again.
+        target = self.max_bytes * EVICTION_TARGET
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if self._total_bytes <= target:
+                break
+            keys.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        logging.info(f"{len(keys)} responses were evicted from the cache.")
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,75 @@
+"""
+Decoding of MeLi API payloads. When only some keys of the search results are needed, the rest are skipped: with msgspec
+(if installed) they are not even built while decoding, since results are decoded into typed structs that only declare
+those keys; otherwise, results are decoded with orjson (if installed) or json, and projected afterwards.
+"""
+import json
+from functools import lru_cache
+from typing import Any, Collection, Dict, FrozenSet, List, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def decoder_name(projected: bool = True) -> str:
+    """
+    :return: name of the library that decodes whole payloads (loads), or projected search results.
+    """
+    if projected and msgspec:
+        return "msgspec"
+    return "orjson" if orjson else "msgspec" if msgspec else "json"
+
+
+def loads(body: Union[bytes, str]) -> Any:
+    if orjson:
+        return orjson.loads(body)
+    if msgspec:
+        return msgspec.json.decode(body)
+    return json.loads(body)
+
+
+def project(objects: List[Dict[str, Any]], keys: Optional[Collection[str]]) -> List[Dict[str, Any]]:
+    """
+    Keeps only the given keys of every object (every key, if keys is None).
+    """
+    if keys is None:
+        return objects
+    return [{key: obj[key] for key in keys if key in obj} for obj in objects]
+
+
+@lru_cache(maxsize=16)
+def _search_decoder(keys: FrozenSet[str]):
+    # keys missing in a result are UNSET, so they are left out of its dict (as if it was decoded as a whole).
+    result = msgspec.defstruct("SearchResult", [(key, Any, msgspec.UNSET) for key in sorted(keys)])
+    payload = msgspec.defstruct("SearchPayload", [("results", List[result], [])])
+    return msgspec.json.Decoder(payload)
+
+
+def decode_search_results(body: bytes, keys: Optional[Collection[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Decodes the results of a search API response body.
+    :param keys: keys of the results that are needed. If None, every key is decoded.
+    """
+    if keys is None:
+        return loads(body)["results"]
+    if msgspec is None:
+        return project(loads(body)["results"], keys)
+
+    keys = frozenset(keys)
+    unset = msgspec.UNSET
+    decoded = []
+    for result in _search_decoder(keys).decode(body).results:
+        values = {}
+        for key in keys:
+            value = getattr(result, key)
+            if value is not unset:
+                values[key] = value
+        decoded.append(values)
+    return decoded
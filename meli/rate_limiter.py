@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+OK, THROTTLED, ERROR = "ok", "throttled", "error"
+
+
+class TokenBucket:
+    """
+    Caps the rate of requests: each request takes a token, tokens are refilled at rate tokens per second, and at most
+    burst tokens are accumulated. Requests without a token wait for the next one (tokens are reserved in order, so
+    waiting requests don't starve each other).
+    Attributes
+    ----------
+    rate: float
+        tokens (requests) per second.
+    burst: float
+        max amount of tokens accumulated while there are no requests.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting for it if needed.
+        :return: seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+_site_buckets: Dict[str, TokenBucket] = {}
+_site_buckets_lock = threading.Lock()
+
+
+def site_bucket(site: str, rate: float, burst: Optional[float] = None) -> TokenBucket:
+    """
+    Token bucket shared by every client of the same MeLi site in this process.
+    """
+    with _site_buckets_lock:
+        bucket = _site_buckets.get(site)
+        if bucket is None or bucket.rate != rate:
+            bucket = _site_buckets[site] = TokenBucket(rate, burst)
+        return bucket
+
+
+class AIMDLimiter:
+    """
+    Adaptive limit of the requests in flight to an endpoint (Additive Increase, Multiplicative Decrease). Every
+    successful response increases the limit by 1 / limit (so one more request in flight after a whole window of
+    successes), unless its smoothed latency grew over latency_tolerance times the baseline (the lowest latency
+    observed, slowly drifting up) by more than min_latency_growth seconds, which means the API is queueing requests.
+    Throttled (429) and failed (5xx or connection error) responses, as well as the latency growth, decrease the limit
+    multiplying it by backoff_ratio, at most once per round trip, so a burst of failures of requests sent together is a
+    single decrease.
+    Attributes
+    ----------
+    name: str
+        name of the endpoint (api_name of its time profiler).
+    limit: float
+        current limit of requests in flight.
+    min_limit: int
+    max_limit: int
+    backoff_ratio: float
+    latency_tolerance: float
+    min_latency_growth: float
+        latency growths below this amount of seconds are ignored (jitter of fast responses).
+    smoothing: float
+        weight of each latency in its exponentially weighted moving average.
+    """
+
+    def __init__(self, name: str, initial_limit: int, min_limit: int = 1, max_limit: int = 100,
+                 backoff_ratio: float = 0.5, latency_tolerance: float = 2.0, min_latency_growth: float = 0.05,
+                 smoothing: float = 0.2) -> None:
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.min_latency_growth = min_latency_growth
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        Waits until there is room for one more request in flight, and takes it.
+        :return: seconds waited.
+        """
+        t0 = time.monotonic()
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return time.monotonic() - t0
+
+    def _update_latency(self, latency: float) -> None:
+        if self.latency is None:
+            self.latency = self.baseline_latency = latency
+            return
+        self.latency += self.smoothing * (latency - self.latency)
+        # the baseline follows latency drops at once, and rises slowly (for instance, if the network got slower).
+        self.baseline_latency = min(latency, self.baseline_latency + 0.01 * (latency - self.baseline_latency))
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self.latency or 0.0):
+            return
+        self._last_decrease = now
+        self._set_limit(max(self.min_limit, self.limit * self.backoff_ratio), reason)
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        previous = int(self.limit)
+        self.limit = limit
+        if int(limit) > previous:
+            self.increases += 1
+            logging.debug(f"{self.name} concurrency limit: {previous} -> {int(limit)} ({reason}).")
+        elif int(limit) < previous:
+            self.decreases += 1
+            logging.info(f"{self.name} concurrency limit: {previous} -> {int(limit)} ({reason}).")
+
+    def release(self, latency: float, outcome: str = OK) -> None:
+        """
+        Frees the room taken by a request, and adapts the limit to its outcome.
+        :param latency: seconds the request took.
+        :param outcome: OK, THROTTLED or ERROR.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if outcome == THROTTLED:
+                self._decrease("throttled by the API")
+            elif outcome == ERROR:
+                self._decrease("request failed")
+            else:
+                self._update_latency(latency)
+                if self.latency > self.baseline_latency * self.latency_tolerance and \
+                        self.latency - self.baseline_latency > self.min_latency_growth:
+                    self._decrease(f"latency {round(self.latency, 3)}s over "
+                                   f"{self.latency_tolerance}x the baseline {round(self.baseline_latency, 3)}s")
+                elif self.limit < self.max_limit:
+                    self._set_limit(min(self.max_limit, self.limit + 1 / self.limit), "requests succeeded")
+            self._condition.notify_all()
@@ -0,0 +1,33 @@
+import os
+
+# database.db builds its engine when it's imported; tests use their own SQLite engines.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.mock_meli_api import MockMeliApi
+from database import Base
+import database.models  # noqa: F401 (registers the tables)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'etl.sqlite'}")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    session = sessionmaker(engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def mock_api():
+    with MockMeliApi(total_items=300) as api:
+        yield api
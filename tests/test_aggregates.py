@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytest
+
+from database.client import DatabaseClient
+from database.models import DailySellerSales, DailyPriceStats, DailyShippingMethods, Item
+from etl.loader import Loader
+
+QUERY = "Iphone 11"
+
+
+def _batch(first: int, amount: int):
+    items = [{"id": f"MLB{i}", "seller_id": i % 2, "title": f"{QUERY} {i}", "sold_quantity": i, "price": 100.0 * i,
+              "warranty": None} for i in range(first, first + amount)]
+    item_shipping = [{"item_id": item["id"], "shipping_method": "fulfillment" if i % 3 else ""}
+                     for i, item in enumerate(items, start=first)]
+    sellers = [{"seller_id": i, "completed_sales": 10 * i} for i in range(first, first + amount)]
+    return items, sellers, item_shipping
+
+
+def _aggregates(session):
+    sellers = {(r.day, r.seller_id): (r.items, r.sold_quantity) for r in session.query(DailySellerSales)}
+    prices = {r.day: (r.items, r.sold_quantity, r.price_sum, r.price_min, r.price_max)
+              for r in session.query(DailyPriceStats)}
+    shipping = {(r.day, r.shipping_method): r.items for r in session.query(DailyShippingMethods)}
+    return sellers, prices, shipping
+
+
+@pytest.mark.parametrize("upsert", [False, True])
+def test_aggregates_sum_the_loaded_batches(session, upsert):
+    loader = Loader(DatabaseClient(session), upsert=upsert, aggregates=True)
+    day = date(2022, 5, 1)
+    loader.load_batch(*_batch(1, 4), query=QUERY, day=day)
+    loader.load_batch(*_batch(5, 2), query=QUERY, day=day)
+
+    sellers, prices, shipping = _aggregates(session)
+    # items 1..6: seller 1 has 1, 3 and 5, seller 0 has 2, 4 and 6.
+    assert sellers == {(day, 1): (3, 9), (day, 0): (3, 12)}
+    assert prices == {day: (6, 21, 2100.0, 100.0, 600.0)}
+    assert shipping == {(day, "fulfillment"): 4, (day, ""): 2}
+
+
+def test_upserting_a_batch_again_does_not_count_it_twice(session):
+    loader = Loader(DatabaseClient(session), upsert=True, aggregates=True)
+    today = date.today()
+    loader.load_batch(*_batch(1, 4), query=QUERY)
+    expected = _aggregates(session)
+    loader.load_batch(*_batch(1, 4), query=QUERY)
+    assert _aggregates(session) == expected
+    assert expected[1][today][0] == 4
+
+    # only the new items of a batch are added.
+    loader.load_batch(*_batch(3, 3), query=QUERY)
+    assert _aggregates(session)[1][today][0] == 5
+
+
+def test_a_failed_insert_does_not_update_the_aggregates(session, monkeypatch):
+    database_client = DatabaseClient(session)
+    loader = Loader(database_client, aggregates=True)
+
+    def failing_insert_sellers(*args, **kwargs):
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(database_client, "insert_sellers", failing_insert_sellers)
+    with pytest.raises(RuntimeError):
+        loader.load_batch(*_batch(1, 4), query=QUERY)
+    assert session.query(Item).count() == 0
+    assert _aggregates(session) == ({}, {}, {})
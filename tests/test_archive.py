@@ -0,0 +1,47 @@
+import gzip
+import json
+import os
+
+from meli.api_client import MLApiClient
+from meli.archive import ResponseArchive, read_archive
+from meli.cache import ResponseCache
+
+
+def _body(i: int) -> bytes:
+    return json.dumps({"id": f"MLB{i:07d}", "title": f"Iphone 11 {i}", "price": 1000.0 + i,
+                       "attributes": [{"id": "BRAND", "value_name": "Apple"}]}).encode()
+
+
+def test_archive_is_readable_before_and_after_closing(tmp_path):
+    archive = ResponseArchive(str(tmp_path), "run")
+    for i in range(200):
+        archive.record("items_multiget", f"http://api/items/{i}", 200, _body(i))
+
+    # as if the process died: every recorded response can be read.
+    assert [r.json()["id"] for r in read_archive(archive.path)] == [f"MLB{i:07d}" for i in range(200)]
+    archive.close()
+    assert len(list(read_archive(archive.path))) == 200
+
+    # responses are compressed together, not one gzip member each.
+    lines = [json.dumps({"body": _body(i).decode()}).encode() for i in range(200)]
+    assert os.path.getsize(archive.path) < sum(len(gzip.compress(line)) for line in lines) / 3
+
+
+def test_closing_the_client_closes_its_archive_and_cache(tmp_path, mock_api):
+    archive = ResponseArchive(str(tmp_path), "run")
+    with MLApiClient(country_ml="MLB", api_url=mock_api.url, archive=archive,
+                     cache=ResponseCache(str(tmp_path / "cache.sqlite"))) as client:
+        client.get_currency_conv_rate(from_currency_id="BRL", to_currenc_id="USD")
+    assert archive._file.closed
+    # the stream was completed.
+    with gzip.open(archive.path) as file:
+        assert len(file.read().splitlines()) == archive.records == 1
+
+
+def test_recorded_search_responses_are_whole(tmp_path, mock_api):
+    archive = ResponseArchive(str(tmp_path), "run")
+    with MLApiClient(country_ml="MLB", api_url=mock_api.url, archive=archive) as client:
+        response = client.request_to_search_api("Iphone 11", exclude_seller_id=0, offset=0, limit=50,
+                                                attributes=["results"]).json()
+    [recorded] = read_archive(archive.path)
+    assert recorded.json() == response and "paging" in response and len(response["results"]) == 50
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from meli import cache as cache_module
+from meli.api_client import MLApiClient
+from meli.cache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # time of the cache entries, moved by the tests.
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def _client(mock_api, cache: ResponseCache) -> MLApiClient:
+    return MLApiClient(country_ml="MLB", api_url=mock_api.url, cache=cache)
+
+
+def test_fresh_entries_are_reused_without_requests(tmp_path, mock_api, clock):
+    with _client(mock_api, ResponseCache(str(tmp_path / "cache.sqlite"), ttls={"item_attributes": 60})) as client:
+        first = client.request_to_item_attributes_api("MLB1").json()
+        clock.now += 59
+        second = client.request_to_item_attributes_api("MLB1")
+    assert second.json() == first and second.from_cache
+    assert mock_api.requests == 1
+
+
+def test_expired_entries_are_revalidated(tmp_path, mock_api, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttls={"item_attributes": 60})
+    with _client(mock_api, cache) as client:
+        first = client.request_to_item_attributes_api("MLB1").json()
+        clock.now += 61
+        # If-None-Match with the stored ETag: the API answers 304, and the entry is fresh again.
+        revalidated = client.request_to_item_attributes_api("MLB1")
+        assert revalidated.status_code == 200 and revalidated.json() == first and revalidated.from_cache
+        assert (mock_api.requests, mock_api.not_modified) == (2, 1)
+        assert cache.get(client._cache_key(client.item_attributes_url + "MLB1")).stored_at == clock.now
+
+        clock.now += 59
+        client.request_to_item_attributes_api("MLB1")
+    assert mock_api.requests == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, mock_api, clock):
+    path = str(tmp_path / "cache.sqlite")
+    with _client(mock_api, ResponseCache(path, ttls={"item_attributes": 60}, max_bytes=500)) as client:
+        for i in range(15):
+            clock.now += 1
+            client.request_to_item_attributes_api(f"MLB{i}")
+            if i > 0:
+                # the first item stays the most recently used one.
+                clock.now += 1
+                client.request_to_item_attributes_api("MLB0")
+        url = client.item_attributes_url
+
+    cache = ResponseCache(path, ttls={"item_attributes": 60}, max_bytes=500)
+    stored = [row[0] for row in cache._conn.execute("SELECT key FROM responses ORDER BY last_access")]
+    assert cache._total_bytes <= 500 and 0 < len(stored) < 15
+    assert stored[-1] == url + "MLB0" and url + "MLB1" not in stored
+    cache.close()
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from database.models import EtlRun
+from etl.checkpoint import RunCheckpoint
+
+
+def test_unfinished_runs_of_the_database_day_are_resumed(engine, session):
+    session_factory = sessionmaker(engine)
+    checkpoint = RunCheckpoint.start(session_factory, "Iphone 11", exclude_seller_id=0, max_items=100)
+    checkpoint.batch_extracted([{"id": "MLB1"}], fetched=50, next_offset=50)
+
+    resumed = RunCheckpoint.start(session_factory, "Iphone 11", exclude_seller_id=0, max_items=100)
+    assert resumed.run_id == checkpoint.run_id and resumed.next_offset == 50
+    assert [items for _, items in resumed.pending_batches()] == [[{"id": "MLB1"}]]
+
+    # a run of the previous day is not resumed.
+    run = session.get(EtlRun, checkpoint.run_id)
+    run.created_at -= timedelta(days=1)
+    session.commit()
+    assert RunCheckpoint.start(session_factory, "Iphone 11", exclude_seller_id=0, max_items=100).run_id != run.rowid
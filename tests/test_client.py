@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from database.aggregates import BestSellerRankings
+from database.client import DatabaseClient
+from database.models import Item
+
+
+def test_current_day_is_the_one_of_the_database(session, monkeypatch):
+    database_client = DatabaseClient(session)
+    # as if the database was in a timezone where it's still yesterday.
+    database_time = datetime.now() - timedelta(days=1)
+    session.add_all([Item(id="MLB1", title="a", sold_quantity=1, price=1.0, created_at=database_time),
+                     Item(id="MLB2", title="b", sold_quantity=1, price=1.0, created_at=datetime.now())])
+    session.commit()
+    monkeypatch.setattr(database_client, "get_database_time", lambda: database_time)
+
+    assert database_client.current_day() == database_time.date()
+    assert database_client.get_current_day_item_ids() == ["MLB1"]
+    assert database_client.count_current_day_items() == 1
+
+
+def test_rankings_default_to_the_day_of_the_database(engine):
+    assert BestSellerRankings(sessionmaker(engine)).today() == DatabaseClient(sessionmaker(engine)()).current_day()
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from etl.daemon import EtlDaemon, ScheduledQuery
+
+
+class _FailingWarmEtl:
+    """
+    Stands in for a WarmEtl whose first refresh fails (for instance, the currency API returned an error).
+    """
+
+    def __init__(self) -> None:
+        self.refreshes = 0
+        self.rollbacks = 0
+        self.components = SimpleNamespace(database_client=SimpleNamespace(session_rollback=self._rollback))
+
+    def _rollback(self) -> None:
+        self.rollbacks += 1
+
+    def refresh(self) -> float:
+        self.refreshes += 1
+        if self.refreshes == 1:
+            raise KeyError("ratio")
+        return 1.0
+
+
+def test_a_failed_refresh_does_not_stop_the_daemon():
+    warm = _FailingWarmEtl()
+    scheduled = ScheduledQuery(query="Iphone 11", interval=0.0, max_items=10, exclude_seller_id=0)
+    runs = []
+
+    def run_query(s: ScheduledQuery) -> None:
+        runs.append(s.query)
+        daemon.stop()
+
+    daemon = EtlDaemon([scheduled], warm, run_query=run_query)
+    assert daemon.run() == 2
+    assert runs == ["Iphone 11"] and warm.rollbacks == 1 and daemon.running is None
+    assert scheduled.runs == 2 and scheduled.failures == 1
+    # the status is the one of the last run, which succeeded.
+    assert scheduled.last_error is None and scheduled.last_setup_ms == 1.0
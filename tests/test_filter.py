@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from database.client import DatabaseClient
+from etl.etl_factory import current_day_item_ids_index
+from etl.filter.condition import NotNewProduct, ItemAlreadyStored
+from etl.filter.filter import Filter
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_stats_are_exact_with_threads(compiled):
+    _filter = Filter(conditions=[ItemAlreadyStored(current_day_item_ids={"0"}), NotNewProduct()],
+                     reorder_every=7, compiled=compiled)
+    results = [{"id": str(i % 10), "condition": "used" if i % 3 else "new"} for i in range(1000)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        kept = sum(executor.map(lambda _: len(_filter.apply_to_all(results)), range(40)))
+
+    expected = [r for r in results if r["id"] != "0" and r["condition"] == "new"]
+    assert kept == 40 * len(expected)
+    # every result is rejected by one condition at most.
+    assert sum(stats.rejections for stats in _filter._stats) == 40 * (len(results) - len(expected))
+
+
+def test_item_index_is_rebuilt_if_it_does_not_match_the_database(session, tmp_path):
+    path = str(tmp_path / "items.idx")
+    database_client = DatabaseClient(session)
+    database_client.insert_items([{"id": "MLB1", "title": "a", "sold_quantity": 1, "price": 1.0}])
+    index = current_day_item_ids_index(database_client, path)
+    index.update(["MLB2", "MLB3"])  # stored by a load that was rolled back, or in a database that was dropped.
+    index.close()
+
+    index = current_day_item_ids_index(database_client, path)
+    assert "MLB1" in index and "MLB2" not in index and len(index) == 1
+    index.close()
+    # an index that matches the database is reused as it is.
+    assert not current_day_item_ids_index(database_client, path).is_new
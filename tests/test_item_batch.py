@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytest
+
+from database.client import DatabaseClient
+from etl.transformations.item_batch import ItemBatch, NumericColumn, StringColumn, CategoryColumn, ObjectColumn, \
+    build_column
+
+
+@pytest.mark.parametrize("values, column_type, typecode", [
+    ([1, None, 3], NumericColumn, "q"),
+    ([1.5, None, 3.0], NumericColumn, "d"),
+    ([1000, 1000.5, None, 999], NumericColumn, "d"),
+    ([2 ** 60, 0.5, 1.0], ObjectColumn, None),
+    ([None] * 8, CategoryColumn, None),
+    ([True, False] * 4, CategoryColumn, None),
+    ([True, False, None], ObjectColumn, None),
+    (["a", "b", None, "c"], StringColumn, None),
+    (["12 meses"] * 7 + [None], CategoryColumn, None),
+])
+def test_column_type_is_selected_by_the_values(values, column_type, typecode):
+    column = build_column(values)
+    assert type(column) is column_type
+    if typecode is not None:
+        assert column.values.typecode == typecode
+    assert [column[i] for i in range(len(values))] == values
+
+
+def test_values_keep_their_type():
+    # bools aren't read back as ints, and ints mixed with floats are read back as floats.
+    assert build_column([True, False] * 4)[0] is True
+    assert type(build_column([1000, 1000.5])[0]) is float
+
+
+def test_batch_round_trip():
+    records = [{"id": f"MLB{i}", "price": 1000 + i % 2 * 0.5, "sold_quantity": i if i % 3 else None,
+                "warranty": None if i % 4 else "12 meses", "shipping": ["fulfillment"] if i % 2 else [],
+                "seller": {"id": i}} for i in range(10)]
+    batch = ItemBatch.from_records(records)
+    assert len(batch) == 10 and list(batch) == batch[:] == [
+        {**r, "shipping": tuple(r["shipping"])} for r in records]
+    assert batch[-1] == batch[9] and batch[2:8:3] == [batch[2], batch[5]] and batch[20:] == []
+    with pytest.raises(IndexError):
+        batch[10]
+    assert list(batch.take([7, 1])) == [batch[7], batch[1]]
+    assert batch.column("id") == [r["id"] for r in records]
+    assert list(batch.drop(["seller"]))[0] == {k: v for k, v in batch[0].items() if k != "seller"}
+
+
+def test_aggregates_filter_compact_batches_by_index(session, monkeypatch):
+    day = date.today()
+    database_client = DatabaseClient(session)
+    database_client.insert_items([{"id": "MLB1", "title": "a", "sold_quantity": 1, "price": 1.0}])
+    items = ItemBatch.from_records([{"id": f"MLB{i}", "seller_id": i, "sold_quantity": i, "price": 10.0 * i}
+                                    for i in range(3)])
+    item_shipping = ItemBatch.from_records([{"item_id": f"MLB{i}", "shipping_method": "fulfillment"}
+                                            for i in range(3)])
+    taken = []
+    take = ItemBatch.take
+
+    def recorded_take(self, indices):
+        taken.append(indices)
+        return take(self, indices)
+
+    monkeypatch.setattr(ItemBatch, "take", recorded_take)
+    assert database_client.update_best_seller_aggregates(day, None, items, item_shipping) == 2
+    # the stored item is left out of both batches by index.
+    assert taken == [[0, 2], [0, 2]]
@@ -0,0 +1,50 @@
+import multiprocessing
+from collections import Counter
+from typing import List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.job_queue import JobQueue, DONE
+from database.models import EtlJob
+
+JOBS = 60
+WORKERS = 4
+
+
+def _claim_all(url: str, worker_id: str) -> List[int]:
+    engine = create_engine(url, connect_args={"timeout": 30})
+    queue = JobQueue(sessionmaker(engine)(), worker_id=worker_id)
+    claimed = []
+    job = queue.claim()
+    while job is not None:
+        claimed.append(job.rowid)
+        assert queue.complete(job.rowid, process_time=0.0)
+        job = queue.claim()
+    queue.session.close()
+    engine.dispose()
+    return claimed
+
+
+def test_each_job_is_claimed_once_by_concurrent_workers(engine, session):
+    JobQueue(session, worker_id="enqueuer").enqueue([f"query {i}" for i in range(JOBS)], max_items=10,
+                                                    exclude_seller_id=None)
+    url = str(engine.url)
+    with multiprocessing.get_context("spawn").Pool(WORKERS) as pool:
+        claims = pool.starmap(_claim_all, [(url, f"worker-{w}") for w in range(WORKERS)])
+
+    counts = Counter(rowid for claimed in claims for rowid in claimed)
+    assert len(counts) == JOBS and set(counts.values()) == {1}
+    assert {job.status for job in session.query(EtlJob)} == {DONE}
+
+
+def test_expired_leases_are_claimed_again(session):
+    queue = JobQueue(session, worker_id="dead", lease_seconds=-1.0)
+    queue.enqueue(["Iphone 11"], max_items=10, exclude_seller_id=None)
+    job = queue.claim()
+    assert job.lease_expires_at < queue._now()
+
+    job = JobQueue(session, worker_id="alive").claim()
+    assert job is not None and job.worker_id == "alive" and job.attempts == 2
+    # the worker whose lease expired doesn't hold the job anymore.
+    assert not queue.heartbeat(job.rowid)
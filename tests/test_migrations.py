@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from database.client import DatabaseClient
+from database.migrations import migrate_shipping_methods, migrate_unique_keys
+from database.models import ItemShipping, Seller
+from etl.transformations.transformations import ShippingMethods
+
+
+def _item_shipping(session):
+    return sorted((row.item_id, row.shipping_method) for row in session.query(ItemShipping))
+
+
+def test_items_without_shipping_method_are_upserted_once(session):
+    database_client = DatabaseClient(session)
+    item = ShippingMethods().apply({"id": "MLB1", "shipping": {"tags": []}})
+    rows = [{"item_id": item["id"], "shipping_method": method} for method in item["shipping"]]
+    for _ in range(2):
+        database_client.upsert_item_shipping(rows)
+    assert _item_shipping(session) == [("MLB1", "")]
+
+
+def test_null_shipping_methods_are_migrated(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.sqlite'}")
+    with engine.begin() as connection:
+        # item_shipping as created by older versions.
+        connection.execute(text("CREATE TABLE item_shipping (rowid INTEGER PRIMARY KEY, item_id VARCHAR(50) NOT NULL, "
+                                "shipping_method VARCHAR(50), date DATETIME DEFAULT (datetime('now', 'localtime')) "
+                                "NOT NULL, CONSTRAINT uq_item_shipping UNIQUE (item_id, shipping_method))"))
+        connection.execute(text("INSERT INTO item_shipping (item_id, shipping_method) VALUES ('MLB1', NULL), "
+                                "('MLB1', NULL), ('MLB2', NULL), ('MLB2', ''), ('MLB3', 'fulfillment')"))
+    Base.metadata.create_all(engine)
+    migrate_shipping_methods(engine)
+    # applying it again does nothing.
+    migrate_shipping_methods(engine)
+
+    column = next(c for c in inspect(engine).get_columns("item_shipping") if c["name"] == "shipping_method")
+    assert not column["nullable"]
+    session = sessionmaker(engine)()
+    assert _item_shipping(session) == [("MLB1", ""), ("MLB2", ""), ("MLB3", "fulfillment")]
+    DatabaseClient(session).upsert_item_shipping([{"item_id": "MLB1", "shipping_method": ""}])
+    assert len(_item_shipping(session)) == 3
+    session.close()
+    engine.dispose()
+
+
+def test_missing_unique_keys_are_added(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.sqlite'}")
+    with engine.begin() as connection:
+        # sellers as created by older versions, with a row loaded twice.
+        connection.execute(text("CREATE TABLE sellers (rowid INTEGER PRIMARY KEY, seller_id INTEGER, "
+                                "completed_sales INTEGER NOT NULL, date DATETIME DEFAULT (datetime('now', "
+                                "'localtime')) NOT NULL)"))
+        connection.execute(text("INSERT INTO sellers (seller_id, completed_sales) VALUES (1, 10), (1, 10), (2, 10)"))
+    Base.metadata.create_all(engine)
+    session = sessionmaker(engine)()
+    with pytest.raises(RuntimeError, match="lacks the unique key"):
+        DatabaseClient(session).upsert_sellers([{"seller_id": 1, "completed_sales": 10}])
+    session.rollback()
+
+    migrate_unique_keys(engine)
+    migrate_unique_keys(engine)
+    assert "uq_sellers_completed_sales" in {c["name"] for c in inspect(engine).get_unique_constraints("sellers")}
+    DatabaseClient(session).upsert_sellers([{"seller_id": 1, "completed_sales": 10}])
+    assert sorted((row.seller_id, row.completed_sales) for row in session.query(Seller)) == [(1, 10), (2, 10)]
+    session.close()
+    engine.dispose()
@@ -0,0 +1,41 @@
+import logging
+
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Item, Seller
+from etl.etl_factory import etl_components
+from etl.loader import Loader
+from etl.multi_query import MultiQueryRunner
+from tests.test_pipeline import QUERY, _first_new_items, _loaded_ids
+
+
+def _runner(components, engine) -> MultiQueryRunner:
+    return MultiQueryRunner(components.extractor, components.transformer, components.loader,
+                            session_factory=sessionmaker(engine), max_workers=2)
+
+
+def test_items_of_a_failed_query_are_found_again(engine, session, mock_api, monkeypatch):
+    components = etl_components(session, api_url=mock_api.url)
+    load_batch = Loader.load_batch
+
+    def failing_load_batch(*args, **kwargs):
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(Loader, "load_batch", failing_load_batch)
+    [report] = _runner(components, engine).run([QUERY], exclude_seller_id=0, max_items=50)
+    assert report.error == "database is gone"
+
+    monkeypatch.setattr(Loader, "load_batch", load_batch)
+    [report] = _runner(components, engine).run([QUERY], exclude_seller_id=0, max_items=50)
+    assert report.error is None
+    assert _loaded_ids(session) == _first_new_items(50)
+    assert session.query(Seller).count() == 50
+
+
+def test_filter_summary_is_logged_once(engine, session, mock_api, caplog):
+    components = etl_components(session, api_url=mock_api.url)
+    with caplog.at_level(logging.WARNING):
+        reports = _runner(components, engine).run([QUERY, "Galaxy S10"], exclude_seller_id=0, max_items=50)
+    assert [r.error for r in reports] == [None, None]
+    assert session.query(Item).count() == 100
+    assert len([r for r in caplog.records if "results were filtered" in r.getMessage()]) == 1
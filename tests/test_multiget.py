@@ -0,0 +1,42 @@
+import json
+from typing import List, Dict, Any
+
+from requests import Response
+
+from etl.extractor import Extractor
+from meli.api_client import match_multiget_entries
+
+
+def _entry(item_id: str, warranty: str = "6 meses") -> Dict[str, Any]:
+    return {"code": 200, "body": {"id": item_id, "warranty": warranty}}
+
+
+def test_entries_are_matched_by_id():
+    entries = [_entry("B"), _entry("A"), _entry("X")]
+    matched = match_multiget_entries(["A", "B", "C"], entries)
+    assert matched == {"A": entries[1], "B": entries[0]}
+
+
+def test_error_entries_are_matched_by_position():
+    error = {"code": 404, "body": {"message": "Item not found", "error": "not_found"}}
+    assert match_multiget_entries(["A", "B"], [_entry("A"), error]) == {"A": _entry("A"), "B": error}
+    # without one entry per id, the item of an error entry is unknown.
+    assert match_multiget_entries(["A", "B", "C"], [_entry("A"), error]) == {"A": _entry("A")}
+
+
+class _MultigetClient:
+    def __init__(self, entries: List[Dict[str, Any]]) -> None:
+        self.entries = entries
+
+    def request_to_items_multiget_api(self, item_ids: List[str], attributes: List[str]) -> Response:
+        resp = Response()
+        resp.status_code = 200
+        resp._content = json.dumps(self.entries).encode()
+        return resp
+
+
+def test_items_missing_from_the_response_are_left_out():
+    client = _MultigetClient([_entry("B", "12 meses"), {"code": 500, "body": None}, _entry("A")])
+    extractor = Extractor(client, _filter=None)
+    results = extractor._get_warranty_for_all([{"id": "A"}, {"id": "B"}, {"id": "C"}, {"id": "D"}])
+    assert results == [{"id": "A", "warranty": "6 meses"}, {"id": "B", "warranty": "12 meses"}]
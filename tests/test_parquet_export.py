@@ -0,0 +1,46 @@
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from database import parquet_export
+from database.client import DatabaseClient
+from database.models import Item
+from database.parquet_export import ParquetExporter
+
+pyarrow = pytest.importorskip("pyarrow")
+
+
+def test_export_again_removes_the_days_without_rows(engine, session, tmp_path):
+    days = [date(2022, 5, 1), date(2022, 5, 2)]
+    session.add_all([Item(id=f"MLB{day.day}{i}", title="a", sold_quantity=1, price=1.0,
+                          created_at=datetime.combine(day, datetime.min.time()).replace(hour=i + 1))
+                     for day in days for i in range(3)])
+    session.commit()
+    output_dir = str(tmp_path / "export")
+    exporter = ParquetExporter(engine, output_dir)
+    assert exporter.export_table("items", since=days[0], until=date(2022, 5, 3)) == (2, 6)
+
+    session.query(Item).filter(Item.created_at >= datetime(2022, 5, 2)).delete()
+    session.commit()
+    assert exporter.export_table("items", since=days[0], until=date(2022, 5, 3)) == (1, 3)
+    assert os.listdir(os.path.join(output_dir, "items")) == ["day=2022-05-01"]
+
+
+def test_current_day_of_the_database_is_not_exported(engine, session, tmp_path, monkeypatch):
+    database_day = DatabaseClient(session).current_day()
+    session.add_all([Item(id=f"MLB{i}", title="a", sold_quantity=1, price=1.0,
+                          created_at=datetime.combine(database_day - timedelta(days=i), datetime.min.time()))
+                     for i in range(2)])
+    session.commit()
+
+    class HostDate(date):
+        @classmethod
+        def today(cls):
+            # the host is a day ahead of the database (for instance, in another timezone).
+            return database_day + timedelta(days=1)
+
+    monkeypatch.setattr(parquet_export, "date", HostDate)
+    exporter = ParquetExporter(engine, str(tmp_path / "export"))
+    assert exporter.export_table("items", since=database_day - timedelta(days=1)) == (1, 1)
+    assert exporter._read_state()["items"] == (database_day - timedelta(days=1)).isoformat()
@@ -0,0 +1,56 @@
+from typing import Set
+
+import pytest
+
+from benchmarks.mock_meli_api import synthetic_result
+from database.models import Item, Seller
+from etl.etl_factory import etl_components
+from etl.pipeline import StreamingPipeline
+
+QUERY = "Iphone 11"
+
+
+def _first_new_items(amount: int) -> Set[str]:
+    results = (synthetic_result(QUERY, i) for i in range(10 * amount))
+    return set([r["id"] for r in results if r["condition"] == "new"][:amount])
+
+
+def _loaded_ids(session) -> Set[str]:
+    return {row.id for row in session.query(Item.id)}
+
+
+def _run(components, max_items: int = 120) -> None:
+    StreamingPipeline(components.extractor, components.transformer, components.loader, batch_size=40).run(
+        query=QUERY, exclude_seller_id=0, max_items=max_items)
+
+
+def test_items_of_a_failed_load_are_found_again(session, mock_api):
+    components = etl_components(session, api_url=mock_api.url)
+    load_batch = components.loader.load_batch
+    calls = []
+
+    def failing_load_batch(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("database is gone")
+        load_batch(*args, **kwargs)
+
+    components.loader.load_batch = failing_load_batch
+    with pytest.raises(RuntimeError):
+        _run(components)
+    loaded = session.query(Item).count()
+    assert 0 < loaded < 120
+
+    # the items (and sellers) registered by the failed run, but not loaded, are found again by the next one.
+    components.loader.load_batch = load_batch
+    _run(components)
+    assert _loaded_ids(session) == _first_new_items(loaded + 120)
+    assert session.query(Seller).count() == loaded + 120
+
+
+def test_items_left_out_of_a_run_are_released(session, mock_api):
+    components = etl_components(session, api_url=mock_api.url)
+    _run(components, max_items=30)
+    # the rest of the last search page was registered, but left out by max_items.
+    _run(components, max_items=30)
+    assert _loaded_ids(session) == _first_new_items(60)
@@ -0,0 +1,19 @@
+import json
+
+from benchmarks import pipeline_benchmark
+
+
+def test_streaming_scenario_against_the_mock_api(tmp_path, capsys):
+    output = str(tmp_path / "results.json")
+    options = dict(concurrency=None, batch_size=40, columnar=False, upsert=False, full_payloads=False,
+                   compact_items=False, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, payloads=None)
+    pipeline_benchmark.main([100], [f"sqlite:///{tmp_path / 'bench.sqlite'}"], ["streaming"], options=options,
+                            output=output, compare=output)
+
+    with open(output) as file:
+        [result] = json.load(file)["results"]
+    assert "error" not in result
+    assert result["scenario"] == "streaming" and result["database"] == "sqlite"
+    assert result["items"] == 100 and result["items_per_second"] > 0
+    # compared with itself.
+    assert "1.00x" in capsys.readouterr().out
@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from meli import rate_limiter
+from meli.rate_limiter import AIMDLimiter, TokenBucket, OK, THROTTLED, ERROR
+
+
+class FakeClock:
+    """
+    Replaces the time module of meli.rate_limiter: time only moves when the test advances it, and sleeps are recorded
+    instead of waited.
+    """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        with self._lock:
+            self.sleeps.append(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def _request(limiter: AIMDLimiter, latency: float, outcome: str = OK) -> None:
+    limiter.acquire()
+    limiter.release(latency, outcome)
+
+
+def test_limit_decreases_once_per_round_trip_when_latency_rises(clock):
+    limiter = AIMDLimiter("search", initial_limit=16, max_limit=16)
+    for _ in range(10):
+        _request(limiter, 0.1)
+    assert limiter.limit == 16 and limiter.decreases == 0
+
+    # responses of requests sent together: the latency grows over 2x the baseline, but the limit is halved once.
+    for _ in range(20):
+        _request(limiter, 1.0)
+    assert limiter.limit == 8 and limiter.decreases == 1
+
+    # a round trip later (the smoothed latency is under 1s), the latency is still high.
+    assert limiter.latency < 1.0
+    clock.now += 1.0
+    _request(limiter, 1.0)
+    assert limiter.limit == 4 and limiter.decreases == 2
+
+
+def test_limit_increases_with_successes(clock):
+    limiter = AIMDLimiter("search", initial_limit=4)
+    # about one more request in flight after a whole window of successes.
+    for _ in range(4):
+        _request(limiter, 0.1)
+    assert int(limiter.limit) == 4
+    _request(limiter, 0.1)
+    assert int(limiter.limit) == 5 and limiter.increases == 1
+
+
+@pytest.mark.parametrize("outcome", [THROTTLED, ERROR])
+def test_limit_never_goes_below_one(clock, outcome):
+    limiter = AIMDLimiter("search", initial_limit=8)
+    for _ in range(10):
+        clock.now += 1.0
+        _request(limiter, 0.1, outcome)
+    assert limiter.limit == 1 and limiter.decreases == 3
+    # there is still room for a request in flight.
+    assert limiter.acquire() == 0.0
+
+
+def test_shared_bucket_does_not_exceed_its_rate(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        waits = list(executor.map(lambda _: bucket.acquire(), range(40)))
+
+    # every request got its own token: the first burst ones at once, then one every 1 / rate seconds.
+    assert sorted(waits) == pytest.approx([0.0] * 5 + [(k + 1) / 10 for k in range(35)])
+    assert sorted(clock.sleeps) == pytest.approx(sorted(waits)[5:])
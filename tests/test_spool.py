@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from database.client import DatabaseClient
+from database.models import Item, Seller
+from database.spool import Spool
+from etl.etl_factory import etl_components
+from etl.loader import Loader
+from etl.pipeline import StreamingPipeline
+
+
+def _spool_batches(spool: Spool, amount: int) -> None:
+    for b in range(amount):
+        items = [{"id": f"MLB{b}{i}", "title": "a", "sold_quantity": 1, "price": 1.0} for i in range(3)]
+        sellers = [{"seller_id": b, "completed_sales": 10}]
+        DatabaseClient.spool_batch(spool, items, [], sellers)
+
+
+def test_spool_is_drained_after_a_partial_failure(session, tmp_path):
+    spool = Spool(str(tmp_path / "spool"))
+    _spool_batches(spool, 3)
+    database_client = DatabaseClient(session)
+    loader = Loader(database_client=database_client, spool=spool)
+    load_spooled_batch = database_client.load_spooled_batch
+    calls = []
+
+    def failing_load_spooled_batch(batch_path, chunk_size=1000):
+        calls.append(batch_path)
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("database is gone"))
+        load_spooled_batch(batch_path, chunk_size)
+
+    database_client.load_spooled_batch = failing_load_spooled_batch
+    pending = spool.pending()
+    assert loader.drain_spool() == 1
+    # the batch that failed, and the following one, are kept in order.
+    assert spool.pending() == pending[1:]
+    assert {row.id for row in session.query(Item.id)} == {"MLB00", "MLB01", "MLB02"}
+
+    assert loader.drain_spool() == 2
+    assert spool.pending() == []
+    assert session.query(Item).count() == 9 and session.query(Seller).count() == 3
+    # a drained spool is left as it is.
+    assert loader.drain_spool() == 0
+
+
+def test_batches_are_spooled_when_the_database_is_unreachable(engine, tmp_path, mock_api):
+    spool_dir = str(tmp_path / "spool")
+    unreachable = create_engine(f"sqlite:///{tmp_path / 'missing' / 'etl.sqlite'}")
+    components = etl_components(sessionmaker(unreachable)(), api_url=mock_api.url, spool_dir=spool_dir)
+    StreamingPipeline(components.extractor, components.transformer, components.loader, batch_size=20).run(
+        query="Iphone 11", exclude_seller_id=0, max_items=40)
+    assert len(Spool(spool_dir).pending()) == 2
+
+    # the next run, with the database back, loads them.
+    session = sessionmaker(engine)()
+    assert Loader(database_client=DatabaseClient(session), spool=Spool(spool_dir)).drain_spool() == 2
+    assert session.query(Item).count() == 40
+    session.close()
+
+
+class _MysqlSession:
+    """
+    Session of a MySQL connection that refuses LOAD DATA LOCAL INFILE (or loses the connection), recording the
+    executed statements.
+    """
+
+    def __init__(self, error_code: int) -> None:
+        self.error_code = error_code
+        self.statements = []
+
+    def get_bind(self):
+        return SimpleNamespace(dialect=mysql.dialect())
+
+    def execute(self, stmt, params=None):
+        self.statements.append(str(stmt))
+        if str(stmt).startswith("LOAD DATA"):
+            raise OperationalError(str(stmt), params, Exception(self.error_code, "local infile refused"))
+
+    def commit(self):
+        pass
+
+
+@pytest.mark.parametrize("error_code", [1148, 3948, 2068])
+def test_spooled_batches_are_upserted_if_load_data_is_refused(tmp_path, error_code):
+    spool = Spool(str(tmp_path / "spool"))
+    _spool_batches(spool, 2)
+    session = _MysqlSession(error_code)
+    database_client = DatabaseClient(session)
+    upserted = []
+    database_client._partitioned = lambda table: False
+    database_client._check_unique_key = lambda table, keys: None
+    database_client._upsert = lambda model, objects, *args: upserted.extend(objects)
+
+    for batch_path in spool.pending():
+        database_client.merge_spooled_sellers(Spool.table_file(batch_path, Seller.__tablename__))
+    assert [s["seller_id"] for s in upserted] == [0, 1]
+    # LOAD DATA is only tried once.
+    assert sum(s.startswith("LOAD DATA") for s in session.statements) == 1
+
+
+def test_a_lost_connection_is_not_a_refused_load_data(tmp_path):
+    spool = Spool(str(tmp_path / "spool"))
+    _spool_batches(spool, 1)
+    database_client = DatabaseClient(_MysqlSession(2013))
+    database_client._partitioned = lambda table: False
+    database_client._check_unique_key = lambda table, keys: None
+    with pytest.raises(OperationalError):
+        database_client.merge_spooled_sellers(Spool.table_file(spool.pending()[0], Seller.__tablename__))
@@ -0,0 +1,35 @@
+import copy
+
+import pytest
+
+from benchmarks.mock_meli_api import synthetic_result, CURRENCY_RATIO
+from etl.pipeline_spec import PipelineSpec
+
+
+def _results(amount: int):
+    results = [synthetic_result("Iphone 11", i) for i in range(amount)]
+    for i, result in enumerate(results):
+        result["warranty"] = "Sem garantia" if i % 4 == 0 else "12 meses"
+    return results
+
+
+def _run(compiled: bool, results, compact: bool = False):
+    # the same items and sellers are stored for both runs.
+    state = {"current_day_item_ids": {results[3]["id"], results[10]["id"]}, "seller_data": {(1005, 5 * 7)},
+             "currency_factor": CURRENCY_RATIO}
+    spec = PipelineSpec.from_dict({"compiled": compiled})
+    item_filter = spec.build_item_filter(state)
+    transformer = spec.build_transformer(state, sellers_filter=spec.build_sellers_filter(state),
+                                         item_keys=item_filter.input_keys(), compact=compact)
+    items = item_filter.apply_to_all(copy.deepcopy(results))
+    products, item_shipping, sellers = transformer.transform(items)
+    return list(products), list(item_shipping), sellers
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_compiled_and_interpreted_pipelines_give_the_same_output(compact):
+    results = _results(200)
+    compiled = _run(True, results, compact=compact)
+    assert compiled == _run(False, results, compact=compact)
+    products, item_shipping, sellers = compiled
+    assert 0 < len(products) < len(results) and item_shipping and sellers
@@ -1,13 +1,13 @@
 import logging
 import time
-from datetime import datetime
 from functools import wraps
 from typing import List, Type, Callable, Any
 
 from requests import RequestException, Response
 
 from utils.exceptions import ResultsNotFoundException
-from utils.time_profilers import TimeProfilerBase, TimeProfilerMetrics
+from utils.time_profilers import TimeProfilerBase
+from utils.tracing import span
 
 
 def handle_error(f):
@@ -33,15 +33,22 @@ def _time_profiling(time_profiler: Type[TimeProfilerBase]):
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kws):
-            t0 = time.time()
-            resp = f(*args, **kws)
-            request_time = time.time() - t0
+            with span(f"{time_profiler.category}:{time_profiler.name()}") as s:
+                t0 = time.time()
+                resp = f(*args, **kws)
+                request_time = time.time() - t0
+                if isinstance(resp, Response):
+                    # non-200 responses are not measured by the profiler, but they are traced.
+                    s.set("status_code", resp.status_code)
+                    s.set("from_cache", getattr(resp, "from_cache", False))
+            if getattr(resp, "from_cache", False):
+                # no request was sent.
+                return resp
             if isinstance(resp, Response) and resp.status_code != 200:
                 logging.warning("Couldn't measure api request time")
                 return resp
                 #raise RequestException
-            metrics = TimeProfilerMetrics(request_time=request_time, date=datetime.now())
-            time_profiler.metrics.append(metrics)
+            time_profiler.record(request_time)
             return resp
 
         return wrapper
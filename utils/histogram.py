@@ -0,0 +1,85 @@
+import math
+import threading
+from array import array
+from typing import Dict, Optional
+
+# values are recorded in logarithmic buckets of PRECISION relative width, between MIN_VALUE and MAX_VALUE seconds.
+MIN_VALUE = 1e-6
+MAX_VALUE = 3600.0
+PRECISION = 0.01
+
+_LOG_BASE = math.log1p(PRECISION)
+_BUCKETS = int(math.ceil(math.log(MAX_VALUE / MIN_VALUE) / _LOG_BASE)) + 2
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations (seconds) with fixed memory, no matter the amount of recorded values: values are counted in
+    logarithmic buckets, so every quantile is known within PRECISION relative error (like an HDR histogram). Values
+    out of [MIN_VALUE, MAX_VALUE] are counted in the first or last bucket, but max and mean are exact. It can be
+    shared by several threads.
+    """
+
+    def __init__(self) -> None:
+        self._counts = array("Q", bytes(8 * _BUCKETS))
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max: Optional[float] = None
+
+    @staticmethod
+    def _bucket(value: float) -> int:
+        if value <= MIN_VALUE:
+            return 0
+        return min(_BUCKETS - 1, int(math.log(value / MIN_VALUE) / _LOG_BASE) + 1)
+
+    @staticmethod
+    def _bucket_value(bucket: int) -> float:
+        # middle of the bucket, so the relative error is at most PRECISION / 2.
+        if bucket == 0:
+            return MIN_VALUE
+        return MIN_VALUE * math.exp((bucket - 0.5) * _LOG_BASE)
+
+    def record(self, value: float) -> None:
+        bucket = self._bucket(value)
+        with self._lock:
+            self._counts[bucket] += 1
+            self.count += 1
+            self.total += value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            return self._quantile(q)
+
+    def _quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = max(1, int(math.ceil(q * self.count)))
+        seen = 0
+        for bucket, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._bucket_value(bucket), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """
+        :return: count, mean, p50, p90, p99 and max of the recorded values.
+        """
+        with self._lock:
+            return {"count": self.count,
+                    "mean": self.total / self.count if self.count else None,
+                    "p50": self._quantile(0.5),
+                    "p90": self._quantile(0.9),
+                    "p99": self._quantile(0.99),
+                    "max": self.max}
+
+    def reset(self) -> None:
+        with self._lock:
+            for i in range(_BUCKETS):
+                self._counts[i] = 0
+            self.count = 0
+            self.total = 0.0
+            self.max = None
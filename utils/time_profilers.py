@@ -1,6 +1,35 @@
+import os
+import threading
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from utils.histogram import LatencyHistogram
+
+_counters_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_run_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+
+
+def start_run(run_id: Optional[str] = None) -> str:
+    """
+    Sets the label of the run whose metrics are being measured (by default, its start time and process id).
+    """
+    global _run_id
+    _run_id = run_id or f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    return _run_id
+
+
+def current_run_id() -> str:
+    return _run_id
+
+
+def set_raw_metrics(raw: bool) -> None:
+    """
+    If raw, every measure is also kept (and stored as a row), besides being recorded in the profiler histogram.
+    Useful for debugging, but the memory used grows with the amount of measures.
+    """
+    TimeProfilerBase.raw_metrics = raw
 
 
 @dataclass
@@ -10,16 +39,67 @@ class TimeProfilerMetrics:
 
 
 class TimeProfilerBase:
+    """
+    Measures are recorded in a fixed memory histogram (see summary_to_json). In raw mode (see set_raw_metrics) or for
+    profilers with keep_raw, each measure is also kept in metrics.
+    """
+    category: str = ""
+    keep_raw: bool = False
+    raw_metrics: bool = False
     metrics: List[TimeProfilerMetrics]
 
+    @classmethod
+    def name(cls) -> str:
+        ...
+
     @classmethod
     def to_json(cls) -> List[Dict[str, Any]]:
         ...
 
+    @classmethod
+    def histogram(cls) -> LatencyHistogram:
+        histogram = cls.__dict__.get("_histogram")
+        if histogram is None:
+            with _metrics_lock:
+                histogram = cls.__dict__.get("_histogram")
+                if histogram is None:
+                    histogram = LatencyHistogram()
+                    cls._histogram = histogram
+        return histogram
+
+    @classmethod
+    def record(cls, measure: float, date: Optional[datetime] = None) -> None:
+        cls.histogram().record(measure)
+        if cls.raw_metrics or cls.keep_raw:
+            with _metrics_lock:
+                cls.metrics.append(TimeProfilerMetrics(request_time=measure, date=date or datetime.now()))
+
+    @classmethod
+    def summary_to_json(cls) -> List[Dict[str, Any]]:
+        summary = cls.histogram().summary()
+        if not summary["count"]:
+            return []
+        return [{"run_id": _run_id, "date": datetime.now(), "category": cls.category, "name": cls.name(), **summary}]
+
+    @classmethod
+    def reset(cls) -> None:
+        with _metrics_lock:
+            cls.metrics.clear()
+        cls.histogram().reset()
+
 
 class APIRequestTimeProfilerBase(TimeProfilerBase):
+    """
+    Besides request times, it keeps named counters related to the api requests (retries, connection pool hits, ...).
+    """
+    category: str = "request"
     api_name: str = ""
     metrics: List[TimeProfilerMetrics]
+    counters: Dict[str, int]
+
+    @classmethod
+    def name(cls) -> str:
+        return cls.api_name
 
     @classmethod
     def to_json(cls) -> List[Dict[str, Any]]:
@@ -28,11 +108,44 @@ class APIRequestTimeProfilerBase(TimeProfilerBase):
                                    "request_time": m.request_time},
                         cls.metrics))
 
+    @classmethod
+    def increment(cls, counter_name: str, value: int = 1) -> None:
+        with _counters_lock:
+            cls.counters[counter_name] = cls.counters.get(counter_name, 0) + value
+
+    @classmethod
+    def set_counter(cls, counter_name: str, value: int) -> None:
+        """
+        Sets the value of a counter that is a level (for instance, the current concurrency limit), instead of a count.
+        """
+        with _counters_lock:
+            cls.counters[counter_name] = value
+
+    @classmethod
+    def reset(cls) -> None:
+        super().reset()
+        with _counters_lock:
+            cls.counters.clear()
+
+    @classmethod
+    def counters_to_json(cls) -> List[Dict[str, Any]]:
+        date = datetime.now()
+        with _counters_lock:
+            return [{"date": date,
+                     "api_name": cls.api_name,
+                     "counter_name": counter_name,
+                     "value": value} for counter_name, value in cls.counters.items()]
+
 
 class DBInsertTimeProfilerBase(TimeProfilerBase):
+    category: str = "database"
     table: str = ""
     metrics: List[TimeProfilerMetrics]
 
+    @classmethod
+    def name(cls) -> str:
+        return cls.table
+
     @classmethod
     def to_json(cls) -> List[Dict[str, Any]]:
         return list(map(lambda m: {"date": m.date,
@@ -42,9 +155,16 @@ class DBInsertTimeProfilerBase(TimeProfilerBase):
 
 
 class ProcessTimeProfilerBase(TimeProfilerBase):
+    category: str = "process"
+    # a few measures per run (one per stage, or batch), always stored as rows.
+    keep_raw: bool = True
     process: str = ""
     metrics: List[TimeProfilerMetrics]
 
+    @classmethod
+    def name(cls) -> str:
+        return cls.process
+
     @classmethod
     def to_json(cls) -> List[Dict[str, Any]]:
         return list(map(lambda m: {"date": m.date,
@@ -56,16 +176,31 @@ class ProcessTimeProfilerBase(TimeProfilerBase):
 class ConverterApiTimeProfiler(APIRequestTimeProfilerBase):
     api_name: str = "currency_coverter"
     metrics: List[TimeProfilerMetrics] = []
+    counters: Dict[str, int] = {}
 
 
 class SearchApiTimeProfiler(APIRequestTimeProfilerBase):
     api_name: str = "search"
     metrics: List[TimeProfilerMetrics] = []
+    counters: Dict[str, int] = {}
 
 
 class AttributesItemApiTimeProfiler(APIRequestTimeProfilerBase):
     api_name: str = "item_attributes"
     metrics: List[TimeProfilerMetrics] = []
+    counters: Dict[str, int] = {}
+
+
+class ItemsMultigetApiTimeProfiler(APIRequestTimeProfilerBase):
+    api_name: str = "items_multiget"
+    metrics: List[TimeProfilerMetrics] = []
+    counters: Dict[str, int] = {}
+
+
+class HttpConnectionPoolProfiler(APIRequestTimeProfilerBase):
+    api_name: str = "http_pool"
+    metrics: List[TimeProfilerMetrics] = []
+    counters: Dict[str, int] = {}
 
 
 class InsertItemsTimeProfiler(DBInsertTimeProfilerBase):
@@ -83,6 +218,11 @@ class InsertSellersTimeProfiler(DBInsertTimeProfilerBase):
     metrics: List[TimeProfilerMetrics] = []
 
 
+class UpdateAggregatesTimeProfiler(DBInsertTimeProfilerBase):
+    table: str = "best_seller_aggregates"
+    metrics: List[TimeProfilerMetrics] = []
+
+
 class ExtractTimeProfiler(ProcessTimeProfilerBase):
     process: str = "extract"
     metrics: List[TimeProfilerMetrics] = []
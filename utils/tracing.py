@@ -0,0 +1,157 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+DEFAULT_MAX_SPANS = 1_000_000
+
+
+class Span:
+    """
+    Timed operation of a trace (run, stage, batch, request...). Spans opened while another one is open (in the same
+    context, see propagate) are its children. Attributes can be added with set while the span is open.
+    """
+    __slots__ = ("tracer", "name", "attributes", "span_id", "parent_id", "thread_id", "start", "end", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = 0
+        self.parent_id = 0
+        self.thread_id = 0
+        self.start = 0
+        self.end = 0
+        self._token = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else 0
+        self.span_id = next(self.tracer._ids)
+        self.thread_id = threading.get_ident()
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.end = time.perf_counter_ns()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer._finish(self)
+
+
+class _NoopSpan:
+    """
+    Span returned while tracing is disabled: it records nothing, so instrumented code costs almost nothing.
+    """
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Collects the finished spans of the process, to be exported in Chrome trace format (it can be opened with
+    chrome://tracing or https://ui.perfetto.dev). Disabled by default. At most max_spans spans are kept (the
+    following ones are counted as dropped), so memory is bounded.
+    """
+
+    def __init__(self, max_spans: int = DEFAULT_MAX_SPANS) -> None:
+        self.enabled = False
+        self.max_spans = max_spans
+        self.dropped = 0
+        self._spans: List[Span] = []
+        self._thread_names: Dict[int, str] = {}
+        self._ids = itertools.count(1)
+        self._origin = time.perf_counter_ns()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        self._spans, self._thread_names, self.dropped = [], {}, 0
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name: str, **attributes: Any) -> Any:
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def _finish(self, span: Span) -> None:
+        if len(self._spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        if span.thread_id not in self._thread_names:
+            self._thread_names[span.thread_id] = threading.current_thread().name
+        self._spans.append(span)
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                         "args": {"name": name}} for tid, name in self._thread_names.items()]
+        for span in list(self._spans):
+            args = {key: value if isinstance(value, (int, float, str, bool)) or value is None else str(value)
+                    for key, value in span.attributes.items()}
+            args["span_id"], args["parent_id"] = span.span_id, span.parent_id
+            events.append({"name": span.name, "cat": span.name.split(":")[0], "ph": "X", "pid": pid,
+                           "tid": span.thread_id, "ts": (span.start - self._origin) / 1000,
+                           "dur": (span.end - span.start) / 1000, "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"spans": len(self._spans), "dropped_spans": self.dropped}}
+
+    def export(self, path: str) -> Tuple[int, int]:
+        """
+        Writes the spans collected so far into a Chrome trace JSON file.
+        :return: amount of spans written and dropped.
+        """
+        with open(path, "w") as file:
+            json.dump(self.to_chrome_trace(), file)
+        return len(self._spans), self.dropped
+
+
+tracer = Tracer()
+
+
+def span(name: str, **attributes: Any) -> Any:
+    """
+    Opens a span of the process tracer: `with span("search page", offset=0) as s: ... s.set("status_code", 200)`.
+    """
+    return tracer.span(name, **attributes)
+
+
+def propagate(function: Callable) -> Callable:
+    """
+    Wraps a function that will run in another thread (thread pools, stage threads...), so the spans it opens are
+    children of the span that is open now.
+    """
+    if not tracer.enabled:
+        return function
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        # each call gets its own copy, since a context can't be entered by two threads at the same time.
+        return context.copy().run(function, *args, **kwargs)
+
+    return wrapper
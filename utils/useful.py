@@ -1,6 +1,6 @@
 import argparse
-from functools import reduce
-from typing import List, Dict, Any
+from itertools import chain
+from typing import List, Dict, Any, Iterator, Sequence
 
 from requests import Response, RequestException
 
@@ -10,11 +10,19 @@ def check_status_response(response: Response) -> None:
         raise RequestException(f"status code: {response.status_code}. Detail: {response.json()}")
 
 
-flat_map = lambda f, xs: reduce(lambda a, b: a + b, map(f, xs))
+flat_map = lambda f, xs: list(chain.from_iterable(map(f, xs)))
 
 
 def drop_repeated_dicts(object: List[Dict[str, Any]]):
-    return [dict(s) for s in set(tuple(x.items()) for x in object)]
+    unique = {}
+    for x in object:
+        unique.setdefault(tuple(x.items()), x)
+    return list(unique.values())
+
+
+def chunked(xs: Sequence[Any], size: int) -> Iterator[Sequence[Any]]:
+    for i in range(0, len(xs), size):
+        yield xs[i:i + size]
 
 
 def str2bool(v):